@@ -0,0 +1,152 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Campos de Seleção com Busca Remota (AJAX) do Painel de Administração
+################################################################################
+
+
+from flask_admin._compat import as_unicode
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from flask_admin.model.ajax import DEFAULT_PAGE_SIZE
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from .. import db
+from ..models import Usuario, Bloco, Ambiente, Equipamento, Manutencao, Conta
+
+
+########## Carregador de Modelos ##########
+
+
+# Os campos de seleção de modelos com muitos registros (equipamentos, manutenções,
+# ambientes, ...) não carregam a tabela inteira ao renderizar o formulário: as
+# opções são buscadas conforme o usuário digita (rota "ajax/lookup" da view),
+# uma página por vez. As colunas de texto são buscadas por trecho (ILIKE
+# '%termo%', atendido pelos índices de trigramas) e as numéricas por igualdade.
+# Cada view que usa um carregador deve registrá-lo em "form_ajax_refs".
+
+
+class CarregadorAjax(QueryAjaxModelLoader):
+    # Inicialização
+    # Opções adicionais:
+    # - campos_numericos: colunas inteiras comparadas por igualdade
+    # - filtros: condições fixas (expressões do SQLAlchemy)
+    # - opcoes: opções da consulta (ex.: joinedload para a exibição), com as
+    #   relações dadas por nome (as "backrefs" só existem após a configuração
+    #   dos mapeamentos)
+    # - formato: função de exibição de cada item (padrão: str do modelo)
+    def __init__(self, name, model, **options):
+        super(CarregadorAjax, self).__init__(name, db.session, model, **options)
+
+        self.campos_numericos = options.get('campos_numericos', [])
+        self.filtros = options.get('filtros', [])
+        self.opcoes = options.get('opcoes', [])
+        self.formato = options.get('formato')
+
+    # Exibição de um item: (id, texto)
+    def format(self, model):
+        if not model:
+            return None
+
+        texto = self.formato(model) if self.formato else as_unicode(model)
+
+        return (getattr(model, self.pk), texto)
+
+    # Página de itens que correspondem ao termo buscado
+    def get_list(self, term, offset=0, limit=DEFAULT_PAGE_SIZE):
+        query = self.session.query(self.model).options(*self.opcoes)
+
+        termo = term.strip()
+
+        if termo:
+            # Caracteres especiais do LIKE são buscados literalmente
+            padrao = u'%%%s%%' % termo.replace('\\', '\\\\')\
+                                      .replace('%', '\\%')\
+                                      .replace('_', '\\_')
+
+            condicoes = [campo.ilike(padrao, escape='\\') for campo in self._cached_fields]
+
+            if termo.isdigit():
+                condicoes.extend(campo == int(termo) for campo in self.campos_numericos)
+
+            query = query.filter(or_(*condicoes))
+
+        for filtro in self.filtros:
+            query = query.filter(filtro)
+
+        if self.order_by is not None:
+            query = query.order_by(*self.order_by)
+
+        return query.offset(offset).limit(limit).all()
+
+
+# Dicionário "form_ajax_refs" de uma view a partir dos seus carregadores
+def referencias_ajax(*carregadores):
+    return dict((carregador.name, carregador) for carregador in carregadores)
+
+
+########## Carregadores ##########
+
+
+# Usuários (por nome ou email)
+CARREGADOR_USUARIOS = CarregadorAjax('usuarios', Usuario,
+    fields=[Usuario.nome, Usuario.email],
+    order_by=[Usuario.nome],
+    formato=lambda usuario: u'%s [%s]' % (usuario.nome, usuario.email))
+
+# Usuários que ainda não são responsáveis por uma unidade
+CARREGADOR_USUARIOS_SEM_UNIDADE = CarregadorAjax('usuarios_sem_unidade', Usuario,
+    fields=[Usuario.nome, Usuario.email],
+    filtros=[Usuario.id_unidade_responsavel == None],
+    order_by=[Usuario.nome],
+    formato=lambda usuario: u'%s [%s]' % (usuario.nome, usuario.email))
+
+# Blocos (por nome)
+CARREGADOR_BLOCOS = CarregadorAjax('blocos', Bloco,
+    fields=[Bloco.nome],
+    order_by=[Bloco.nome],
+    opcoes=[joinedload('departamento').joinedload('centro').joinedload('campus')])
+
+# Ambientes (por nome ou local)
+CARREGADOR_AMBIENTES = CarregadorAjax('ambientes', Ambiente,
+    fields=[Ambiente.nome, Ambiente.caminho_local],
+    order_by=[Ambiente.nome],
+    formato=lambda ambiente: u'%s [%s]' % (ambiente.nome, ambiente.caminho_local))
+
+
+# Exibição de um equipamento (pelo caminho de localização desnormalizado)
+def formato_equipamento(equipamento):
+    return u'%s %d [%s]' % (equipamento.tipo_equipamento, equipamento.tombamento,
+                            equipamento.caminho_local)
+
+
+# Equipamentos (por tipo, local ou tombamento)
+CARREGADOR_EQUIPAMENTOS = CarregadorAjax('equipamentos', Equipamento,
+    fields=[Equipamento.tipo_equipamento, Equipamento.caminho_local],
+    campos_numericos=[Equipamento.tombamento],
+    order_by=[Equipamento.tipo_equipamento, Equipamento.tombamento],
+    formato=formato_equipamento)
+
+# Equipamentos em uso e sem manutenção aberta (abertura de manutenções)
+CARREGADOR_EQUIPAMENTOS_DISPONIVEIS = CarregadorAjax('equipamentos_disponiveis',
+    Equipamento,
+    fields=[Equipamento.tipo_equipamento, Equipamento.caminho_local],
+    campos_numericos=[Equipamento.tombamento],
+    filtros=[Equipamento.em_uso == True, Equipamento.em_manutencao == False],
+    order_by=[Equipamento.tipo_equipamento, Equipamento.tombamento],
+    formato=formato_equipamento)
+
+# Manutenções (por tipo, status ou número da ordem de serviço)
+CARREGADOR_MANUTENCOES = CarregadorAjax('manutencoes', Manutencao,
+    fields=[Manutencao.tipo_manutencao, Manutencao.status],
+    campos_numericos=[Manutencao.num_ordem_servico],
+    order_by=[Manutencao.data_abertura.desc()],
+    opcoes=[joinedload('equipamento')])
+
+# Contas de energia (por data de leitura, no formato aaaa-mm-dd)
+CARREGADOR_CONTAS = CarregadorAjax('contas', Conta,
+    fields=[db.cast(Conta.data_leitura, db.String)],
+    order_by=[Conta.data_leitura.desc()],
+    opcoes=[joinedload('unidade_consumidora')])
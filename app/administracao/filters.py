@@ -10,6 +10,8 @@
 import datetime
 from flask_admin.contrib.sqla.filters import *
 
+from ..models import HierarquiaLocal
+
 
 ########## Funções Auxiliares ##########
 
@@ -58,6 +60,47 @@ def FiltrosDatas(coluna, nome):
             FilterEmpty(column=coluna, name=nome)]
 
 
+########## Filtros de Hierarquia de Locais ##########
+
+
+# Opções dos filtros de locais
+# As opções são obtidas do banco de dados apenas quando percorridas (a cada
+# exibição da página), acompanhando os locais cadastrados
+class OpcoesLocais(object):
+    def __nonzero__(self):
+        return True
+
+    def __iter__(self):
+        return iter(HierarquiaLocal.opcoes_locais())
+
+
+# Filtro de subárvore de locais
+# Seleciona os registros cujo local (coluna de ids de locais do tipo dado)
+# está abaixo de um local qualquer da hierarquia (instituição, campus, centro,
+# departamento ou bloco), usando a tabela de fechamento da hierarquia
+# O valor do filtro tem o formato 'tipo:id' (ex.: 'centros:3')
+class FiltroSubarvoreLocal(BaseSQLAFilter):
+    def __init__(self, column, name, tipo='ambientes', options=None, data_type=None):
+        # Por padrão, as opções são todos os locais cadastrados
+        super(FiltroSubarvoreLocal, self).__init__(column, name,
+                                                   options or OpcoesLocais(), data_type)
+
+        # Tipo dos locais referenciados pela coluna
+        self.tipo = tipo
+
+    def clean(self, value):
+        tipo, id = value.split(':', 1)
+        return tipo, int(id)
+
+    def apply(self, query, value, alias=None):
+        tipo, id = value
+        return query.filter(self.get_column(alias).in_(
+            HierarquiaLocal.subarvore(tipo, id, self.tipo)))
+
+    def operation(self):
+        return 'dentro de'
+
+
 ########## Filtros Modificados ##########
 
 # Os filtros utilizados são fornecidos pelo Flask-Admin, mas alguns
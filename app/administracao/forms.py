@@ -10,9 +10,11 @@
 from datetime import date, timedelta
 from flask import request, flash
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from flask_admin.form.fields import Select2Field, Select2TagsField
 from flask_admin.form.widgets import DatePickerWidget
 from flask_admin.contrib.sqla.fields import QuerySelectField, QuerySelectMultipleField
+from flask_admin.model.fields import AjaxSelectField, AjaxSelectMultipleField
 from flask_admin.contrib.geoa.fields import GeoJSONField
 from wtforms import StringField, PasswordField, BooleanField, IntegerField, DecimalField, \
                     SubmitField, TextAreaField, DateField
@@ -23,6 +25,10 @@ from wtforms.validators import InputRequired, Optional, Regexp, Email, Length, N
 from .. import db
 from ..models import *
 from .fields import DateFieldMod
+from .ajax import CARREGADOR_USUARIOS, CARREGADOR_USUARIOS_SEM_UNIDADE, \
+                  CARREGADOR_BLOCOS, CARREGADOR_AMBIENTES, CARREGADOR_EQUIPAMENTOS, \
+                  CARREGADOR_EQUIPAMENTOS_DISPONIVEIS, CARREGADOR_MANUTENCOES, \
+                  CARREGADOR_CONTAS
 
 
 ########## Formulário Base (Tradução habilitada) ##########
@@ -46,10 +52,7 @@ class FormEditarCargo(FormBase):
 
     padrao = BooleanField('Padrão')
 
-    usuarios = QuerySelectMultipleField('Usuários',
-                                        allow_blank=True,
-                                        query_factory= lambda: 
-                                        Usuario.query.order_by('nome').all())
+    usuarios = AjaxSelectMultipleField(CARREGADOR_USUARIOS, 'Usuários')
 
 
 # Criação de Usuário
@@ -232,9 +235,7 @@ class FormEditarDepartamento(FormBase):
     centro = QuerySelectField('Centro',
                         query_factory=lambda: Centro.query.order_by('nome').all())
 
-    blocos = QuerySelectMultipleField('Blocos',
-                            allow_blank=True,
-                            query_factory=lambda: Bloco.query.order_by('nome').all())
+    blocos = AjaxSelectMultipleField(CARREGADOR_BLOCOS, 'Blocos')
 
 
 # Criação de Bloco
@@ -246,6 +247,11 @@ class FormCriarBloco(FormBase):
                                 query_factory=lambda: 
                                 Departamento.query.order_by('nome').all())
 
+    unidade_responsavel = QuerySelectField('Unidade Responsável',
+                                allow_blank=True,
+                                query_factory=lambda:
+                                UnidadeResponsavel.query.order_by('nome').all())
+
     localizacao = GeoJSONField('Localização', srid=-1, session=db.session,
                                 geometry_type='POINT',
                                 # Aumentar o mapa e centralizar em Fortaleza
@@ -262,14 +268,16 @@ class FormEditarBloco(FormBase):
     departamento = QuerySelectField('Departamento',
             query_factory=lambda: Departamento.query.order_by('nome').all())
 
+    unidade_responsavel = QuerySelectField('Unidade Responsável',
+            allow_blank=True,
+            query_factory=lambda: UnidadeResponsavel.query.order_by('nome').all())
+
     localizacao = GeoJSONField('Localização', srid=-1, session=db.session,
                                geometry_type='POINT',
                                # Aumentar o mapa
                                render_kw={'data-width':400, 'data-height':400})
 
-    ambientes = QuerySelectMultipleField('Ambientes',
-                allow_blank=True,
-                query_factory=lambda: Ambiente.query.order_by('nome').all())
+    ambientes = AjaxSelectMultipleField(CARREGADOR_AMBIENTES, 'Ambientes')
 
 
 # Criação de Ambiente (Escolha do tipo de ambiente a ser criado)
@@ -291,8 +299,7 @@ class FormCriarAmbienteInterno(FormBase):
       choices=[('Térreo', 'Térreo')] + [(str(n)+'º Andar', str(n)+'º Andar') 
                for n in range(1, 11)])
 
-    bloco = QuerySelectField('Bloco',
-                        query_factory=lambda: Bloco.query.order_by('nome').all())
+    bloco = AjaxSelectField(CARREGADOR_BLOCOS, 'Bloco')
 
     detalhe_localizacao = TextAreaField('Detalhe de Localização')
 
@@ -311,8 +318,7 @@ class FormEditarAmbienteInterno(FormBase):
       choices=[('Térreo', 'Térreo')] + [(str(n)+'º Andar', str(n)+'º Andar')
                for n in range(1, 11)])    
 
-    bloco = QuerySelectField('Bloco',
-                        query_factory=lambda: Bloco.query.order_by('nome').all())
+    bloco = AjaxSelectField(CARREGADOR_BLOCOS, 'Bloco')
 
     detalhe_localizacao = TextAreaField('Detalhe de Localização')
 
@@ -321,10 +327,7 @@ class FormEditarAmbienteInterno(FormBase):
 
     populacao = IntegerField('População', validators=[Optional(), NumberRange(0)])
 
-    equipamentos = QuerySelectMultipleField('Equipamentos',
-            allow_blank=True,
-            query_factory=lambda: 
-                Equipamento.query.order_by('tipo_equipamento').all())
+    equipamentos = AjaxSelectMultipleField(CARREGADOR_EQUIPAMENTOS, 'Equipamentos')
 
 
 # Criação de Ambiente Externo
@@ -332,8 +335,7 @@ class FormCriarAmbienteExterno(FormBase):
     nome = StringField('Nome', validators=[InputRequired(),
                                            Length(1, 64)])
 
-    bloco = QuerySelectField('Bloco',
-                        query_factory=lambda: Bloco.query.order_by('nome').all())
+    bloco = AjaxSelectField(CARREGADOR_BLOCOS, 'Bloco')
 
     detalhe_localizacao = TextAreaField('Detalhe de Localização')
 
@@ -343,15 +345,11 @@ class FormEditarAmbienteExterno(FormBase):
     nome = StringField('Nome', validators=[InputRequired(),
                                            Length(1, 64)])
 
-    bloco = QuerySelectField('Bloco',
-                        query_factory=lambda: Bloco.query.order_by('nome').all())
+    bloco = AjaxSelectField(CARREGADOR_BLOCOS, 'Bloco')
 
     detalhe_localizacao = TextAreaField('Detalhe de Localização')
 
-    equipamentos = QuerySelectMultipleField('Equipamentos',
-            allow_blank=True,
-            query_factory=lambda: 
-                Equipamento.query.order_by('tipo_equipamento').all())
+    equipamentos = AjaxSelectMultipleField(CARREGADOR_EQUIPAMENTOS, 'Equipamentos')
 
 
 # Criação de Subestação Abrigada
@@ -391,10 +389,7 @@ class FormEditarSubestacaoAbrigada(FormBase):
 
     detalhe_localizacao = TextAreaField('Detalhe de Localização')
 
-    equipamentos = QuerySelectMultipleField('Equipamentos',
-            allow_blank=True,
-            query_factory=lambda: 
-                Equipamento.query.order_by('tipo_equipamento').all())
+    equipamentos = AjaxSelectMultipleField(CARREGADOR_EQUIPAMENTOS, 'Equipamentos')
 
 
 # Criação de Subestação Aérea
@@ -434,10 +429,7 @@ class FormEditarSubestacaoAerea(FormBase):
 
     detalhe_localizacao = TextAreaField('Detalhe de Localização')
 
-    equipamentos = QuerySelectMultipleField('Equipamentos',
-            allow_blank=True,
-            query_factory=lambda: 
-                Equipamento.query.order_by('tipo_equipamento').all())
+    equipamentos = AjaxSelectMultipleField(CARREGADOR_EQUIPAMENTOS, 'Equipamentos')
 
 
 # Criação de Equipamento (Escolha do tipo de equipamento a ser criado)
@@ -450,6 +442,22 @@ class FormCriarEquipamento(FormBase):
     proximo = SubmitField('Próximo')
 
 
+# Importação de equipamentos em lote (arquivo CSV)
+class FormImportarEquipamentos(FormBase):
+    tipo_equipamento = Select2Field('Tipo de Equipamento', validators=[InputRequired()],
+                    # Obter os tipos de equipamentos automaticamente
+                    choices=[(tipo.endpoint, tipo.nome_formatado_singular)
+                        for tipo in Equipamento.__subclasses__()])
+
+    arquivo = FileField('Arquivo CSV',
+                        validators=[FileRequired('Selecione um arquivo.'),
+                                    FileAllowed(['csv'], 'O arquivo deve ser CSV.')])
+
+    parcial = BooleanField('Importar as linhas válidas mesmo que haja erros')
+
+    importar = SubmitField('Importar')
+
+
 # Criação de Extintor
 class FormCriarExtintor(FormBase):
     # Caso não haja número de tombamento, usar 0
@@ -468,9 +476,7 @@ class FormCriarExtintor(FormBase):
 
     fabricante = StringField('Fabricante', validators=[Length(1, 64)])
 
-    ambiente = QuerySelectField('Ambiente',
-                                query_factory=lambda: 
-                                    Ambiente.query.order_by('nome').all())
+    ambiente = AjaxSelectField(CARREGADOR_AMBIENTES, 'Ambiente')
 
     intervalo_manutencao = IntegerField('Intervalo de Manutenção (Meses)',
                                         validators=[InputRequired(), NumberRange(0)])
@@ -506,9 +512,7 @@ class FormEditarExtintor(FormBase):
 
     fabricante = StringField('Fabricante', validators=[Length(1, 64)])
 
-    ambiente = QuerySelectField('Ambiente',
-                                query_factory=lambda: 
-                                    Ambiente.query.order_by('nome').all())
+    ambiente = AjaxSelectField(CARREGADOR_AMBIENTES, 'Ambiente')
 
     intervalo_manutencao = IntegerField('Intervalo de Manutenção (Meses)',
                                         validators=[InputRequired(),
@@ -518,9 +522,7 @@ class FormEditarExtintor(FormBase):
 
     info_adicional = TextAreaField('Informações Adicionais')
 
-    manutencoes = QuerySelectMultipleField('Manutenções',
-                                           query_factory=lambda: Manutencao.query.all(),
-                                           allow_blank=True)
+    manutencoes = AjaxSelectMultipleField(CARREGADOR_MANUTENCOES, 'Manutenções')
 
 
     # Certificar que, se houve alteração no número de tombamento, o novo número
@@ -562,9 +564,7 @@ class FormCriarCondicionadorAr(FormBase):
 
     fabricante = StringField('Fabricante', validators=[Length(1, 64)])
 
-    ambiente = QuerySelectField('Ambiente',
-                                query_factory=lambda: 
-                                    Ambiente.query.order_by('nome').all())
+    ambiente = AjaxSelectField(CARREGADOR_AMBIENTES, 'Ambiente')
 
     intervalo_manutencao = IntegerField('Intervalo de Manutenção (Meses)',
                                         validators=[InputRequired(), NumberRange(0)])
@@ -611,9 +611,7 @@ class FormEditarCondicionadorAr(FormBase):
 
     fabricante = StringField('Fabricante', validators=[Length(1, 64)])
 
-    ambiente = QuerySelectField('Ambiente',
-                                query_factory=lambda: 
-                                    Ambiente.query.order_by('nome').all())
+    ambiente = AjaxSelectField(CARREGADOR_AMBIENTES, 'Ambiente')
 
     intervalo_manutencao = IntegerField('Intervalo de Manutenção (Meses)',
                                         validators=[InputRequired(), NumberRange(0)])
@@ -622,9 +620,7 @@ class FormEditarCondicionadorAr(FormBase):
 
     info_adicional = TextAreaField('Informações Adicionais')                         
 
-    manutencoes = QuerySelectMultipleField('Manutenções',
-                                           query_factory=lambda: Manutencao.query.all(),
-                                           allow_blank=True)
+    manutencoes = AjaxSelectMultipleField(CARREGADOR_MANUTENCOES, 'Manutenções')
 
 
     # Certificar que, se houve alteração no número de tombamento, o novo número
@@ -661,10 +657,7 @@ class FormCriarManutencao(FormBase):
                                             ('Troca', 'Troca'),
                                             ('Inicial', 'Inicial')])
 
-    equipamento = QuerySelectField('Equipamento',
-        query_factory=lambda: 
-            Equipamento.query.filter_by(em_uso=True).filter_by(em_manutencao=False)\
-                             .order_by('tipo_equipamento').all())
+    equipamento = AjaxSelectField(CARREGADOR_EQUIPAMENTOS_DISPONIVEIS, 'Equipamento')
 
     descricao_servico = TextAreaField('Descrição do Serviço')
 
@@ -784,10 +777,7 @@ class FormEditarManutencao(FormBase):
                                             ('Troca', 'Troca'),
                                             ('Inicial', 'Inicial')])
 
-    equipamento = QuerySelectField('Equipamento',
-        query_factory=lambda: 
-            Equipamento.query.filter_by(em_uso=True)\
-                             .order_by('tipo_equipamento').all())
+    equipamento = AjaxSelectField(CARREGADOR_EQUIPAMENTOS, 'Equipamento')
 
     descricao_servico = TextAreaField('Descrição do Serviço')
 
@@ -803,15 +793,21 @@ class FormEditarManutencao(FormBase):
         # comprometimento do banco de dados.
         self.equipamento.render_kw = dict(disabled='disabled')
 
-        # Obter o id da manutenção
-        id_manutencao = request.args.get('id')
+        # Obter a manutenção
+        manutencao = Manutencao.query.get(request.args.get('id'))
 
         # Caso a manutenção seja do tipo inicial, desabilitar edição dos campos
         # de tipo de manutenção e de status
-        if Manutencao.query.get(id_manutencao).tipo_manutencao == 'Inicial':
+        if manutencao.tipo_manutencao == 'Inicial':
             self.tipo_manutencao.render_kw = dict(disabled='disabled')
             self.status.render_kw = dict(disabled='disabled')
 
+        # Caso a manutenção seja agendada (gerada automaticamente), sua edição
+        # corresponde à abertura da manutenção: a data de abertura sugerida é
+        # a de hoje (a data prevista pode estar no futuro)
+        if manutencao.status == 'Agendada' and request.method == 'GET':
+            self.data_abertura.data = date.today()
+
 
     # Certificar que, se houve alteração no número da ordem de serviço,
     # o novo número seja diferente dos já existentes
@@ -872,10 +868,8 @@ class FormCriarUnidadeResponsavel(FormBase):
     nome = StringField('Nome', validators=[InputRequired(),
                                            Length(1, 64)])
 
-    responsaveis = QuerySelectMultipleField('Responsáveis',
-                                            query_factory=\
-                                                lambda: Usuario.query.filter_by(responsavel_unidade=None).all(),
-                                            validators=[InputRequired()])
+    responsaveis = AjaxSelectMultipleField(CARREGADOR_USUARIOS_SEM_UNIDADE, 'Responsáveis',
+                                           validators=[InputRequired()])
 
 
     # Certificar que o nome é diferente dos já cadastrados
@@ -889,10 +883,8 @@ class FormEditarUnidadeResponsavel(FormBase):
     nome = StringField('Nome', validators=[InputRequired(),
                                            Length(1, 64)])
 
-    responsaveis = QuerySelectMultipleField('Responsáveis',
-                                            query_factory=\
-                                                lambda: Usuario.query.all(),
-                                            validators=[InputRequired()])
+    responsaveis = AjaxSelectMultipleField(CARREGADOR_USUARIOS, 'Responsáveis',
+                                           validators=[InputRequired()])
 
     unidades_consumidoras = QuerySelectMultipleField('Unidades Consumidoras',
                                             query_factory=\
@@ -993,10 +985,7 @@ class FormEditarUnidadeConsumidora(FormBase):
                                              NumberRange(0)])
 
 
-    hist_contas = QuerySelectMultipleField('Histórico de Contas',
-                                            query_factory=\
-                                                lambda: Conta.query.all(),
-                                            allow_blank=True)
+    hist_contas = AjaxSelectMultipleField(CARREGADOR_CONTAS, 'Histórico de Contas')
 
 
     # Certificar que, se houve alteração no número de cliente, o novo é diferente dos
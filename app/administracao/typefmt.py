@@ -7,14 +7,19 @@
 ################################################################################
 
 
-from flask import request, url_for
+import json
+from flask import current_app, request, url_for
 from datetime import date
 from jinja2 import Markup
 from flask_admin.contrib.geoa import typefmt
 from wtforms.widgets import html_params
 from geoalchemy2.shape import to_shape
 from geoalchemy2.elements import WKBElement
-from sqlalchemy import func
+from sqlalchemy import func, inspect
+
+from ..models import Ambiente, Conta, Equipamento, Manutencao, UnidadeConsumidora, \
+                     Usuario, HistoricoManutencao
+from ..util.miniaturas import gerar_miniatura, LARGURA_MINIATURA, ALTURA_MINIATURA
 
 
 ########## Formatos de Tipos de Dados ##########
@@ -39,8 +44,8 @@ def formato_data(view, value):
     return value.strftime('%d.%m.%Y')
 
 
-# Tipo Mapa
-def formato_mapa(view, value):
+# Widget de mapa (Leaflet) a partir do GeoJSON e do tipo da geometria
+def widget_mapa(geojson, tipo_geometria):
     # Mostrar mapa maior na view de detalhes
     if 'details' in request.path:
         width = 400
@@ -57,7 +62,7 @@ def formato_mapa(view, value):
         "data-role": "leaflet",
         "data-width": width,
         "data-height": height,
-        "data-geometry-type": to_shape(value).geom_type,
+        "data-geometry-type": tipo_geometria,
         "data-zoom": zoom
     })
 
@@ -66,12 +71,33 @@ def formato_mapa(view, value):
     if 'details' not in request.path:
         params += u' disabled'
 
+    return Markup('<textarea %s>%s</textarea>' % (params, geojson))
+
+
+# Miniatura (SVG em cache) de uma geometria, exibida na view de listagem no
+# lugar do widget de mapa (sem carregar o mapa de fundo no navegador)
+def miniatura_mapa(value):
+    chave = gerar_miniatura(value)
+
+    return Markup('<img class="miniatura-mapa" src="%s" width="%d" height="%d">' %
+                  (url_for('principal.miniatura', chave=chave),
+                   LARGURA_MINIATURA, ALTURA_MINIATURA))
+
+
+# Tipo Mapa
+# Miniatura na view de listagem e mapa na view de detalhes (uma consulta ao
+# banco de dados por geometria; as views com mapas usam
+# "formato_mapa_precarregado", ver abaixo)
+def formato_mapa(view, value):
+    if 'details' not in request.path:
+        return miniatura_mapa(value)
+
     if value.srid is -1:
         value.srid = 4326
 
     geojson = view.session.query(view.model).with_entities(func.ST_AsGeoJSON(value)).scalar()
 
-    return Markup('<textarea %s>%s</textarea>' % (params, geojson))
+    return widget_mapa(geojson, to_shape(value).geom_type)
 
 
 ########## Formatos de Campos Específicos ##########
@@ -79,10 +105,130 @@ def formato_mapa(view, value):
 # Alteração da forma como alguns campos específicos dos modelos são 
 # exibidos nas views de listagem e de detalhes
 
-# Campos Tipo Relação Geral (Relações one-to-many)
-def formato_relacao(view, context, model, name):
-    html_string = ""
+# Campos Tipo Mapa: miniatura na view de listagem e, na view de detalhes, mapa
+# com GeoJSON e tipo da geometria já carregados junto com o modelo (propriedades
+# "<campo>_geojson" e "<campo>_tipo", ver "propriedades_mapa" em models.py),
+# sem consultas adicionais ao banco de dados
+def formato_mapa_precarregado(view, context, model, name):
+    if 'details' not in request.path:
+        geometria = getattr(model, name)
+
+        return miniatura_mapa(geometria) if geometria is not None else ''
+
+    geojson = getattr(model, name + '_geojson')
+
+    if geojson is None:
+        return ''
+
+    return widget_mapa(geojson, getattr(model, name + '_tipo'))
+
+
+# Progresso de uma tarefa de exportação (barra de progresso)
+def formato_progresso(view, context, model, name):
+    progresso = model.progresso
+
+    return Markup('<div class="progress" style="margin-bottom: 0px;">'
+                  '<div class="progress-bar" role="progressbar" style="width: %d%%;">'
+                  '%d%%</div></div>' % (progresso, progresso))
+
+
+# Arquivo de uma tarefa de exportação: link de download (concluída) ou erro (falha)
+def formato_arquivo_tarefa(view, context, model, name):
+    if model.status == 'Concluída':
+        return Markup('<a href="%s">%s</a> (%.1f kB)' %
+                      (url_for('.download_view', id=model.id),
+                       Markup.escape(model.nome_arquivo),
+                       model.tamanho_arquivo / 1024.0))
+
+    if model.status == 'Falha':
+        return Markup.escape(model.erro or '')
+
+    return ''
+
+
+# Alterações de um registro de auditoria (um campo por linha: anterior -> novo)
+def formato_alteracoes(view, context, model, name):
+    if not model.alteracoes:
+        return ''
+
+    alteracoes = json.loads(model.alteracoes)
+
+    def valor(v):
+        return u'-' if v is None else unicode(v)
+
+    return Markup('<br>'.join(u'<b>%s</b>: %s &rarr; %s' %
+                              (Markup.escape(campo), Markup.escape(valor(anterior)),
+                               Markup.escape(valor(novo)))
+                              for campo, (anterior, novo) in sorted(alteracoes.items())))
+
 
+##### Campos Tipo Relação (Relações one-to-many) #####
+
+# Cada relação é buscada com uma única consulta, apenas com as colunas exibidas
+# (sem instanciar os objetos), e limitada a LIMITE_RELACAO itens por página.
+# Relações maiores são paginadas (parâmetro "pagina_<campo>" da query string).
+# Os itens são exibidos pelo template "administracao/relacao.html", compilado
+# uma única vez pelo ambiente Jinja da aplicação.
+
+
+# Número máximo de itens de uma relação exibidos por página
+LIMITE_RELACAO = 100
+
+
+# Endpoints dos tipos de um modelo polimórfico (identidade -> endpoint)
+def endpoints_polimorficos(modelo):
+    return dict((identidade, mapper.class_.endpoint)
+                for identidade, mapper in inspect(modelo).polymorphic_map.items())
+
+
+# Busca de uma página dos itens de uma relação dinâmica
+# Retorna (linhas, página, número de páginas)
+def pagina_relacao(model, name, colunas, ordem):
+    query = getattr(model, name)
+
+    pagina = max(request.args.get('pagina_' + name, 1, type=int), 1)
+
+    # Um item a mais indica que há mais de uma página
+    linhas = query.with_entities(*colunas)\
+                  .order_by(*ordem)\
+                  .limit(LIMITE_RELACAO + 1)\
+                  .offset((pagina - 1) * LIMITE_RELACAO)\
+                  .all()
+
+    # Total de itens contado apenas quando a relação não cabe em uma página
+    if pagina == 1 and len(linhas) <= LIMITE_RELACAO:
+        num_paginas = 1
+    else:
+        num_paginas = -(-query.count() // LIMITE_RELACAO)
+
+    return linhas[:LIMITE_RELACAO], pagina, num_paginas
+
+
+# Renderização dos itens de uma relação ([(url, texto)]) e da sua paginação
+def renderizar_relacao(name, itens, pagina, num_paginas):
+    paginas = []
+
+    if num_paginas > 1:
+        argumentos = request.args.to_dict()
+
+        for numero in range(1, num_paginas + 1):
+            argumentos['pagina_' + name] = numero
+            paginas.append((numero, url_for(request.endpoint, **argumentos)))
+
+    template = current_app.jinja_env.get_template('administracao/relacao.html')
+
+    return Markup(template.render(itens=itens, pagina=pagina, paginas=paginas))
+
+
+# Url da view de detalhes de um endpoint, à qual se acrescenta o id do item
+# (url_for é chamado uma vez por endpoint, e não por item)
+def urls_detalhes(endpoints):
+    return dict((endpoint, url_for(endpoint + '.details_view') + '?id=')
+                for endpoint in set(endpoints))
+
+
+# Campos Tipo Relação Geral (itens com nome)
+def formato_relacao(view, context, model, name):
     # Extrair o tipo de relação a partir do nome do campo (que estará no plural)
     # para usar nas urls dos links de redirecionamento (que deve ser no singular)
 
@@ -91,125 +237,123 @@ def formato_relacao(view, context, model, name):
     elif name[-1] == 'i':           # Caso 'Campi' -> 'Campus'
         tipo = name[:-1] + 'us'
 
-    # Gerar lista de botões com links de redirecionamento para cada item da relação
+    modelo = getattr(type(model), name).property.mapper.class_
 
-    for item in model.__getattribute__(name).order_by('nome').all():
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{nome}</span>\
-             </a>'.format(url=url_for(tipo + '.details_view', id=item.id),
-                          nome=item.nome)
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [modelo.id, modelo.nome],
+                                                 [modelo.nome])
 
-    return Markup(html_string)
+    url = urls_detalhes([tipo])[tipo]
 
+    return renderizar_relacao(name, [(url + str(id), nome) for id, nome in linhas],
+                              pagina, num_paginas)
 
-# Campo Tipo Relação de Ambientes
-def formato_relacao_ambientes(view, context, model, name):
-    html_string = ""
-
-    # Gerar lista de botões com links de redirecionamento para cada ambiente
 
-    for ambiente in model.__getattribute__(name).order_by('nome').all():
-        # Obter o endpoint do tipo do ambiente para gerar o link de redirecionamento
-        endpoint = ambiente.endpoint
+# Campo Tipo Relação de Ambientes (links para a view do tipo de cada ambiente)
+def formato_relacao_ambientes(view, context, model, name):
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [Ambiente.id, Ambiente.nome, Ambiente.tipo],
+                                                 [Ambiente.nome])
 
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{nome}</span>\
-             </a>'.format(url=url_for(endpoint + '.details_view', id=ambiente.id),
-                          nome=ambiente.nome)
+    endpoints = endpoints_polimorficos(Ambiente)
+    urls = urls_detalhes(endpoints.values())
 
-    return Markup(html_string)
+    return renderizar_relacao(name, [(urls[endpoints[tipo]] + str(id), nome)
+                                     for id, nome, tipo in linhas],
+                              pagina, num_paginas)
 
 
-# Campo Tipo Relação de Equipamentos
+# Campo Tipo Relação de Equipamentos (links para a view do tipo de cada equipamento)
 def formato_relacao_equipamentos(view, context, model, name):
-    html_string = ""
-
-    # Gerar lista de botões com links de redirecionamento para cada equipamento
-    
-    for equip in model.__getattribute__(name).order_by('tipo_equipamento').all():
-        # Obter o endpoint do tipo do equipamento para gerar o link de redirecionamento
-        endpoint = equip.endpoint
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [Equipamento.id,
+                                                  Equipamento.tipo_equipamento,
+                                                  Equipamento.tombamento],
+                                                 [Equipamento.tipo_equipamento,
+                                                  Equipamento.tombamento])
 
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{tipo} [{tomb}]</span>\
-             </a>'.format(url=url_for(endpoint + '.details_view', id=equip.id),
-                          tipo=equip.tipo_equipamento, tomb=equip.tombamento)
+    endpoints = endpoints_polimorficos(Equipamento)
+    urls = urls_detalhes(endpoints.values())
 
-    return Markup(html_string)
+    return renderizar_relacao(name, [(urls[endpoints[tipo]] + str(id),
+                                      '%s [%s]' % (tipo, tombamento))
+                                     for id, tipo, tombamento in linhas],
+                              pagina, num_paginas)
 
 
 # Campo Tipo Relação de Manutenções
+# (mostrar a data de conclusão, caso haja, ou a de abertura)
 def formato_relacao_manutencoes(view, context, model, name):
-    html_string = ""
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [Manutencao.id,
+                                                  Manutencao.num_ordem_servico,
+                                                  func.coalesce(Manutencao.data_conclusao,
+                                                                Manutencao.data_abertura)],
+                                                 [Manutencao.data_abertura])
+
+    url = urls_detalhes(['manutencao'])['manutencao']
 
-    # Gerar lista de botões com links de redirecionamento para cada manutenção
-    for manutencao in model.__getattribute__(name).order_by('data_abertura').all():
-        # Mostrar a data de conclusão (caso haja) ou a de abertura
-        if manutencao.data_conclusao:
-            data = manutencao.data_conclusao
-        else:
-            data = manutencao.data_abertura
+    return renderizar_relacao(name, [(url + str(id),
+                                      '%s [%s]' % (num_os, data.strftime('%d.%m.%Y')))
+                                     for id, num_os, data in linhas],
+                              pagina, num_paginas)
 
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{num_os} [{data}]</span>\
-             </a>'.format(url=url_for('manutencao.details_view', id=manutencao.id),
-                          num_os=manutencao.num_ordem_servico,
-                          data=data.strftime("%d.%m.%Y"))
 
-    return Markup(html_string)
+# Campo Tipo Relação de Manutenções do Histórico (principais e arquivadas)
+def formato_relacao_historico_manutencoes(view, context, model, name):
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [HistoricoManutencao.id,
+                                                  HistoricoManutencao.num_ordem_servico,
+                                                  func.coalesce(
+                                                      HistoricoManutencao.data_conclusao,
+                                                      HistoricoManutencao.data_abertura)],
+                                                 [HistoricoManutencao.data_abertura])
+
+    url = urls_detalhes(['historicomanutencao'])['historicomanutencao']
+
+    return renderizar_relacao(name, [(url + str(id),
+                                      '%s [%s]' % (num_os, data.strftime('%d.%m.%Y')))
+                                     for id, num_os, data in linhas],
+                              pagina, num_paginas)
 
 
 # Campo Tipo Relação de Usuários Responsáveis por uma Unidade Responsável
 def formato_relacao_responsaveis(view, context, model, name):
-    html_string = ""
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [Usuario.id, Usuario.nome, Usuario.email],
+                                                 [Usuario.nome])
 
-    # Gerar lista de botões com links de redirecionamento para cada responsável
-    for responsavel in model.__getattribute__(name).order_by('nome').all():
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{nome} [{email}]</span>\
-             </a>'.format(url=url_for('usuario.details_view', id=responsavel.id),
-                          nome=responsavel.nome,
-                          email=responsavel.email)
+    url = urls_detalhes(['usuario'])['usuario']
 
-    return Markup(html_string)
+    return renderizar_relacao(name, [(url + str(id), '%s [%s]' % (nome, email))
+                                     for id, nome, email in linhas],
+                              pagina, num_paginas)
 
 
 # Campo Tipo Relação de Unidades Consumidoras
 def formato_relacao_unidades_consumidoras(view, context, model, name):
-    html_string = ""
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [UnidadeConsumidora.id,
+                                                  UnidadeConsumidora.nome],
+                                                 [UnidadeConsumidora.nome])
 
-    # Gerar lista de botões com links de redirecionamento para cada unidade consumidora
-    for unidade in model.__getattribute__(name).order_by('nome').all():
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{nome}</span>\
-             </a>'.format(url=url_for('unidadeconsumidora.details_view', 
-                          id=unidade.id),
-                          nome=unidade.nome)
+    url = urls_detalhes(['unidadeconsumidora'])['unidadeconsumidora']
 
-    return Markup(html_string)
+    return renderizar_relacao(name, [(url + str(id), nome) for id, nome in linhas],
+                              pagina, num_paginas)
 
 
 # Campo Tipo Relação de Contas de Luz
 def formato_relacao_contas(view, context, model, name):
-    html_string = ""
-
-    # Gerar lista de botões com links de redirecionamento para cada conta de luz
-    for conta in model.__getattribute__(name).order_by('data_leitura').all():
-        html_string += \
-            '<a class="campo_relacao" href="{url}">\
-                <span class="label label-default">{data}</span>\
-             </a>'.format(url=url_for('conta.details_view', id=conta.id),
-                          data=conta.data_leitura.strftime("%d.%m.%Y"))
-
-    return Markup(html_string)
+    linhas, pagina, num_paginas = pagina_relacao(model, name,
+                                                 [Conta.id, Conta.data_leitura],
+                                                 [Conta.data_leitura])
 
+    url = urls_detalhes(['conta'])['conta']
 
+    return renderizar_relacao(name, [(url + str(id), data.strftime('%d.%m.%Y'))
+                                     for id, data in linhas],
+                              pagina, num_paginas)
 
 
 ########## Registro dos Formatos de Tipos de Dados ##########
@@ -7,18 +7,39 @@
 ################################################################################
 
 
-from datetime import date, timedelta
-from flask import url_for, redirect, request
+from datetime import date
+from flask import url_for, redirect, request, flash, abort, Response, stream_with_context, \
+                  current_app
 from flask_login import current_user
 from flask_admin import BaseView, expose
+from flask_admin.actions import action
+from flask_admin.babel import gettext
+from flask_admin.helpers import get_redirect_target
 from flask_admin.contrib.geoa import ModelView
+from flask_admin.contrib.sqla import tools
+from sqlalchemy.orm import undefer, undefer_group
+from werkzeug.urls import url_encode
+from werkzeug.utils import secure_filename
 
 from . import admin, typefmt
 from .. import db
 from .forms import *
 from .filters import *
+from .ajax import referencias_ajax, CARREGADOR_USUARIOS, CARREGADOR_USUARIOS_SEM_UNIDADE, \
+                  CARREGADOR_BLOCOS, CARREGADOR_AMBIENTES, CARREGADOR_EQUIPAMENTOS, \
+                  CARREGADOR_EQUIPAMENTOS_DISPONIVEIS, CARREGADOR_MANUTENCOES, \
+                  CARREGADOR_CONTAS
 from ..models import *
 from ..util import email
+from ..util.exportacao import FORMATOS_EXPORTACAO, LOTE_EXPORTACAO, TIPOS_MIME, \
+                              gerar_csv, arquivo_xlsx, ler_e_remover
+from ..util.tarefas import criar_tarefa_exportacao
+from ..util.agenda import atualizar_agenda
+from ..util.auditoria import ColetorAlteracoes, valores_modelo, registrar_operacao
+from ..util.importacao import importar_equipamentos, colunas_importacao
+from ..util.manutencoes import agendar_proxima_manutencao, abrir_manutencoes, \
+                               registrar_manutencoes, concluir_manutencoes, \
+                               atualizar_situacao_equipamentos
 
 
 ########## View Base ##########
@@ -42,6 +63,204 @@ class ModelViewBase(ModelView):
     can_export = True           # Eportação dos dados
     can_view_details = True     # View de detalhes
 
+    # Formatos de exportação (XLSX apenas se "openpyxl" estiver instalado)
+    export_types = FORMATOS_EXPORTACAO
+
+    # Registrar as alterações feitas pela view no registro de auditoria
+    auditar = True
+
+
+    ### Unidade de Trabalho ###
+
+    # Cada operação de criação, edição ou exclusão é feita em uma única transação:
+    # o modelo e as alterações dos procedimentos adicionais (after_model_change e
+    # after_model_delete) são apenas enviados ao banco (flush) e há um único commit
+    # no final. Em caso de falha, tudo é desfeito (rollback).
+    # Efeitos externos (ex.: envio de emails) devem ser feitos em "apos_commit",
+    # chamado somente após o commit.
+    # As alterações do modelo são coletadas a cada flush e registradas na
+    # auditoria somente após o commit (gravação em segundo plano).
+
+    # Criação
+    def create_model(self, form):
+        try:
+            model = self.model()
+
+            with ColetorAlteracoes(self.session(), model) as coletor:
+                form.populate_obj(model)
+                self.session.add(model)
+                self._on_model_change(form, model, True)
+                self.session.flush()
+                id_registro = model.id
+                self.after_model_change(form, model, True)
+                self.session.commit()
+        except Exception as ex:
+            if not self.handle_view_exception(ex):
+                flash(gettext('Failed to create record. %(error)s', error=str(ex)), 'error')
+
+            self.session.rollback()
+
+            return False
+        else:
+            self.registrar_auditoria('Criação', model, id_registro, coletor.alteracoes)
+            self.apos_commit(model, True)
+
+        return model
+
+    # Edição
+    def update_model(self, form, model):
+        try:
+            id_registro = model.id
+
+            with ColetorAlteracoes(self.session(), model) as coletor:
+                form.populate_obj(model)
+                self._on_model_change(form, model, False)
+                self.session.flush()
+                self.after_model_change(form, model, False)
+                self.session.commit()
+        except Exception as ex:
+            if not self.handle_view_exception(ex):
+                flash(gettext('Failed to update record. %(error)s', error=str(ex)), 'error')
+
+            self.session.rollback()
+
+            return False
+        else:
+            # Edições sem alterações não são registradas
+            if coletor.alteracoes:
+                self.registrar_auditoria('Edição', model, id_registro, coletor.alteracoes)
+
+            self.apos_commit(model, False)
+
+        return True
+
+    # Exclusão
+    def delete_model(self, model):
+        try:
+            self.on_model_delete(model)
+            self.session.flush()
+            valores = valores_modelo(model)
+            id_registro = model.id
+            self.session.delete(model)
+            self.session.flush()
+            self.after_model_delete(model)
+            self.session.commit()
+        except Exception as ex:
+            if not self.handle_view_exception(ex):
+                flash(gettext('Failed to delete record. %(error)s', error=str(ex)), 'error')
+
+            self.session.rollback()
+
+            return False
+        else:
+            self.registrar_auditoria('Exclusão', model, id_registro, valores)
+            self.apos_exclusao(model)
+
+        return True
+
+    # Procedimentos executados somente após o commit da criação/edição
+    def apos_commit(self, model, is_created):
+        pass
+
+    # Procedimentos executados somente após o commit da exclusão
+    def apos_exclusao(self, model):
+        pass
+
+    # Registro de uma operação na auditoria (após o commit)
+    def registrar_auditoria(self, operacao, model, id_registro, alteracoes):
+        if self.auditar:
+            registrar_operacao(operacao, model, id_registro, alteracoes, current_user)
+
+
+    ### Exportação ###
+
+    # A exportação usa a mesma consulta da listagem (busca, filtros e ordenação
+    # ativos), sem paginação, lida em lotes por um cursor do lado do servidor
+    # (memória constante, mesmo exportando todas as manutenções ou contas).
+    # Nas views de modelos polimórficos, a consulta da listagem já inclui as
+    # tabelas dos subtipos (ver "ViewPolimorfica").
+
+    # Consulta da exportação
+    # Retorna (número de linhas, consulta)
+    def consulta_exportacao(self, sort_column, sort_desc, search, filters):
+        count, query = self.get_list(0, sort_column, sort_desc, search, filters,
+                                     execute=False, page_size=0)
+
+        return count, query.execution_options(stream_results=True)\
+                           .yield_per(LOTE_EXPORTACAO)
+
+    # Linhas de valores exportados de uma consulta
+    def linhas_exportacao(self, query):
+        for model in query:
+            yield [self.get_export_value(model, coluna)
+                   for coluna, titulo in self._export_columns]
+
+    # Títulos das colunas exportadas
+    def titulos_exportacao(self):
+        return [titulo for coluna, titulo in self._export_columns]
+
+    # Dados da exportação (a partir dos parâmetros da listagem na query string)
+    def _export_data(self):
+        view_args = self._get_list_extra_args()
+
+        sort_column = self._get_column_by_idx(view_args.sort)
+
+        if sort_column is not None:
+            sort_column = sort_column[0]
+
+        return self.consulta_exportacao(sort_column, view_args.sort_desc,
+                                        view_args.search, view_args.filters)
+
+    # Cabeçalho de anexo da resposta de exportação
+    def anexo_exportacao(self, export_type):
+        nome = secure_filename(self.get_export_name(export_type=export_type))
+
+        return {'Content-Disposition': 'attachment;filename=%s' % nome}
+
+    # Exportação em CSV (linhas enviadas à medida que são produzidas)
+    def _export_csv(self, return_url):
+        count, query = self._export_data()
+
+        linhas = gerar_csv(self.titulos_exportacao(), self.linhas_exportacao(query))
+
+        return Response(stream_with_context(linhas),
+                        headers=self.anexo_exportacao('csv'),
+                        mimetype=TIPOS_MIME['csv'])
+
+    # Exportação em XLSX (arquivo temporário enviado em blocos)
+    def _export_tablib(self, export_type, return_url):
+        if export_type not in FORMATOS_EXPORTACAO:
+            flash('Formato de exportação não disponível.', 'error')
+            return redirect(return_url)
+
+        count, query = self._export_data()
+
+        caminho = arquivo_xlsx(self.titulos_exportacao(), self.linhas_exportacao(query))
+
+        return Response(ler_e_remover(caminho),
+                        headers=self.anexo_exportacao('xlsx'),
+                        mimetype=TIPOS_MIME['xlsx'])
+
+    # Exportação em segundo plano: uma tarefa com os parâmetros atuais da listagem
+    # (busca, filtros e ordenação) é adicionada à fila e executada pelo worker
+    # ("python launcher.py executar_tarefas"). O arquivo gerado fica disponível
+    # para download na listagem de exportações.
+    @expose('/export_tarefa/<export_type>/')
+    def export_tarefa(self, export_type):
+        return_url = get_redirect_target() or self.get_url('.index_view')
+
+        if not self.can_export or export_type not in self.export_types:
+            flash('Formato de exportação não disponível.', 'error')
+            return redirect(return_url)
+
+        criar_tarefa_exportacao(self, export_type, url_encode(request.args),
+                                current_user.id)
+
+        flash('Exportação adicionada à fila. O arquivo ficará disponível para '
+              'download assim que for gerado.', 'success')
+
+        return redirect(url_for(TarefaExportacao.endpoint + '.index_view'))
+
 
 ########## Views Restritas ##########
 
@@ -58,6 +277,157 @@ class ModelViewCadastrador(ModelViewBase):
         return current_user.pode_cadastrar()
 
 
+########## Ações em Lote ##########
+
+
+# Executa uma operação em lote como uma única transação, informando o resultado
+# (ou a falha, desfazendo toda a operação e registrando o erro no log) através de
+# mensagens flash. Após o commit, é gerada a agenda dos equipamentos afetados.
+def executar_acao_lote(operacao, ids, mensagem, ids_equipamentos):
+    try:
+        resultado = operacao([int(id) for id in ids])
+
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+
+        current_app.logger.exception('Falha na operação em lote "%s".' % operacao.__name__)
+
+        flash('Falha na operação em lote. Nenhum item foi alterado.', 'error')
+
+    else:
+        atualizar_agenda(ids_equipamentos)
+
+        # Operações podem retornar a lista de itens afetados ou o seu número
+        if isinstance(resultado, list):
+            resultado = len(resultado)
+
+        flash(mensagem % resultado, 'success')
+
+
+# Ações em lote das views de equipamentos (abrir, registrar e reagendar
+# manutenções preventivas dos equipamentos selecionados)
+class AcoesLoteEquipamentos(object):
+    @action('abrir_manutencao', 'Abrir Manutenção Preventiva',
+            'Abrir manutenção preventiva para os equipamentos selecionados?')
+    def action_abrir_manutencao(self, ids):
+        executar_acao_lote(abrir_manutencoes, ids,
+                           'Manutenção aberta para %d equipamento(s).',
+                           [int(id) for id in ids])
+
+    @action('registrar_preventiva', 'Registrar Preventiva Concluída Hoje',
+            'Registrar manutenção preventiva concluída hoje para os equipamentos selecionados?')
+    def action_registrar_preventiva(self, ids):
+        executar_acao_lote(registrar_manutencoes, ids,
+                           'Manutenção registrada para %d equipamento(s).',
+                           [int(id) for id in ids])
+
+    @action('reagendar', 'Recalcular Próxima Manutenção',
+            'Recalcular a próxima manutenção dos equipamentos selecionados?')
+    def action_reagendar(self, ids):
+        executar_acao_lote(atualizar_situacao_equipamentos, ids,
+                           'Próxima manutenção recalculada para %d equipamento(s).',
+                           [int(id) for id in ids])
+
+
+########## Modelos Polimórficos ##########
+
+
+# Views dos modelos com subtipos (equipamentos e ambientes), que listam itens de
+# todos os tipos e redirecionam a edição e os detalhes para a view do tipo do
+# item. A consulta da listagem inclui as tabelas dos subtipos (with_polymorphic),
+# de modo que as colunas específicas de cada tipo são carregadas junto com a
+# linha, sem uma consulta por item. Para o redirecionamento, basta a coluna de
+# identificação do tipo, consultada sozinha e guardada em cache (o tipo de um
+# item nunca muda).
+class ViewPolimorfica(object):
+    # Subtipos cujas tabelas são incluídas na consulta da listagem ('*': todos)
+    tipos_listagem = '*'
+
+    # Tamanho máximo do cache de tipos (por view)
+    tamanho_cache_tipos = 10000
+
+    # Inicialização (cache de tipos vazio: id -> endpoint da view do tipo)
+    def __init__(self, *args, **kwargs):
+        self.cache_tipos = {}
+
+        super(ViewPolimorfica, self).__init__(*args, **kwargs)
+
+    # Consulta da listagem (e da exportação)
+    def get_query(self):
+        return super(ViewPolimorfica, self).get_query()\
+                                           .with_polymorphic(self.tipos_listagem)
+
+    # Endpoint da view do tipo de um item (None, caso o item não exista)
+    def endpoint_tipo(self, id):
+        cache = self.cache_tipos
+
+        if id not in cache:
+            mapeador = self.model.__mapper__
+
+            tipo = self.session.query(mapeador.polymorphic_on)\
+                               .filter(mapeador.primary_key[0] == id)\
+                               .scalar()
+
+            # Itens inexistentes não são guardados (podem ser criados depois)
+            if tipo is None:
+                return None
+
+            # Cache cheio: recomeçar
+            if len(cache) >= self.tamanho_cache_tipos:
+                cache.clear()
+
+            cache[id] = mapeador.polymorphic_map[tipo].class_.endpoint
+
+        return cache[id]
+
+    # Redirecionamento para uma view (edição, detalhes) do tipo do item
+    # cujo id é dado na query string
+    def redirecionar_tipo(self, nome_view):
+        return_url = url_for(self.endpoint + '.index_view')
+
+        try:
+            id = int(request.args.get('id'))
+        except (TypeError, ValueError):
+            id = None
+
+        endpoint = self.endpoint_tipo(id) if id is not None else None
+
+        if endpoint is None:
+            flash(gettext('Record does not exist.'), 'error')
+            return redirect(return_url)
+
+        return redirect(url_for(endpoint + '.' + nome_view, url=return_url, id=id))
+
+
+########## Mapas ##########
+
+
+# Views com colunas de geometria exibidas como mapas: a listagem exibe miniaturas
+# (SVG gerados a partir da própria geometria) e a view de detalhes o mapa, com o
+# GeoJSON e o tipo das geometrias (grupo de propriedades "mapas" dos modelos)
+# carregados na própria consulta do modelo, em vez de uma consulta por mapa
+class MapasPrecarregados(object):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = []
+
+    # Inicialização (formato dos mapas para as colunas de geometria)
+    def __init__(self, *args, **kwargs):
+        self.column_formatters = dict(self.column_formatters or {})
+
+        for coluna in self.colunas_mapas:
+            self.column_formatters[coluna] = typefmt.formato_mapa_precarregado
+
+        super(MapasPrecarregados, self).__init__(*args, **kwargs)
+
+    # Consulta da view de detalhes (e de edição)
+    def get_one(self, id):
+        return self.session.query(self.model)\
+                           .options(undefer_group('mapas'))\
+                           .get(tools.iterdecode(id))
+
+
 ########## Views dos Modelos do Sistema ##########
 
 
@@ -96,6 +466,9 @@ class ModelViewCargo(ModelViewAdministrador):
     # Definição dos formulários utilizados
     edit_form = FormEditarCargo
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_USUARIOS)
+
 
 # Usuários (Somente administradores)
 class ModelViewUsuario(ModelViewAdministrador):
@@ -138,10 +511,12 @@ class ModelViewUsuario(ModelViewAdministrador):
             # Verificar usuário
             model.verificado = True
 
-            # Salvar no banco de dados
-            db.session.add(model)
-            db.session.commit()
+            # Enviar ao banco de dados (commit único ao final da criação)
+            db.session.flush()
 
+    # Após o commit da criação, enviar email de confirmação
+    def apos_commit(self, model, is_created):
+        if is_created:
             # Se o usuário não foi confirmado na criação, enviar email para
             # que este possa confirmar seu email
             if model.confirmado is False:
@@ -183,7 +558,10 @@ class ModelViewInstituicao(ModelViewCadastrador):
 
 
 # Campi
-class ModelViewCampus(ModelViewCadastrador):
+class ModelViewCampus(MapasPrecarregados, ModelViewCadastrador):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = ['mapeamento']
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -224,7 +602,6 @@ class ModelViewCampus(ModelViewCadastrador):
             centro.campus = model
 
             db.session.add(centro)
-            db.session.commit()
 
             # Criação do departamento para subestações
             departamento = Departamento()
@@ -232,7 +609,6 @@ class ModelViewCampus(ModelViewCadastrador):
             departamento.centro = centro
 
             db.session.add(departamento)
-            db.session.commit()
 
             # Criação do bloco para subestações
             bloco = Bloco()
@@ -240,11 +616,16 @@ class ModelViewCampus(ModelViewCadastrador):
             bloco.departamento = departamento
 
             db.session.add(bloco)
-            db.session.commit()
+
+            # Enviar ao banco de dados (commit único ao final da criação)
+            db.session.flush()
 
 
 # Centros
-class ModelViewCentro(ModelViewCadastrador):
+class ModelViewCentro(MapasPrecarregados, ModelViewCadastrador):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = ['mapeamento']
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -316,6 +697,9 @@ class ModelViewDepartamento(ModelViewCadastrador):
     create_form = FormCriarDepartamento
     edit_form = FormEditarDepartamento
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_BLOCOS)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
@@ -327,7 +711,10 @@ class ModelViewDepartamento(ModelViewCadastrador):
 
 
 # Blocos
-class ModelViewBloco(ModelViewCadastrador):
+class ModelViewBloco(MapasPrecarregados, ModelViewCadastrador):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = ['localizacao']
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -348,7 +735,8 @@ class ModelViewBloco(ModelViewCadastrador):
 
     # Colunas exibidas na view de detalhes (em ordem)
     column_details_list = ['nome', 'departamento.nome', 'departamento.centro.nome',
-                           'departamento.centro.campus.nome', 'localizacao',
+                           'departamento.centro.campus.nome',
+                           'unidade_responsavel.nome', 'localizacao',
                            'ambientes']
 
     # Exibição dos nomes das colunas (necessário adicionar os acentos)
@@ -356,6 +744,7 @@ class ModelViewBloco(ModelViewCadastrador):
     column_labels = {'departamento.nome': 'Departamento',
                      'departamento.centro.nome': 'Centro',
                      'departamento.centro.campus.nome': 'Campus',
+                     'unidade_responsavel.nome': 'Unidade Responsável',
                      'localizacao': 'Localização'}
 
     # Colunas que possuem um formato modificado (arquivo 'typefmt.py')
@@ -372,6 +761,9 @@ class ModelViewBloco(ModelViewCadastrador):
     create_form = FormCriarBloco
     edit_form = FormEditarBloco
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_AMBIENTES)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
@@ -389,13 +781,13 @@ class ModelViewBloco(ModelViewCadastrador):
 
 
 # Ambientes
-class ModelViewAmbiente(ModelViewCadastrador):
+class ModelViewAmbiente(ViewPolimorfica, ModelViewCadastrador):
     # Nesta view são mostrados todos os tipos de ambientes (interno, externo, ...)
 
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
-    column_list = ['nome', 'tipo', 'bloco.nome',
+    column_list = ['nome', 'tipo', 'andar', 'bloco.nome',
                    'bloco.departamento.nome',
                    'bloco.departamento.centro.nome', 
                    'bloco.departamento.centro.campus.nome']
@@ -419,7 +811,18 @@ class ModelViewAmbiente(ModelViewCadastrador):
     column_labels = {'bloco.nome': 'Bloco',
                      'bloco.departamento.nome': 'Departamento',
                      'bloco.departamento.centro.nome': 'Centro',
-                     'bloco.departamento.centro.campus.nome': 'Campus'}
+                     'bloco.departamento.centro.campus.nome': 'Campus',
+                     'detalhe_localizacao': 'Detalhe de Localização',
+                     'area': 'Área (m²)',
+                     'populacao': 'População'}
+
+    # Colunas exportadas (em ordem), incluindo as específicas de cada tipo
+    # (vazias nos ambientes dos outros tipos)
+    column_export_list = ['nome', 'tipo', 'bloco.nome',
+                          'bloco.departamento.nome',
+                          'bloco.departamento.centro.nome',
+                          'bloco.departamento.centro.campus.nome',
+                          'detalhe_localizacao', 'andar', 'area', 'populacao']
 
     # Lista de filtros que podem ser aplicados em cada coluna
     # Deve-se indicar a coluna e o nome de exibição do filtro
@@ -429,6 +832,7 @@ class ModelViewAmbiente(ModelViewCadastrador):
     column_filters.extend(FiltrosStrings(Departamento.nome, 'Departamento'))
     column_filters.extend(FiltrosStrings(Centro.nome, 'Centro'))
     column_filters.extend(FiltrosStrings(Campus.nome, 'Campus'))
+    column_filters.append(FiltroSubarvoreLocal(Ambiente.id, 'Local'))
 
 
     # Inicialização
@@ -436,14 +840,13 @@ class ModelViewAmbiente(ModelViewCadastrador):
         super(ModelViewAmbiente, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do ambiente)
 
-        self._filter_joins[Departamento.nome] = [Bloco.__table__, Departamento.__table__]
+        self._filter_joins[Departamento.nome] = [Ambiente.departamento]
 
-        self._filter_joins[Centro.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__]
+        self._filter_joins[Centro.nome] = [Ambiente.centro]
 
-        self._filter_joins[Campus.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__, Campus.__table__]
+        self._filter_joins[Campus.nome] = [Ambiente.campus]
 
 
     # View de criação modificada
@@ -466,32 +869,14 @@ class ModelViewAmbiente(ModelViewCadastrador):
     # Redirecionamento para view de edição correspondente a partir do id do ambiente
     @expose('/edit/')
     def edit_view(self):
-        # Obter id do ambiente a partir da query string
-        id_ambiente = request.args.get('id')
-
-        # Obter o endpoint para o tipo de ambiente do ambiente representado pelo id
-        tipo_ambiente = Ambiente.query.get(id_ambiente).endpoint
-
-        # Redirecionar para view de edição do ambiente representado pelo id
-        return redirect(url_for(tipo_ambiente + '.edit_view',
-                                url=url_for('ambiente.index_view'),
-                                id=id_ambiente))
+        return self.redirecionar_tipo('edit_view')
 
 
     # View de detalhes modificada
     # Redirecionamento para view de detalhes correspondente a partir do id do ambiente
     @expose('/details/')
     def details_view(self):
-        # Obter id do ambiente a partir da query string
-        id_ambiente = request.args.get('id')
-
-        # Obter o endpoint para o tipo de ambiente do ambiente representado pelo id
-        tipo_ambiente = Ambiente.query.get(id_ambiente).endpoint
-
-        # Redirecionar para view de detalhes do ambiente representado pelo id
-        return redirect(url_for(tipo_ambiente + '.details_view',
-                                url=url_for('ambiente.index_view'),
-                                id=id_ambiente))
+        return self.redirecionar_tipo('details_view')
 
 
 # Ambientes Internos
@@ -552,20 +937,22 @@ class ModelViewAmbienteInterno(ModelViewCadastrador):
     create_form = FormCriarAmbienteInterno
     edit_form = FormEditarAmbienteInterno
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_BLOCOS, CARREGADOR_EQUIPAMENTOS)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewAmbienteInterno, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do ambiente)
 
-        self._filter_joins[Departamento.nome] = [Bloco.__table__, Departamento.__table__]
+        self._filter_joins[Departamento.nome] = [AmbienteInterno.departamento]
 
-        self._filter_joins[Centro.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__]
+        self._filter_joins[Centro.nome] = [AmbienteInterno.centro]
 
-        self._filter_joins[Campus.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__, Campus.__table__]
+        self._filter_joins[Campus.nome] = [AmbienteInterno.campus]
 
 
 # Ambientes Externos
@@ -623,24 +1010,29 @@ class ModelViewAmbienteExterno(ModelViewCadastrador):
     create_form = FormCriarAmbienteExterno
     edit_form = FormEditarAmbienteExterno
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_BLOCOS, CARREGADOR_EQUIPAMENTOS)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewAmbienteExterno, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do ambiente)
 
-        self._filter_joins[Departamento.nome] = [Bloco.__table__, Departamento.__table__]
+        self._filter_joins[Departamento.nome] = [AmbienteExterno.departamento]
 
-        self._filter_joins[Centro.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__]
+        self._filter_joins[Centro.nome] = [AmbienteExterno.centro]
 
-        self._filter_joins[Campus.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__, Campus.__table__]
+        self._filter_joins[Campus.nome] = [AmbienteExterno.campus]
 
 
 # Subestações Abrigadas
-class ModelViewSubestacaoAbrigada(ModelViewCadastrador):
+class ModelViewSubestacaoAbrigada(MapasPrecarregados, ModelViewCadastrador):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = ['localizacao']
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -684,19 +1076,25 @@ class ModelViewSubestacaoAbrigada(ModelViewCadastrador):
     create_form = FormCriarSubestacaoAbrigada
     edit_form = FormEditarSubestacaoAbrigada
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_EQUIPAMENTOS)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewSubestacaoAbrigada, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do ambiente)
 
-        self._filter_joins[Campus.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__, Campus.__table__]
+        self._filter_joins[Campus.nome] = [SubestacaoAbrigada.campus]
 
 
 # Subestações Aéreas
-class ModelViewSubestacaoAerea(ModelViewCadastrador):
+class ModelViewSubestacaoAerea(MapasPrecarregados, ModelViewCadastrador):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = ['localizacao']
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -740,30 +1138,36 @@ class ModelViewSubestacaoAerea(ModelViewCadastrador):
     create_form = FormCriarSubestacaoAerea
     edit_form = FormEditarSubestacaoAerea
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_EQUIPAMENTOS)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewSubestacaoAerea, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do ambiente)
 
-        self._filter_joins[Campus.nome] = [Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__, Campus.__table__]
+        self._filter_joins[Campus.nome] = [SubestacaoAerea.campus]
 
 
 ##### Equipamentos #####
 
 
 # Equipamentos
-class ModelViewEquipamento(ModelViewCadastrador):
+class ModelViewEquipamento(ViewPolimorfica, AcoesLoteEquipamentos, ModelViewCadastrador):
     # Nesta view são mostrados todos os tipos de equipamentos
     # (extintores, condicionadores de ar...)
 
+    # Template de listagem com o link para a importação de equipamentos
+    list_template = 'administracao/listar_equipamentos.html'
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
     column_list = ['tombamento', 'tipo_equipamento', 'categoria_equipamento',
-                   'fabricante', 'ambiente.nome', 'ambiente.bloco.nome',
+                   'classificacao', 'fabricante', 'ambiente.nome', 'ambiente.bloco.nome',
                    'ambiente.bloco.departamento.nome',
                    'ambiente.bloco.departamento.centro.nome',
                    'ambiente.bloco.departamento.centro.campus.nome',
@@ -796,7 +1200,26 @@ class ModelViewEquipamento(ModelViewCadastrador):
                      'ambiente.bloco.departamento.nome': 'Departamento',
                      'ambiente.bloco.departamento.centro.nome': 'Centro',
                      'ambiente.bloco.departamento.centro.campus.nome': 'Campus',
-                     'em_manutencao': 'Em Manutenção'}
+                     'em_manutencao': 'Em Manutenção',
+                     'classificacao': 'Classificação',
+                     'cap_refrigeracao': 'Cap. de Refrigeração',
+                     'pot_nominal': 'Pot. Nominal',
+                     'tensao_alimentacao': 'Tensão de Alimentação',
+                     'eficiencia': 'Eficiência',
+                     'intervalo_manutencao': 'Intervalo de Manutenção',
+                     'proxima_manutencao': 'Próxima Manutenção'}
+
+    # Colunas exportadas (em ordem), incluindo as específicas de cada tipo
+    # (vazias nos equipamentos dos outros tipos)
+    column_export_list = ['tombamento', 'tipo_equipamento', 'categoria_equipamento',
+                          'fabricante', 'classificacao', 'carga_nominal',
+                          'cap_refrigeracao', 'pot_nominal', 'tensao_alimentacao',
+                          'eficiencia', 'ambiente.nome', 'ambiente.bloco.nome',
+                          'ambiente.bloco.departamento.nome',
+                          'ambiente.bloco.departamento.centro.nome',
+                          'ambiente.bloco.departamento.centro.campus.nome',
+                          'intervalo_manutencao', 'proxima_manutencao',
+                          'em_uso', 'em_manutencao']
 
     # Lista de filtros que podem ser aplicados em cada coluna
     # Deve-se indicar a coluna e o nome de exibição do filtro
@@ -809,6 +1232,7 @@ class ModelViewEquipamento(ModelViewCadastrador):
     column_filters.extend(FiltrosStrings(Departamento.nome, 'Departamento'))
     column_filters.extend(FiltrosStrings(Centro.nome, 'Centro'))
     column_filters.extend(FiltrosStrings(Campus.nome, 'Campus'))    
+    column_filters.append(FiltroSubarvoreLocal(Equipamento.id_ambiente, 'Local'))
     column_filters.append(BooleanEqualFilter(Equipamento.em_uso, 'Em Uso'))
     column_filters.append(BooleanEqualFilter(Equipamento.em_uso, 'Em Manutenção'))
 
@@ -818,18 +1242,15 @@ class ModelViewEquipamento(ModelViewCadastrador):
         super(ModelViewEquipamento, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do equipamento)
 
-        self._filter_joins[Bloco.nome] = [Ambiente.__table__, Bloco.__table__]
+        self._filter_joins[Bloco.nome] = [Equipamento.bloco]
 
-        self._filter_joins[Departamento.nome] = [Ambiente.__table__, Bloco.__table__,
-                                                 Departamento.__table__]
+        self._filter_joins[Departamento.nome] = [Equipamento.departamento]
 
-        self._filter_joins[Centro.nome] = [Ambiente.__table__, Bloco.__table__,
-                                           Departamento.__table__, Centro.__table__]
+        self._filter_joins[Centro.nome] = [Equipamento.centro]
 
-        self._filter_joins[Campus.nome] = [Ambiente.__table__, Bloco.__table__,
-                                           Departamento.__table__,Centro.__table__,
-                                           Campus.__table__]
+        self._filter_joins[Campus.nome] = [Equipamento.campus]
 
     # View de criação modificada
     # Escolha tipo de equipamento e redirecionamento para view de criação correspondente
@@ -850,35 +1271,60 @@ class ModelViewEquipamento(ModelViewCadastrador):
     # Redirecionamento para view de edição correspondente a partir do id do equipamento
     @expose('/edit/')
     def edit_view(self):
-        # Obter id do equipamento a partir da query string
-        id_equipamento = request.args.get('id')
-
-        # Obter o endpoint para o tipo de equipamento do equipamento representado pelo id
-        tipo_equipamento = Equipamento.query.get(id_equipamento).endpoint
-
-        # Redirecionar para a view de edição do equipamento representado pelo id
-        return redirect(url_for(tipo_equipamento + '.edit_view',
-                                url = url_for('equipamento.index_view'),
-                                id=id_equipamento))
+        return self.redirecionar_tipo('edit_view')
 
     # View de detalhes modificada
     # Redirecionar para view de detalhes correspondente a partir do id do equipamento
     @expose('/details/')
     def details_view(self):
-        # Obter id do equipamento a partir da query string
-        id_equipamento = request.args.get('id')
+        return self.redirecionar_tipo('details_view')
 
-        # Obter o endpoint para o tipo de equipamento do equipamento representado pelo id
-        tipo_equipamento = Equipamento.query.get(id_equipamento).endpoint
+    # Importação de equipamentos em lote a partir de um arquivo CSV
+    # Os equipamentos são criados com uma manutenção inicial (na data dada no
+    # arquivo ou hoje) e a próxima manutenção já calculada. Os erros de cada
+    # linha são exibidos na página.
+    @expose('/importar/', methods=['GET', 'POST'])
+    def importar_view(self):
+        form = FormImportarEquipamentos()
 
-        # Redirecionar para a view de edição do equipamento representado pelo id
-        return redirect(url_for(tipo_equipamento + '.details_view',
-                                url = url_for('equipamento.index_view'),
-                                id=id_equipamento))
+        erros = []
+
+        if form.validate_on_submit():
+            try:
+                importados, erros = importar_equipamentos(form.tipo_equipamento.data,
+                                                          form.arquivo.data,
+                                                          form.parcial.data)
+
+                db.session.commit()
+
+            except Exception as ex:
+                db.session.rollback()
+
+                flash('Falha na importação: %s' % ex, 'error')
+
+            else:
+                # Geração das manutenções agendadas dos equipamentos importados
+                atualizar_agenda()
+
+                if importados:
+                    flash('%d equipamento(s) importado(s).' % importados, 'success')
+
+                if erros:
+                    flash('%d erro(s) encontrado(s) no arquivo.%s' %
+                          (len(erros), '' if importados else
+                           ' Nenhum equipamento foi importado.'), 'error')
+
+        # Colunas esperadas no arquivo para cada tipo de equipamento
+        colunas = [(tipo.nome_formatado_singular, colunas_importacao(tipo.endpoint))
+                   for tipo in Equipamento.__subclasses__()]
+
+        return self.render('administracao/importar_equipamentos.html', form=form,
+                           erros=erros, colunas=colunas,
+                           return_url=url_for('equipamento.index_view'))
 
 
 # Extintores
-class ModelViewExtintor(ModelViewCadastrador):
+class ModelViewExtintor(AcoesLoteEquipamentos, ModelViewCadastrador):
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -949,6 +1395,7 @@ class ModelViewExtintor(ModelViewCadastrador):
     column_filters.extend(FiltrosStrings(Departamento.nome, 'Departamento'))
     column_filters.extend(FiltrosStrings(Centro.nome, 'Centro'))
     column_filters.extend(FiltrosStrings(Campus.nome, 'Campus'))
+    column_filters.append(FiltroSubarvoreLocal(Extintor.id_ambiente, 'Local'))
     column_filters.extend(FiltrosDatas(Extintor.proxima_manutencao, 'Próxima Manutenção'))
     column_filters.append(BooleanEqualFilter(Equipamento.em_uso, 'Em Uso'))
     column_filters.append(BooleanEqualFilter(Equipamento.em_manutencao, 'Em Manutenção'))
@@ -957,24 +1404,24 @@ class ModelViewExtintor(ModelViewCadastrador):
     create_form = FormCriarExtintor
     edit_form = FormEditarExtintor
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_AMBIENTES, CARREGADOR_MANUTENCOES)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewExtintor, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do equipamento)
 
-        self._filter_joins[Bloco.nome] = [Ambiente.__table__, Bloco.__table__]
+        self._filter_joins[Bloco.nome] = [Extintor.bloco]
 
-        self._filter_joins[Departamento.nome] = [Ambiente.__table__, Bloco.__table__,
-                                                 Departamento.__table__]
+        self._filter_joins[Departamento.nome] = [Extintor.departamento]
 
-        self._filter_joins[Centro.nome] = [Ambiente.__table__, Bloco.__table__,
-                                           Departamento.__table__, Centro.__table__]
+        self._filter_joins[Centro.nome] = [Extintor.centro]
 
-        self._filter_joins[Campus.nome] = [Ambiente.__table__, Bloco.__table__,
-                                           Departamento.__table__,Centro.__table__,
-                                           Campus.__table__]
+        self._filter_joins[Campus.nome] = [Extintor.campus]
 
 
     # Procedimentos adicionais após criação/edição
@@ -1000,28 +1447,20 @@ class ModelViewExtintor(ModelViewCadastrador):
             manutencao.descricao_servico = 'Manutenção inicial padrão criada automaticamente.'
             manutencao.status = 'Concluída'
 
-            # Salvando no banco de dados
+            # Adicionando à sessão
             db.session.add(manutencao)
-            db.session.commit()
 
         # Havendo uma manutenção inicial ou eventual edição no intervalo de
         # manutenção, a data da próxima manutenção preventiva é calculada
+        # (a partir da manutenção concluída mais recente)
+        agendar_proxima_manutencao(model)
 
-        # Lista de manutenções concluídas (ordenadas por data de conclusão)
-        manutencoes = Manutencao.query.filter_by(id_equipamento=id_equipamento)\
-                                      .filter_by(status='Concluída')\
-                                      .order_by('data_conclusao').all()        
+        # Enviar ao banco de dados (commit único ao final da criação/edição)
+        db.session.flush()
 
-        # Última manutenção concluída do equipamento
-        ultima_manutencao = manutencoes[-1]
-
-        # Cálculo da data da próxima manutenção a ser realizada
-        delta = timedelta(days = 30 * model.intervalo_manutencao)
-        model.proxima_manutencao = ultima_manutencao.data_conclusao + delta
-
-        # Salvando no banco de dados
-        db.session.add(model)
-        db.session.commit()
+    # Geração das manutenções agendadas do equipamento (após o commit)
+    def apos_commit(self, model, is_created):
+        atualizar_agenda([model.id])
 
 
     # Após criação de um novo equipamento, redirecionar para uma página em que
@@ -1037,7 +1476,7 @@ class ModelViewExtintor(ModelViewCadastrador):
 
 
 # Condicionadores de Ar
-class ModelViewCondicionadorAr(ModelViewCadastrador):
+class ModelViewCondicionadorAr(AcoesLoteEquipamentos, ModelViewCadastrador):
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -1118,6 +1557,7 @@ class ModelViewCondicionadorAr(ModelViewCadastrador):
     column_filters.extend(FiltrosStrings(Departamento.nome, 'Departamento'))
     column_filters.extend(FiltrosStrings(Centro.nome, 'Centro'))
     column_filters.extend(FiltrosStrings(Campus.nome, 'Campus'))
+    column_filters.append(FiltroSubarvoreLocal(CondicionadorAr.id_ambiente, 'Local'))
     column_filters.extend(FiltrosDatas(CondicionadorAr.proxima_manutencao, 'Próxima Manutenção'))
     column_filters.append(BooleanEqualFilter(Equipamento.em_uso, 'Em Uso'))
     column_filters.append(BooleanEqualFilter(Equipamento.em_manutencao, 'Em Manutenção'))
@@ -1126,24 +1566,24 @@ class ModelViewCondicionadorAr(ModelViewCadastrador):
     create_form = FormCriarCondicionadorAr
     edit_form = FormEditarCondicionadorAr
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_AMBIENTES, CARREGADOR_MANUTENCOES)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewCondicionadorAr, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do equipamento)
 
-        self._filter_joins[Bloco.nome] = [Ambiente.__table__, Bloco.__table__]
+        self._filter_joins[Bloco.nome] = [CondicionadorAr.bloco]
 
-        self._filter_joins[Departamento.nome] = [Ambiente.__table__, Bloco.__table__,
-                                                 Departamento.__table__]
+        self._filter_joins[Departamento.nome] = [CondicionadorAr.departamento]
 
-        self._filter_joins[Centro.nome] = [Ambiente.__table__, Bloco.__table__,
-                                           Departamento.__table__, Centro.__table__]
+        self._filter_joins[Centro.nome] = [CondicionadorAr.centro]
 
-        self._filter_joins[Campus.nome] = [Ambiente.__table__, Bloco.__table__,
-                                           Departamento.__table__,Centro.__table__,
-                                           Campus.__table__]
+        self._filter_joins[Campus.nome] = [CondicionadorAr.campus]
 
     # Procedimentos adicionais após criação/edição
     def after_model_change(self, form, model, is_created):
@@ -1168,28 +1608,20 @@ class ModelViewCondicionadorAr(ModelViewCadastrador):
             manutencao.descricao_servico = 'Manutenção inicial padrão criada automaticamente.'
             manutencao.status = 'Concluída'
 
-            # Salvando no banco de dados
+            # Adicionando à sessão
             db.session.add(manutencao)
-            db.session.commit()
 
         # Havendo uma manutenção inicial ou eventual edição no intervalo de
         # manutenção, a data da próxima manutenção preventiva é calculada
+        # (a partir da manutenção concluída mais recente)
+        agendar_proxima_manutencao(model)
 
-        # Lista de manutenções concluídas (ordenadas por data de conclusão)
-        manutencoes = Manutencao.query.filter_by(id_equipamento=id_equipamento)\
-                                      .filter_by(status='Concluída')\
-                                      .order_by('data_conclusao').all()        
-
-        # Última manutenção concluída do equipamento
-        ultima_manutencao = manutencoes[-1]
-
-        # Cálculo da data da próxima manutenção a ser realizada
-        delta = timedelta(days = 30 * model.intervalo_manutencao)
-        model.proxima_manutencao = ultima_manutencao.data_conclusao + delta
+        # Enviar ao banco de dados (commit único ao final da criação/edição)
+        db.session.flush()
 
-        # Salvando no banco de dados
-        db.session.add(model)
-        db.session.commit()
+    # Geração das manutenções agendadas do equipamento (após o commit)
+    def apos_commit(self, model, is_created):
+        atualizar_agenda([model.id])
 
     # Após criação de um novo equipamento, redirecionar para uma página em que
     # pode-se escolher se será utilizada uma manutenção inicial padrão ou se
@@ -1280,34 +1712,36 @@ class ModelViewManutencao(ModelViewCadastrador):
     column_filters.extend(FiltrosStrings(Departamento.nome, 'Departamento'))
     column_filters.extend(FiltrosStrings(Centro.nome, 'Centro'))
     column_filters.extend(FiltrosStrings(Campus.nome, 'Campus'))
+    column_filters.append(FiltroSubarvoreLocal(Equipamento.id_ambiente, 'Local'))
     column_filters.extend(FiltrosStrings(Manutencao.status, 'Status'))
 
     # Definição dos formulários utilizados
     create_form = FormCriarManutencao
     edit_form = FormEditarManutencao
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_EQUIPAMENTOS_DISPONIVEIS,
+                                      CARREGADOR_EQUIPAMENTOS)
+
 
     # Inicialização
     def __init__(self, *args, **kwargs):
         super(ModelViewManutencao, self).__init__(*args, **kwargs)
 
         # Consertar geração automática de joins para as queries dos filtros
+        # (joins diretos pelos campos de localização desnormalizados do equipamento)
+
+        self._filter_joins[Ambiente.nome] = [Manutencao.equipamento, Equipamento.ambiente]
 
-        self._filter_joins[Ambiente.nome] = [Equipamento.__table__, Ambiente.__table__]
+        self._filter_joins[Bloco.nome] = [Manutencao.equipamento, Equipamento.bloco]
 
-        self._filter_joins[Bloco.nome] = [Equipamento.__table__, Ambiente.__table__,
-                                          Bloco.__table__]
+        self._filter_joins[Departamento.nome] = [Manutencao.equipamento, Equipamento.departamento]
 
-        self._filter_joins[Departamento.nome] = [Equipamento.__table__, Ambiente.__table__,
-                                                 Bloco.__table__, Departamento.__table__]
+        self._filter_joins[Centro.nome] = [Manutencao.equipamento, Equipamento.centro]
 
-        self._filter_joins[Centro.nome] = [Equipamento.__table__, Ambiente.__table__,
-                                           Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__]
+        self._filter_joins[Campus.nome] = [Manutencao.equipamento, Equipamento.campus]
 
-        self._filter_joins[Campus.nome] = [Equipamento.__table__, Ambiente.__table__,
-                                           Bloco.__table__, Departamento.__table__,
-                                           Centro.__table__, Campus.__table__]
+        self._filter_joins[Equipamento.id_ambiente] = [Manutencao.equipamento]
 
 
     # Procedimentos adicionais após criação/edição
@@ -1333,48 +1767,29 @@ class ModelViewManutencao(ModelViewCadastrador):
                     if manutencao.tipo_manutencao == 'Inicial' and manutencao != model:
                         # Excluir a manutenção inicial padrão
                         db.session.delete(manutencao)
-                        db.session.commit()
 
             # Para o caso de troca, o equipamento antigo é colocado fora de uso
             if model.tipo_manutencao == 'Troca':
                 equipamento.em_uso = False
 
-                # Salvar no banco de dados
-                db.session.add(equipamento)
-                db.session.commit()
-
             # Recalcular a data da próxima manutenção preventiva para este equipamento.
             # A nova data sempre é calculada com base na data de conclusão da manutenção
             # concluída mais recentemente. Desta forma, caso uma manutenção antiga tenha 
             # sido cadastrada, sua data de conclusão não será usada como base para cálculo 
             # da próxima manutenção, que não será alterada.
+            agendar_proxima_manutencao(equipamento)
 
-            # Lista de manutenções concluídas (ordenadas por data de conclusão)
-            manutencoes = Manutencao.query.filter_by(id_equipamento=equipamento.id)\
-                                          .filter_by(status='Concluída')\
-                                          .order_by('data_conclusao').all() 
-
-            # Última manutenção concluída do equipamento
-            ultima_manutencao = manutencoes[-1]
-
-            # Cálculo da data da próxima manutenção a ser realizada
-            # A data base para o cálculo é a data de conclusão da manutenção concluída
-            # mais recentemente.
-            delta = timedelta(days = 30 * equipamento.intervalo_manutencao)
-            equipamento.proxima_manutencao = ultima_manutencao.data_conclusao + delta
-
-            # Salvar no banco de dados
-            db.session.add(equipamento)
-            db.session.commit()
-
-        # Manutenções abertas
-        else:
+        # Manutenções abertas (as agendadas não alteram o equipamento)
+        elif model.status == 'Aberta':
             # Atualizar o status "em manutenção" do equipamento
             equipamento.em_manutencao = True
 
             # Atualizar o campo de data de abertura de manutenção do equipamento
             equipamento.inicio_manutencao = model.data_abertura
 
+        # Enviar ao banco de dados (commit único ao final da criação/edição)
+        db.session.flush()
+
 
     # Quando uma manutenção tipo troca é concluída, redirecionar para criação de um
     # novo equipamento, que substituirá o antigo
@@ -1412,23 +1827,35 @@ class ModelViewManutencao(ModelViewCadastrador):
         # Obter o objeto equipamento a partir do seu id
         equipamento = Equipamento.query.get(id_equipamento)
 
-        # Lista de manutenções concluídas do equipamento (ordenadas por data de conclusão)
-        manutencoes = Manutencao.query.filter_by(id_equipamento=id_equipamento)\
-                                      .filter_by(status='Concluída')\
-                                      .order_by('data_conclusao').all() 
-
-        # Última manutenção concluída do equipamento
-        ultima_manutencao = manutencoes[-1]
-
         # Cálculo da data da próxima manutenção a ser realizada
         # A data base para o cálculo é a data de conclusão da manutenção concluída
         # mais recentemente.
-        delta = timedelta(days = 30 * equipamento.intervalo_manutencao)
-        equipamento.proxima_manutencao = ultima_manutencao.data_conclusao + delta
+        agendar_proxima_manutencao(equipamento)
 
-        # Salvar no banco de dados
-        db.session.add(equipamento)
-        db.session.commit()
+        # Enviar ao banco de dados (commit único ao final da exclusão)
+        db.session.flush()
+
+    # Geração das manutenções agendadas do equipamento (após o commit da
+    # criação/edição ou da exclusão)
+    def apos_commit(self, model, is_created):
+        atualizar_agenda([model.id_equipamento])
+
+    def apos_exclusao(self, model):
+        atualizar_agenda([model.id_equipamento])
+
+
+    # Ação em lote: conclusão (hoje) das manutenções abertas selecionadas
+    @action('concluir', 'Concluir Manutenções',
+            'Concluir hoje as manutenções abertas selecionadas?')
+    def action_concluir(self, ids):
+        # Equipamentos das manutenções (a agenda é gerada após a conclusão)
+        ids_equipamentos = [id for (id,) in
+                            db.session.query(Manutencao.id_equipamento)
+                                      .filter(Manutencao.id.in_([int(id) for id in ids]))
+                                      .distinct()]
+
+        executar_acao_lote(concluir_manutencoes, ids,
+                           '%d manutenção(ões) concluída(s).', ids_equipamentos)
 
 
     # Página de cadastro de manutenção inicial
@@ -1461,7 +1888,7 @@ class ModelViewUnidadeResponsavel(ModelViewCadastrador):
     column_searchable_list = ['nome']
     
     # Colunas exibidas na view de detalhes (em ordem)
-    column_details_list = ['nome', 'responsaveis', 'unidades_consumidoras']
+    column_details_list = ['nome', 'responsaveis', 'unidades_consumidoras', 'blocos']
 
     # Exibição dos nomes das colunas (necessário adicionar os acentos)
     # Colunas referenciadas de outros modelos devem ter seus nomes corrigidos
@@ -1469,15 +1896,23 @@ class ModelViewUnidadeResponsavel(ModelViewCadastrador):
 
     # Colunas que possuem um formato modificado (arquivo 'typefmt.py')
     column_formatters = {'responsaveis': typefmt.formato_relacao_responsaveis,
-                         'unidades_consumidoras': typefmt.formato_relacao_unidades_consumidoras}
+                         'unidades_consumidoras': typefmt.formato_relacao_unidades_consumidoras,
+                         'blocos': typefmt.formato_relacao}
 
     # Definição dos formulários utilizados
     create_form = FormCriarUnidadeResponsavel
     edit_form = FormEditarUnidadeResponsavel
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_USUARIOS_SEM_UNIDADE,
+                                      CARREGADOR_USUARIOS)
+
 
 # Unidades Consumidoras
-class ModelViewUnidadeConsumidora(ModelViewCadastrador):
+class ModelViewUnidadeConsumidora(MapasPrecarregados, ModelViewCadastrador):
+    # Colunas de geometria exibidas como mapas
+    colunas_mapas = ['localizacao']
+
     # Colunas exibidas na view de listagem (em ordem)
     # Caso a coluna seja uma referência a outro modelo, indicar que
     # coluna do modelo referenciado deve ser exibida usando notação de ponto
@@ -1521,6 +1956,9 @@ class ModelViewUnidadeConsumidora(ModelViewCadastrador):
     create_form = FormCriarUnidadeConsumidora
     edit_form = FormEditarUnidadeConsumidora
 
+    # Campos de seleção com busca remota (arquivo 'ajax.py')
+    form_ajax_refs = referencias_ajax(CARREGADOR_CONTAS)
+
 
 # Contas de Energia
 class ModelViewConta(ModelViewCadastrador):
@@ -1576,6 +2014,258 @@ class ModelViewConta(ModelViewCadastrador):
     edit_form = FormEditarConta
 
 
+##### Exportações #####
+
+
+# Tarefas de exportação em segundo plano
+# Cada usuário vê apenas as suas exportações (administradores veem todas)
+class ModelViewTarefaExportacao(ModelViewCadastrador):
+    # Tarefas são criadas pelas views de listagem e não podem ser editadas
+    can_create = False
+    can_edit = False
+    can_export = False
+    can_view_details = False
+
+    # A exclusão de exportações não é registrada na auditoria
+    auditar = False
+
+    # Colunas exibidas na view de listagem (em ordem)
+    column_list = ['nome_view', 'formato', 'status', 'progresso', 'criada_em',
+                   'concluida_em', 'usuario.nome', 'nome_arquivo']
+
+    # Coluna padrão usada para ordenar itens (mais recentes primeiro)
+    column_default_sort = ('criada_em', True)
+
+    # Colunas que podem ser utilizadas para ordenar os itens
+    column_sortable_list = ['nome_view', 'formato', 'status', 'criada_em',
+                            'concluida_em']
+
+    # Exibição dos nomes das colunas (necessário adicionar os acentos)
+    # Colunas referenciadas de outros modelos devem ter seus nomes corrigidos
+    column_labels = {'nome_view': 'Listagem',
+                     'criada_em': 'Criada em',
+                     'concluida_em': 'Concluída em',
+                     'usuario.nome': 'Usuário',
+                     'nome_arquivo': 'Arquivo'}
+
+    # Colunas que possuem um formato modificado (arquivo 'typefmt.py')
+    column_formatters = dict(progresso=typefmt.formato_progresso,
+                             nome_arquivo=typefmt.formato_arquivo_tarefa)
+
+
+    # Tarefas visíveis ao usuário atual
+    def filtrar_usuario(self, query):
+        if current_user.pode_administrar():
+            return query
+
+        return query.filter(TarefaExportacao.id_usuario == current_user.id)
+
+    # Consultas da listagem e da contagem
+    def get_query(self):
+        return self.filtrar_usuario(super(ModelViewTarefaExportacao, self).get_query())
+
+    def get_count_query(self):
+        return self.filtrar_usuario(
+            super(ModelViewTarefaExportacao, self).get_count_query())
+
+    # Tarefa pelo id (exclusão), apenas entre as visíveis ao usuário
+    def get_one(self, id):
+        return self.get_query().filter(TarefaExportacao.id == id).first()
+
+    # Download do arquivo de uma tarefa concluída
+    @expose('/download/')
+    def download_view(self):
+        tarefa = self.get_query().options(undefer('arquivo'))\
+                                 .filter(TarefaExportacao.id == request.args.get('id', type=int))\
+                                 .filter(TarefaExportacao.status == 'Concluída')\
+                                 .first()
+
+        if tarefa is None:
+            abort(404)
+
+        if tarefa.formato == 'csv':
+            tipo = 'application/gzip'
+        else:
+            tipo = TIPOS_MIME[tarefa.formato]
+
+        nome = secure_filename(tarefa.nome_arquivo)
+
+        return Response(tarefa.arquivo, mimetype=tipo,
+                        headers={'Content-Disposition': 'attachment;filename=%s' % nome})
+
+
+##### Histórico #####
+
+
+# Histórico de equipamentos (em uso, fora de uso e arquivados) - somente leitura
+# Os equipamentos arquivados só são acessíveis por esta view
+class ModelViewHistoricoEquipamento(ModelViewCadastrador):
+    # O histórico é formado pelas tabelas principais e de arquivo (visão)
+    can_create = False
+    can_edit = False
+    can_delete = False
+    auditar = False
+
+    # Colunas exibidas na view de listagem (em ordem)
+    column_list = ['tombamento', 'tipo_equipamento', 'categoria_equipamento',
+                   'fabricante', 'caminho_local', 'em_uso', 'arquivado']
+
+    # Coluna padrão usada para ordenar itens
+    column_default_sort = 'tombamento'
+
+    # Colunas que podem ser utilizadas para ordenar os itens
+    column_sortable_list = ['tombamento', 'tipo_equipamento', 'categoria_equipamento',
+                            'fabricante', 'caminho_local']
+
+    # Colunas em que pode ser feita busca
+    column_searchable_list = ['tipo_equipamento', 'fabricante', 'caminho_local']
+
+    # Colunas exibidas na view de detalhes (em ordem)
+    column_details_list = ['tombamento', 'tipo_equipamento', 'categoria_equipamento',
+                           'fabricante', 'caminho_local', 'em_uso', 'arquivado',
+                           'manutencoes']
+
+    # Exibição dos nomes das colunas (necessário adicionar os acentos)
+    column_labels = {'tipo_equipamento': 'Tipo',
+                     'categoria_equipamento': 'Categoria',
+                     'caminho_local': 'Local',
+                     'manutencoes': 'Manutenções'}
+
+    # Colunas que possuem um formato modificado (arquivo 'typefmt.py')
+    column_formatters = dict(manutencoes=typefmt.formato_relacao_historico_manutencoes)
+
+    # Lista de filtros que podem ser aplicados em cada coluna
+    # Deve-se indicar a coluna e o nome de exibição do filtro
+    # Note também que alguns tipos de dados possuem mais de um filtro ('filters.py')
+    column_filters = FiltrosInteiros(HistoricoEquipamento.tombamento, 'Tombamento')
+    column_filters.extend(FiltrosStrings(HistoricoEquipamento.tipo_equipamento, 'Tipo'))
+    column_filters.extend(FiltrosStrings(HistoricoEquipamento.fabricante, 'Fabricante'))
+    column_filters.append(BooleanEqualFilter(HistoricoEquipamento.em_uso, 'Em Uso'))
+    column_filters.append(BooleanEqualFilter(HistoricoEquipamento.arquivado, 'Arquivado'))
+
+
+# Histórico de manutenções (principais e arquivadas) - somente leitura
+class ModelViewHistoricoManutencao(ModelViewCadastrador):
+    # O histórico é formado pelas tabelas principais e de arquivo (visão)
+    can_create = False
+    can_edit = False
+    can_delete = False
+    auditar = False
+
+    # Colunas exibidas na view de listagem (em ordem)
+    column_list = ['num_ordem_servico', 'data_abertura', 'data_conclusao',
+                   'tipo_manutencao', 'equipamento.tipo_equipamento',
+                   'equipamento.tombamento', 'status', 'arquivada']
+
+    # Coluna padrão usada para ordenar itens (True -> ordem descrescente)
+    column_default_sort = ('data_abertura', True)
+
+    # Colunas que podem ser utilizadas para ordenar os itens
+    column_sortable_list = ['num_ordem_servico', 'data_abertura', 'data_conclusao',
+                            'tipo_manutencao', 'status']
+
+    # Colunas exibidas na view de detalhes (em ordem)
+    column_details_list = ['num_ordem_servico', 'data_abertura', 'data_conclusao',
+                           'tipo_manutencao', 'equipamento.tipo_equipamento',
+                           'equipamento.tombamento', 'equipamento.caminho_local',
+                           'descricao_servico', 'status', 'arquivada']
+
+    # Exibição dos nomes das colunas (necessário adicionar os acentos)
+    # Colunas referenciadas de outros modelos devem ter seus nomes corrigidos
+    column_labels = {'num_ordem_servico': 'Ordem de Serviço',
+                     'data_abertura': 'Data de Abertura',
+                     'data_conclusao': 'Data de Conclusão',
+                     'tipo_manutencao': 'Tipo de Manutenção',
+                     'equipamento.tipo_equipamento': 'Tipo de Equipamento',
+                     'equipamento.tombamento': 'Tombamento',
+                     'equipamento.caminho_local': 'Local',
+                     'descricao_servico': 'Descrição do Serviço'}
+
+    # Lista de filtros que podem ser aplicados em cada coluna
+    # Deve-se indicar a coluna e o nome de exibição do filtro
+    # Note também que alguns tipos de dados possuem mais de um filtro ('filters.py')
+    column_filters = FiltrosDatas(HistoricoManutencao.data_abertura, 'Data de Abertura')
+    column_filters.extend(FiltrosDatas(HistoricoManutencao.data_conclusao,
+                                       'Data de Conclusão'))
+    column_filters.extend(FiltrosStrings(HistoricoManutencao.tipo_manutencao,
+                                         'Tipo de Manutenção'))
+    column_filters.extend(FiltrosInteiros(HistoricoManutencao.id_equipamento,
+                                          'Id do Equipamento'))
+    column_filters.extend(FiltrosStrings(HistoricoManutencao.status, 'Status'))
+    column_filters.append(BooleanEqualFilter(HistoricoManutencao.arquivada, 'Arquivada'))
+
+
+##### Auditoria #####
+
+
+# Registro de auditoria das alterações feitas no painel de administração
+# (somente leitura). O histórico de um registro é aberto pela sua view de
+# detalhes (rota "historico"), que aplica os filtros de modelo e id.
+class ModelViewRegistroAuditoria(ModelViewAdministrador):
+    # Registros são criados pelas outras views e não podem ser alterados
+    can_create = False
+    can_edit = False
+    can_delete = False
+
+    # A própria auditoria não é auditada
+    auditar = False
+
+    # Colunas exibidas na view de listagem (em ordem)
+    column_list = ['data_hora', 'operacao', 'modelo', 'id_registro',
+                   'email_usuario', 'alteracoes']
+
+    # Coluna padrão usada para ordenar itens (mais recentes primeiro)
+    column_default_sort = ('data_hora', True)
+
+    # Colunas que podem ser utilizadas para ordenar os itens
+    column_sortable_list = ['data_hora', 'operacao', 'modelo', 'id_registro',
+                            'email_usuario']
+
+    # Colunas em que pode ser feita busca
+    column_searchable_list = ['modelo', 'email_usuario']
+
+    # Exibição dos nomes das colunas (necessário adicionar os acentos)
+    column_labels = {'data_hora': 'Data e Hora',
+                     'operacao': 'Operação',
+                     'id_registro': 'Id do Registro',
+                     'email_usuario': 'Usuário',
+                     'alteracoes': 'Alterações'}
+
+    # Colunas que possuem um formato modificado (arquivo 'typefmt.py')
+    column_formatters = dict(alteracoes=typefmt.formato_alteracoes)
+
+    # Lista de filtros que podem ser aplicados em cada coluna
+    # Deve-se indicar a coluna e o nome de exibição do filtro
+    # Note também que alguns tipos de dados possuem mais de um filtro ('filters.py')
+    column_filters = FiltrosStrings(RegistroAuditoria.modelo, 'Modelo')
+    column_filters.extend(FiltrosInteiros(RegistroAuditoria.id_registro, 'Id do Registro'))
+    column_filters.extend(FiltrosStrings(RegistroAuditoria.operacao, 'Operação'))
+    column_filters.extend(FiltrosStrings(RegistroAuditoria.email_usuario, 'Usuário'))
+    column_filters.extend([DateTimeGreaterFilter(RegistroAuditoria.data_hora, 'Data e Hora'),
+                           DateTimeSmallerFilter(RegistroAuditoria.data_hora, 'Data e Hora'),
+                           DateTimeBetweenFilter(RegistroAuditoria.data_hora, 'Data e Hora')])
+
+
+    # Argumento da query string de um filtro (tipo dado) sobre uma coluna
+    def argumento_filtro(self, posicao, coluna, tipo):
+        for chave, (indice, filtro) in self._filter_args.items():
+            if type(filtro) is tipo and filtro.column is coluna:
+                return 'flt%d_%s' % (posicao, chave)
+
+    # Histórico de um registro (modelo e id na query string): listagem filtrada
+    # por modelo e id (consulta atendida pelo índice de modelo, id e data)
+    @expose('/historico/')
+    def historico_view(self):
+        argumentos = {
+            self.argumento_filtro(0, RegistroAuditoria.modelo, FilterEqual):
+                request.args.get('modelo', ''),
+            self.argumento_filtro(1, RegistroAuditoria.id_registro, IntEqualFilter):
+                request.args.get('id', type=int)
+        }
+
+        return redirect(url_for('.index_view', **argumentos))
+
+
 ########## Registro das Views ##########
 
 # Para cada view, define-se o modelo, a sessão atual de interface com
@@ -1688,3 +2378,27 @@ admin.add_view(ModelViewConta(Conta, db.session,
                               category='Consumo',
                               endpoint=Conta.endpoint))
 
+##### Exportações #####
+
+##### Histórico #####
+
+admin.add_view(ModelViewHistoricoEquipamento(HistoricoEquipamento, db.session,
+                                    name=HistoricoEquipamento.nome_formatado_plural,
+                                    category='Histórico',
+                                    endpoint=HistoricoEquipamento.endpoint))
+
+admin.add_view(ModelViewHistoricoManutencao(HistoricoManutencao, db.session,
+                                    name=HistoricoManutencao.nome_formatado_plural,
+                                    category='Histórico',
+                                    endpoint=HistoricoManutencao.endpoint))
+
+##### Auditoria #####
+
+admin.add_view(ModelViewRegistroAuditoria(RegistroAuditoria, db.session,
+                                    name=RegistroAuditoria.nome_formatado_plural,
+                                    endpoint=RegistroAuditoria.endpoint))
+
+admin.add_view(ModelViewTarefaExportacao(TarefaExportacao, db.session,
+                                    name=TarefaExportacao.nome_formatado_plural,
+                                    endpoint=TarefaExportacao.endpoint))
+
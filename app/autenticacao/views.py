@@ -232,8 +232,11 @@ def confirmacao(token):
         # Redirecionar para a página inicial
         return redirect(url_for('principal.home'))
 
+    # Usuário a ser confirmado (o usuário da sessão é uma cópia somente leitura)
+    usuario = current_user.modelo
+
     # Testar se o token de confirmação é válido
-    if current_user.confirmar_conta(token):
+    if usuario.confirmar_conta(token):
         # Usuário foi confirmado
         flash('Seu cadastro foi confirmado. Obrigado!', 'success')
     else:
@@ -254,7 +257,7 @@ def reenviar_confirmacao():
         return redirect(url_for('principal.home'))
 
     # Gerar novo token de confirmação
-    token = current_user.gerar_token_confirmacao()
+    token = current_user.modelo.gerar_token_confirmacao()
 
     # Enviar novo email de confirmação
     enviar_email(current_user.email,
@@ -278,13 +281,16 @@ def alterar_senha():
 
     # Após validação do formulário
     if form.validate_on_submit():
+        # Usuário a ser alterado (o usuário da sessão é uma cópia somente leitura)
+        usuario = current_user.modelo
+
         # Testar se a senha está correta
-        if current_user.verificar_senha(form.senha_atual.data):
+        if usuario.verificar_senha(form.senha_atual.data):
             # Alterar senha antiga para a nova
-            current_user.senha = form.senha_nova.data
+            usuario.senha = form.senha_nova.data
 
             # Salvar no banco de dados
-            db.session.add(current_user)
+            db.session.add(usuario)
 
             flash('Sua senha foi alterada.', 'success')
 
@@ -379,13 +385,16 @@ def pedido_alteracao_email():
 
     # Após validação do formulário
     if form.validate_on_submit():
+        # Usuário da sessão (com a senha e a geração de tokens)
+        usuario = current_user.modelo
+
         # Testar se a senha está correta
-        if current_user.verificar_senha(form.senha.data):
+        if usuario.verificar_senha(form.senha.data):
             # Obter novo email desejado
             email_novo = form.email_novo.data
 
             # Gerar token de alteração de email
-            token = current_user.gerar_token_alteracao_email(email_novo)
+            token = usuario.gerar_token_alteracao_email(email_novo)
 
             # Enviar email de confirmação para novo email informado
             enviar_email(email_novo,
@@ -410,8 +419,11 @@ def pedido_alteracao_email():
 @autenticacao.route('/alterar-email/<token>')
 @login_required
 def alterar_email(token):
+    # Usuário a ser alterado (o usuário da sessão é uma cópia somente leitura)
+    usuario = current_user.modelo
+
     # Caso o token de alteração seja válido, o email é alterado
-    if current_user.alterar_email(token):
+    if usuario.alterar_email(token):
         flash('Seu email foi atualizado.', 'success')
     else:
         flash('Solicitação inválida.', 'danger')
@@ -8,13 +8,15 @@
 
 
 import datetime
+from collections import OrderedDict
 from flask import current_app
 from flask_login import UserMixin, AnonymousUserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect, select, literal, tuple_, or_, and_
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from geoalchemy2.types import Geometry
 
 from . import db, login_manager
+from .util.senhas import gerar_hash_senha, verificar_hash_senha, hash_desatualizado
 
 
 ########## Definição de Permissões dos Usuários ##########
@@ -139,6 +141,10 @@ class Usuario(UserMixin, db.Model):
     id_unidade_responsavel = db.Column(db.Integer,
                                        db.ForeignKey('unidadesresponsaveis.id'))
 
+    # Versão do cadastro (incrementada a cada alteração do usuário ou do seu
+    # cargo, identifica a cópia em cache do usuário da sessão)
+    versao = db.Column(db.Integer, default=1, nullable=False)
+
 
     ### Métodos ###
 
@@ -168,19 +174,33 @@ class Usuario(UserMixin, db.Model):
             db.session.add(administrador)
             db.session.commit()
 
+    # Modelo do usuário (o próprio; ver UsuarioSessao em app/util/usuarios.py)
+    @property
+    def modelo(self):
+        return self
+
     # Bloquear leitura da senha
     @property
     def senha(self):
         raise AttributeError('A senha não pode ser lida!')
 
-    # Armazenar apenas hash da senha cadastrada
+    # Armazenar apenas hash da senha cadastrada (ver app/util/senhas.py)
     @senha.setter
     def senha(self, senha):
-        self.senha_hash = generate_password_hash(senha)
+        self.senha_hash = gerar_hash_senha(senha)
 
     # Testa se a senha é correta a partir do hash armazenado
+    # Caso o hash tenha sido gerado com outro método ou custo (configuração
+    # anterior), ele é gerado novamente com a configuração atual
     def verificar_senha(self, senha):
-        return check_password_hash(self.senha_hash, senha)
+        if not verificar_hash_senha(self.senha_hash, senha):
+            return False
+
+        if hash_desatualizado(self.senha_hash):
+            self.senha = senha
+            db.session.add(self)
+
+        return True
 
     # Gera token para confirmação de nova conta
     def gerar_token_confirmacao(self, validade=3600):
@@ -345,14 +365,28 @@ class UsuarioAnonimo(AnonymousUserMixin):
 login_manager.anonymous_user = UsuarioAnonimo
 
 # Função para que o sistema de login possa carregar um usuário
+# O usuário da sessão é obtido do cache (consultando apenas a sua versão no banco
+# de dados), como uma cópia somente leitura com as suas permissões
 @login_manager.user_loader
 def load_user(id_usuario):
-    return Usuario.query.get(int(id_usuario))
+    from .util.usuarios import carregar_usuario
+
+    return carregar_usuario(int(id_usuario))
 
 
 ########## Modelos do Sistema ##########
 
 
+# GeoJSON e tipo de uma coluna de geometria, calculados pelo banco de dados
+# Ambos são carregados sob demanda (grupo "mapas"), para que as views do painel
+# de administração os incluam na própria consulta da listagem (undefer_group)
+def propriedades_mapa(coluna):
+    return (db.column_property(db.func.ST_AsGeoJSON(coluna), deferred=True,
+                               group='mapas'),
+            db.column_property(db.func.GeometryType(coluna), deferred=True,
+                               group='mapas'))
+
+
 # Instituição (Topo da Hierarquia)
 class Instituicao(db.Model):
     # Nome da tabela no banco de dados
@@ -413,6 +447,9 @@ class Campus(db.Model):
     # Mapeamento do campus (seleção da área no mapa)
     mapeamento = db.Column(Geometry("MULTIPOLYGON"), unique=True)
 
+    # GeoJSON e tipo da geometria (para exibição no painel de administração)
+    mapeamento_geojson, mapeamento_tipo = propriedades_mapa(mapeamento)
+
     # Relação de centros do campus
     centros = db.relationship('Centro', backref='campus', lazy='dynamic')
 
@@ -453,6 +490,9 @@ class Centro(db.Model):
     # Mapeamento do centro (seleção da área no mapa)
     mapeamento = db.Column(Geometry("MULTIPOLYGON"), unique=True)
 
+    # GeoJSON e tipo da geometria (para exibição no painel de administração)
+    mapeamento_geojson, mapeamento_tipo = propriedades_mapa(mapeamento)
+
     # Relação de departamentos do centro
     departamentos = db.relationship('Departamento', backref='centro', lazy='dynamic')
 
@@ -529,9 +569,18 @@ class Bloco(db.Model):
     # Georeferenciamento do bloco (marcador no mapa)
     localizacao = db.Column(Geometry("POINT"), unique=True)
 
+    # GeoJSON e tipo da geometria (para exibição no painel de administração)
+    localizacao_geojson, localizacao_tipo = propriedades_mapa(localizacao)
+
     # Departamento do qual o bloco faz parte
     id_departamento = db.Column(db.Integer, db.ForeignKey('departamentos.id'))
 
+    # Unidade responsável pelo bloco (seus responsáveis recebem os avisos de
+    # manutenções vencidas dos equipamentos do bloco)
+    id_unidade_responsavel = db.Column(db.Integer,
+                                       db.ForeignKey('unidadesresponsaveis.id'),
+                                       index=True)
+
     # Relação de ambientes do bloco
     ambientes = db.relationship('Ambiente', backref='bloco', lazy='dynamic')   
 
@@ -576,12 +625,27 @@ class Ambiente(db.Model):
     # Bloco do qual este ambiente faz parte
     id_bloco = db.Column(db.Integer, db.ForeignKey('blocos.id'))
 
+    # Departamento, centro e campus do ambiente (cópias da hierarquia do bloco,
+    # mantidas automaticamente pelos eventos no final deste arquivo)
+    id_departamento = db.Column(db.Integer, db.ForeignKey('departamentos.id'), index=True)
+    id_centro = db.Column(db.Integer, db.ForeignKey('centros.id'), index=True)
+    id_campus = db.Column(db.Integer, db.ForeignKey('campi.id'), index=True)
+
+    # Caminho de localização para exibição [Bloco - Departamento - Centro - Campus]
+    caminho_local = db.Column(db.Text)
+
     # Detalhes sobre a localização do ambiente
     detalhe_localizacao = db.Column(db.Text)
 
     # Relação de equipamentos do ambiente
     equipamentos = db.relationship('Equipamento', backref='ambiente', lazy='dynamic')
 
+    # Locais da hierarquia do ambiente (acesso direto, sem passar pelo bloco)
+    departamento = db.relationship('Departamento', foreign_keys=[id_departamento],
+                                   viewonly=True)
+    centro = db.relationship('Centro', foreign_keys=[id_centro], viewonly=True)
+    campus = db.relationship('Campus', foreign_keys=[id_campus], viewonly=True)
+
     # Como Ambiente é uma superclasse de cada tipo específico de ambiente,
     # (interno, externo, ...), é necessário explicitar essa relação para o banco de
     # dados. Isso é feito através do dicionário __mapper_args__, em que:
@@ -740,6 +804,9 @@ class SubestacaoAbrigada(Ambiente):
     # Georeferenciamento do bloco (marcador no mapa)
     localizacao = db.Column(Geometry("POINT"), unique=True)
 
+    # GeoJSON e tipo da geometria (para exibição no painel de administração)
+    localizacao_geojson, localizacao_tipo = propriedades_mapa(localizacao)
+
     # SubestacaoAbrigada é uma subclasse de Ambiente, portanto, esta relação
     # deve ser explicitada para o banco de dados através do dicionário
     # __mapper_args__.
@@ -790,6 +857,9 @@ class SubestacaoAerea(Ambiente):
     # Georeferenciamento do bloco (marcador no mapa)
     localizacao = db.Column(Geometry("POINT"), unique=True)
 
+    # GeoJSON e tipo da geometria (para exibição no painel de administração)
+    localizacao_geojson, localizacao_tipo = propriedades_mapa(localizacao)
+
     # SubestacaoAerea é uma subclasse de Ambiente, portanto, esta relação
     # deve ser explicitada para o banco de dados através do dicionário
     # __mapper_args__.
@@ -843,6 +913,17 @@ class Equipamento(db.Model):
     # Ambiente em que o equipamento se encontra
     id_ambiente = db.Column(db.Integer, db.ForeignKey('ambientes.id'))
 
+    # Bloco, departamento, centro e campus do equipamento (cópias da hierarquia
+    # do ambiente, mantidas automaticamente pelos eventos no final deste arquivo)
+    id_bloco = db.Column(db.Integer, db.ForeignKey('blocos.id'), index=True)
+    id_departamento = db.Column(db.Integer, db.ForeignKey('departamentos.id'), index=True)
+    id_centro = db.Column(db.Integer, db.ForeignKey('centros.id'), index=True)
+    id_campus = db.Column(db.Integer, db.ForeignKey('campi.id'), index=True)
+
+    # Caminho de localização para exibição
+    # [Ambiente - Bloco - Departamento - Centro - Campus]
+    caminho_local = db.Column(db.Text)
+
     # Categoria do equipamento (elétrico, combate a incêndio, ...)
     categoria_equipamento = db.Column(db.String(64), index=True)
 
@@ -858,6 +939,13 @@ class Equipamento(db.Model):
     # Relação de manutenções realizadas no equipamento
     manutencoes = db.relationship('Manutencao', backref='equipamento', lazy='dynamic')
 
+    # Locais da hierarquia do equipamento (acesso direto, sem passar pelo ambiente)
+    bloco = db.relationship('Bloco', foreign_keys=[id_bloco], viewonly=True)
+    departamento = db.relationship('Departamento', foreign_keys=[id_departamento],
+                                   viewonly=True)
+    centro = db.relationship('Centro', foreign_keys=[id_centro], viewonly=True)
+    campus = db.relationship('Campus', foreign_keys=[id_campus], viewonly=True)
+
     # Data da próxima manutenção preventiva [dd.mm.aaaa]
     # Calculada com base na última manutenção e no intervalo entre manutenções
     proxima_manutencao = db.Column(db.Date, index=True)
@@ -874,6 +962,13 @@ class Equipamento(db.Model):
     # Data de início da manutenção aberta atual, caso haja [dd.mm.aaaa]
     inicio_manutencao = db.Column(db.Date, index=True)
 
+    # Indica que as manutenções agendadas do equipamento precisam ser geradas
+    # novamente (mudança de próxima manutenção, intervalo ou situação)
+    agenda_desatualizada = db.Column(db.Boolean, default=True, index=True)
+
+    # Data até a qual as manutenções agendadas do equipamento foram geradas
+    agenda_ate = db.Column(db.Date)
+
     # Como Equipamento é uma superclasse de cada tipo específico de equipamento
     # (extintor, condicionador de ar, ...), é necessário explicitar essa relação 
     # para o banco de dados.
@@ -1036,7 +1131,8 @@ class Manutencao(db.Model):
     # Descrição do serviço realizado
     descricao_servico = db.Column(db.Text)
 
-    # Status da manutenção (aberta, concluída)
+    # Status da manutenção (agendada, aberta, concluída)
+    # As manutenções agendadas são geradas automaticamente (ver app/util/agenda.py)
     status = db.Column(db.String(64), index=True)
 
     ### Métodos ###
@@ -1048,6 +1144,9 @@ class Manutencao(db.Model):
         if self.data_conclusao:
             data = self.data_conclusao
             str_status = 'concluída'
+        elif self.status == 'Agendada':
+            data = self.data_abertura
+            str_status = 'agendada'
         else:
             data = self.data_abertura
             str_status = 'aberta'
@@ -1063,6 +1162,9 @@ class Manutencao(db.Model):
         if self.data_conclusao:
             data = self.data_conclusao
             str_status = 'concluída'
+        elif self.status == 'Agendada':
+            data = self.data_abertura
+            str_status = 'agendada'
         else:
             data = self.data_abertura
             str_status = 'aberta'
@@ -1102,6 +1204,9 @@ class UnidadeResponsavel(db.Model):
                                             backref='unidade_responsavel',
                                             lazy='dynamic')
 
+    # Relação de blocos sob responsabilidade da unidade
+    blocos = db.relationship('Bloco', backref='unidade_responsavel', lazy='dynamic')
+
     ### Métodos ###
 
     # Representação no shell
@@ -1140,6 +1245,9 @@ class UnidadeConsumidora(db.Model):
     # Georeferenciamento (marcador no mapa)
     localizacao = db.Column(Geometry("POINT"))
 
+    # GeoJSON e tipo da geometria (para exibição no painel de administração)
+    localizacao_geojson, localizacao_tipo = propriedades_mapa(localizacao)
+
     # Número do cliente
     num_cliente = db.Column(db.Integer, unique=True, nullable=False)
 
@@ -1220,3 +1328,954 @@ class Conta(db.Model):
         return '%s [%s]' % \
                 (self.unidade_consumidora.nome, self.data_leitura.strftime("%d.%m.%Y"))
 
+
+########## Índices Parciais e Compostos ##########
+
+
+# Índices ajustados às consultas mais frequentes das listagens e dos cálculos de
+# manutenção (as condições "postgresql_where" geram índices parciais, que contêm
+# apenas as linhas que as consultas de fato buscam)
+# Comparação dos planos de execução: "python launcher.py comparar_indices"
+
+
+# Manutenções agendadas: equipamentos em uso e fora de manutenção, ordenados pela
+# próxima manutenção
+db.Index('ix_equipamentos_agendados', Equipamento.proxima_manutencao,
+         postgresql_where=db.and_(Equipamento.em_uso == True,
+                                  Equipamento.em_manutencao == False))
+
+# Tombamento único (0 indica equipamento sem tombamento e pode se repetir)
+# Também atende à verificação de tombamento existente dos formulários
+db.Index('ix_equipamentos_tombamento', Equipamento.tombamento, unique=True,
+         postgresql_where=Equipamento.tombamento != 0)
+
+# Última manutenção concluída de um equipamento (cálculo da próxima manutenção)
+db.Index('ix_manutencoes_concluidas', Manutencao.id_equipamento,
+         Manutencao.data_conclusao,
+         postgresql_where=Manutencao.status == u'Concluída')
+
+# Manutenções abertas, ordenadas por data de abertura
+db.Index('ix_manutencoes_abertas', Manutencao.data_abertura,
+         postgresql_where=Manutencao.status == u'Aberta')
+
+# Histórico de manutenções de um equipamento (relação "manutencoes" e cálculo
+# dos indicadores de confiabilidade)
+db.Index('ix_manutencoes_equipamento_abertura', Manutencao.id_equipamento,
+         Manutencao.data_abertura)
+
+# Manutenções agendadas (geradas automaticamente), ordenadas pela data prevista
+db.Index('ix_manutencoes_agendadas', Manutencao.data_abertura,
+         postgresql_where=Manutencao.status == u'Agendada')
+
+# Histórico de contas de uma unidade consumidora, por data de leitura
+db.Index('ix_contas_unidade_leitura', Conta.id_unidade_consumidora,
+         Conta.data_leitura)
+
+
+##### Índices de Trigramas #####
+
+
+# Buscas por trecho de texto (ILIKE '%termo%') dos campos de seleção com busca
+# remota do painel de administração (arquivo 'administracao/ajax.py')
+# Requerem a extensão "pg_trgm" do PostgreSQL
+
+
+# Índice GIN de trigramas de uma coluna de texto
+def indice_trigramas(nome, coluna):
+    return db.Index(nome, coluna, postgresql_using='gin',
+                    postgresql_ops={coluna.key: 'gin_trgm_ops'})
+
+
+indice_trigramas('ix_usuarios_nome_trgm', Usuario.nome)
+indice_trigramas('ix_usuarios_email_trgm', Usuario.email)
+indice_trigramas('ix_blocos_nome_trgm', Bloco.nome)
+indice_trigramas('ix_ambientes_nome_trgm', Ambiente.nome)
+indice_trigramas('ix_ambientes_caminho_local_trgm', Ambiente.caminho_local)
+indice_trigramas('ix_equipamentos_tipo_trgm', Equipamento.tipo_equipamento)
+indice_trigramas('ix_equipamentos_caminho_local_trgm', Equipamento.caminho_local)
+
+
+########## Localização Desnormalizada de Ambientes e Equipamentos ##########
+
+
+# Ambientes e equipamentos guardam os ids de toda a sua hierarquia de locais e
+# um caminho de localização já formatado, para que listagens e filtros não
+# precisem da cadeia de joins Ambiente -> Bloco -> Departamento -> Centro -> Campus.
+# Estas cópias são mantidas pelos eventos abaixo e podem ser reconstruídas com
+# o comando "python launcher.py reparar_locais".
+
+# Atualiza em lote os campos de localização dos ambientes que satisfazem a
+# condição (expressão sobre a tabela de ambientes) e de seus equipamentos.
+# Sem condição, todos os ambientes e equipamentos são atualizados.
+def atualizar_locais(conexao, condicao=None):
+    atualizar_locais_ambientes(conexao, condicao)
+    atualizar_locais_equipamentos(conexao, condicao)
+
+
+# UPDATE ambientes ... FROM blocos, departamentos, centros, campi
+def atualizar_locais_ambientes(conexao, condicao=None):
+    ambientes = Ambiente.__table__
+    blocos = Bloco.__table__
+    departamentos = Departamento.__table__
+    centros = Centro.__table__
+    campi = Campus.__table__
+
+    atualizacao = ambientes.update()\
+        .where(ambientes.c.id_bloco == blocos.c.id)\
+        .where(blocos.c.id_departamento == departamentos.c.id)\
+        .where(departamentos.c.id_centro == centros.c.id)\
+        .where(centros.c.id_campus == campi.c.id)\
+        .values(id_departamento=departamentos.c.id,
+                id_centro=centros.c.id,
+                id_campus=campi.c.id,
+                caminho_local=blocos.c.nome + ' - ' + departamentos.c.nome + ' - ' +
+                              centros.c.nome + ' - ' + campi.c.nome)
+
+    if condicao is not None:
+        atualizacao = atualizacao.where(condicao)
+
+    conexao.execute(atualizacao)
+
+
+# UPDATE equipamentos ... FROM ambientes
+def atualizar_locais_equipamentos(conexao, condicao=None):
+    equipamentos = Equipamento.__table__
+    ambientes = Ambiente.__table__
+
+    atualizacao = equipamentos.update()\
+        .where(equipamentos.c.id_ambiente == ambientes.c.id)\
+        .values(id_bloco=ambientes.c.id_bloco,
+                id_departamento=ambientes.c.id_departamento,
+                id_centro=ambientes.c.id_centro,
+                id_campus=ambientes.c.id_campus,
+                caminho_local=ambientes.c.nome + ' - ' + ambientes.c.caminho_local)
+
+    if condicao is not None:
+        atualizacao = atualizacao.where(condicao)
+
+    conexao.execute(atualizacao)
+
+
+# Testa se algum dos atributos do objeto foi alterado no flush atual
+def alterado(objeto, *atributos):
+    estado = inspect(objeto)
+
+    return any(estado.attrs[atributo].history.has_changes() for atributo in atributos)
+
+
+##### Eventos #####
+
+
+# Ambientes: ao definir ou mudar o bloco, copiar a hierarquia do novo bloco
+@event.listens_for(Ambiente, 'before_insert', propagate=True)
+@event.listens_for(Ambiente, 'before_update', propagate=True)
+def copiar_local_ambiente(mapper, conexao, ambiente):
+    if not alterado(ambiente, 'id_bloco'):
+        return
+
+    blocos = Bloco.__table__
+    departamentos = Departamento.__table__
+    centros = Centro.__table__
+    campi = Campus.__table__
+
+    # Busca da hierarquia do bloco (uma única linha, pelas chaves primárias)
+    linha = conexao.execute(
+        select([departamentos.c.id, centros.c.id, campi.c.id,
+                blocos.c.nome + ' - ' + departamentos.c.nome + ' - ' +
+                centros.c.nome + ' - ' + campi.c.nome])
+        .where(blocos.c.id == ambiente.id_bloco)
+        .where(blocos.c.id_departamento == departamentos.c.id)
+        .where(departamentos.c.id_centro == centros.c.id)
+        .where(centros.c.id_campus == campi.c.id)).first()
+
+    if linha is None:
+        linha = (None, None, None, None)
+
+    ambiente.id_departamento, ambiente.id_centro, ambiente.id_campus, \
+        ambiente.caminho_local = linha
+
+
+# Ambientes: mudanças de nome ou de bloco são propagadas para os equipamentos
+@event.listens_for(Ambiente, 'after_update', propagate=True)
+def propagar_local_ambiente(mapper, conexao, ambiente):
+    if alterado(ambiente, 'nome', 'id_bloco'):
+        atualizar_locais_equipamentos(conexao, Ambiente.__table__.c.id == ambiente.id)
+
+
+# Equipamentos: ao definir ou mudar o ambiente, copiar a hierarquia do novo ambiente
+@event.listens_for(Equipamento, 'before_insert', propagate=True)
+@event.listens_for(Equipamento, 'before_update', propagate=True)
+def copiar_local_equipamento(mapper, conexao, equipamento):
+    if not alterado(equipamento, 'id_ambiente'):
+        return
+
+    ambientes = Ambiente.__table__
+
+    linha = conexao.execute(
+        select([ambientes.c.id_bloco, ambientes.c.id_departamento,
+                ambientes.c.id_centro, ambientes.c.id_campus,
+                ambientes.c.nome + ' - ' + ambientes.c.caminho_local])
+        .where(ambientes.c.id == equipamento.id_ambiente)).first()
+
+    if linha is None:
+        linha = (None, None, None, None, None)
+
+    equipamento.id_bloco, equipamento.id_departamento, equipamento.id_centro, \
+        equipamento.id_campus, equipamento.caminho_local = linha
+
+
+# Blocos, departamentos, centros e campi: mudanças de nome ou de local superior
+# são propagadas em lote para todos os ambientes e equipamentos abaixo deles
+
+@event.listens_for(Bloco, 'after_update')
+def propagar_local_bloco(mapper, conexao, bloco):
+    if alterado(bloco, 'nome', 'id_departamento'):
+        atualizar_locais(conexao, Ambiente.__table__.c.id_bloco == bloco.id)
+
+
+@event.listens_for(Departamento, 'after_update')
+def propagar_local_departamento(mapper, conexao, departamento):
+    if alterado(departamento, 'nome', 'id_centro'):
+        atualizar_locais(conexao,
+                         Ambiente.__table__.c.id_departamento == departamento.id)
+
+
+@event.listens_for(Centro, 'after_update')
+def propagar_local_centro(mapper, conexao, centro):
+    if alterado(centro, 'nome', 'id_campus'):
+        atualizar_locais(conexao, Ambiente.__table__.c.id_centro == centro.id)
+
+
+@event.listens_for(Campus, 'after_update')
+def propagar_local_campus(mapper, conexao, campus):
+    if alterado(campus, 'nome'):
+        atualizar_locais(conexao, Ambiente.__table__.c.id_campus == campus.id)
+
+
+########## Hierarquia de Locais (Tabela de Fechamento) ##########
+
+
+# Tabela de fechamento (closure table) da hierarquia de locais
+# [Instituição -> Campus -> Centro -> Departamento -> Bloco -> Ambiente]
+# Cada linha liga um local a um de seus descendentes, em qualquer profundidade
+# (inclusive ao próprio local, com profundidade 0). Assim, todos os ancestrais
+# ou todos os descendentes de um local são obtidos com uma única consulta
+# indexada, sem uma cadeia de joins de profundidade fixa.
+# Os locais são identificados pelo par (tipo, id), em que o tipo é o nome da
+# tabela do local. A tabela é mantida pelos eventos abaixo e pode ser
+# reconstruída com o comando "python launcher.py reconstruir_hierarquia".
+class HierarquiaLocal(db.Model):
+    # Nome da tabela no banco de dados
+    __tablename__ = 'hierarquia_locais'
+
+    # Índices compostos para as buscas de descendentes e de ancestrais
+    __table_args__ = (db.Index('ix_hierarquia_locais_ancestral',
+                               'tipo_ancestral', 'id_ancestral', 'tipo_descendente'),
+                      db.Index('ix_hierarquia_locais_descendente',
+                               'tipo_descendente', 'id_descendente'))
+
+    ### Colunas ###
+
+    # ID na tabela
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Local ancestral (tipo e id)
+    tipo_ancestral = db.Column(db.String(32), nullable=False)
+    id_ancestral = db.Column(db.Integer, nullable=False)
+
+    # Local descendente (tipo e id)
+    tipo_descendente = db.Column(db.String(32), nullable=False)
+    id_descendente = db.Column(db.Integer, nullable=False)
+
+    # Distância entre os dois locais na hierarquia (0 = o próprio local)
+    profundidade = db.Column(db.Integer, nullable=False)
+
+    ### Métodos ###
+
+    # Subconsulta com os ids dos locais de um dado tipo que estão abaixo de um
+    # local (incluindo o próprio local, caso seja do mesmo tipo)
+    # Ex.: ambientes de um centro -> subarvore('centros', id, 'ambientes')
+    @staticmethod
+    def subarvore(tipo, id, tipo_descendente):
+        hierarquia = HierarquiaLocal.__table__
+
+        return select([hierarquia.c.id_descendente])\
+            .where(hierarquia.c.tipo_ancestral == tipo)\
+            .where(hierarquia.c.id_ancestral == id)\
+            .where(hierarquia.c.tipo_descendente == tipo_descendente)
+
+    # Query dos ancestrais de um local (do mais próximo ao mais distante)
+    @staticmethod
+    def ancestrais(tipo, id):
+        return HierarquiaLocal.query\
+            .filter_by(tipo_descendente=tipo, id_descendente=id)\
+            .filter(HierarquiaLocal.profundidade > 0)\
+            .order_by(HierarquiaLocal.profundidade)
+
+    # Opções de locais para os filtros de subárvore, no formato
+    # ('tipo:id', 'Tipo: Nome'), da instituição até os blocos
+    @staticmethod
+    def opcoes_locais():
+        opcoes = []
+
+        for modelo, coluna_superior in NIVEIS_HIERARQUIA[:-1]:
+            for id, nome in db.session.query(modelo.id, modelo.nome).order_by(modelo.nome):
+                opcoes.append(('%s:%d' % (modelo.__tablename__, id),
+                               '%s: %s' % (modelo.nome_formatado_singular, nome)))
+
+        return opcoes
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Hierarquia: %s %d -> %s %d [%d]>' % \
+                (self.tipo_ancestral, self.id_ancestral,
+                 self.tipo_descendente, self.id_descendente, self.profundidade)
+
+
+# Níveis da hierarquia de locais (de cima para baixo) e a coluna de cada
+# modelo que referencia o local do nível superior
+NIVEIS_HIERARQUIA = [(Instituicao, None),
+                     (Campus, 'id_instituicao'),
+                     (Centro, 'id_campus'),
+                     (Departamento, 'id_centro'),
+                     (Bloco, 'id_departamento'),
+                     (Ambiente, 'id_bloco')]
+
+# Dicionário tipo do local -> (coluna do local superior, tipo do local superior)
+LOCAIS_SUPERIORES = dict(
+    (modelo.__tablename__, (coluna, NIVEIS_HIERARQUIA[i - 1][0].__tablename__ if i else None))
+    for i, (modelo, coluna) in enumerate(NIVEIS_HIERARQUIA))
+
+
+# Liga a subárvore de um local (ele e seus descendentes) a todos os ancestrais
+# de um novo local superior (ele incluso), com uma única inserção em lote
+def ligar_subarvore(conexao, tipo, id, tipo_superior, id_superior):
+    hierarquia = HierarquiaLocal.__table__
+    superior = hierarquia.alias('superior')
+    subarvore = hierarquia.alias('subarvore')
+
+    conexao.execute(hierarquia.insert().from_select(
+        ['tipo_ancestral', 'id_ancestral', 'tipo_descendente', 'id_descendente',
+         'profundidade'],
+        select([superior.c.tipo_ancestral, superior.c.id_ancestral,
+                subarvore.c.tipo_descendente, subarvore.c.id_descendente,
+                superior.c.profundidade + subarvore.c.profundidade + 1])
+        .where(superior.c.tipo_descendente == tipo_superior)
+        .where(superior.c.id_descendente == id_superior)
+        .where(subarvore.c.tipo_ancestral == tipo)
+        .where(subarvore.c.id_ancestral == id)))
+
+
+# Desliga a subárvore de um local de todos os seus ancestrais atuais
+# (as ligações internas da subárvore são mantidas)
+def desligar_subarvore(conexao, tipo, id):
+    hierarquia = HierarquiaLocal.__table__
+    subarvore = hierarquia.alias('subarvore')
+    ancestrais = hierarquia.alias('ancestrais')
+
+    conexao.execute(hierarquia.delete()
+        .where(tuple_(hierarquia.c.tipo_descendente, hierarquia.c.id_descendente).in_(
+            select([subarvore.c.tipo_descendente, subarvore.c.id_descendente])
+            .where(subarvore.c.tipo_ancestral == tipo)
+            .where(subarvore.c.id_ancestral == id)))
+        .where(tuple_(hierarquia.c.tipo_ancestral, hierarquia.c.id_ancestral).in_(
+            select([ancestrais.c.tipo_ancestral, ancestrais.c.id_ancestral])
+            .where(ancestrais.c.tipo_descendente == tipo)
+            .where(ancestrais.c.id_descendente == id)
+            .where(ancestrais.c.profundidade > 0))))
+
+
+# Reconstrói toda a tabela de fechamento, nível por nível
+def reconstruir_hierarquia(conexao):
+    hierarquia = HierarquiaLocal.__table__
+
+    conexao.execute(hierarquia.delete())
+
+    colunas = ['tipo_ancestral', 'id_ancestral', 'tipo_descendente', 'id_descendente',
+               'profundidade']
+
+    for modelo, coluna_superior in NIVEIS_HIERARQUIA:
+        tabela = modelo.__table__
+        tipo = tabela.name
+
+        # Ligação de cada local a si mesmo
+        conexao.execute(hierarquia.insert().from_select(colunas,
+            select([literal(tipo), tabela.c.id.label('id_ancestral'),
+                    literal(tipo), tabela.c.id.label('id_descendente'), literal(0)])))
+
+        # Ligação de cada local aos ancestrais do seu local superior
+        if coluna_superior is not None:
+            tipo_superior = LOCAIS_SUPERIORES[tipo][1]
+
+            conexao.execute(hierarquia.insert().from_select(colunas,
+                select([hierarquia.c.tipo_ancestral, hierarquia.c.id_ancestral,
+                        literal(tipo), tabela.c.id, hierarquia.c.profundidade + 1])
+                .where(hierarquia.c.tipo_descendente == tipo_superior)
+                .where(hierarquia.c.id_descendente == tabela.c[coluna_superior])))
+
+
+##### Eventos #####
+
+
+# Tipo de um local (nome da tabela do modelo base, no caso dos ambientes)
+def tipo_local(mapper):
+    return mapper.base_mapper.local_table.name
+
+
+# Novo local: ligação a si mesmo e aos ancestrais do local superior
+def inserir_local_hierarquia(mapper, conexao, local):
+    tipo = tipo_local(mapper)
+    coluna_superior, tipo_superior = LOCAIS_SUPERIORES[tipo]
+
+    conexao.execute(HierarquiaLocal.__table__.insert().values(
+        tipo_ancestral=tipo, id_ancestral=local.id,
+        tipo_descendente=tipo, id_descendente=local.id, profundidade=0))
+
+    if coluna_superior is not None and getattr(local, coluna_superior) is not None:
+        ligar_subarvore(conexao, tipo, local.id,
+                        tipo_superior, getattr(local, coluna_superior))
+
+
+# Mudança de local superior: a subárvore é movida para o novo local superior
+def mover_local_hierarquia(mapper, conexao, local):
+    tipo = tipo_local(mapper)
+    coluna_superior, tipo_superior = LOCAIS_SUPERIORES[tipo]
+
+    if coluna_superior is None or not alterado(local, coluna_superior):
+        return
+
+    desligar_subarvore(conexao, tipo, local.id)
+
+    if getattr(local, coluna_superior) is not None:
+        ligar_subarvore(conexao, tipo, local.id,
+                        tipo_superior, getattr(local, coluna_superior))
+
+
+# Remoção de local: remoção de todas as suas ligações
+def remover_local_hierarquia(mapper, conexao, local):
+    hierarquia = HierarquiaLocal.__table__
+    tipo = tipo_local(mapper)
+
+    conexao.execute(hierarquia.delete().where(or_(
+        and_(hierarquia.c.tipo_ancestral == tipo, hierarquia.c.id_ancestral == local.id),
+        and_(hierarquia.c.tipo_descendente == tipo, hierarquia.c.id_descendente == local.id))))
+
+
+for modelo, coluna_superior in NIVEIS_HIERARQUIA:
+    event.listen(modelo, 'after_insert', inserir_local_hierarquia, propagate=True)
+    event.listen(modelo, 'after_update', mover_local_hierarquia, propagate=True)
+    event.listen(modelo, 'after_delete', remover_local_hierarquia, propagate=True)
+
+
+########## Indicadores de Confiabilidade dos Equipamentos ##########
+
+
+# Indicadores de confiabilidade de cada equipamento, calculados a partir do seu
+# histórico de manutenções (app/util/confiabilidade.py) e materializados nesta
+# tabela. Além dos indicadores, são guardadas as somas que os originam, para que
+# os indicadores por tipo, fabricante ou bloco sejam obtidos com um GROUP BY.
+# Os valores que dependem da data atual (tempo de vida, MTBF, taxa de falhas) são
+# calculados na consulta, a partir das datas gravadas. Equipamentos sem histórico
+# têm uma linha zerada.
+# Quando uma manutenção muda, a linha do equipamento é apenas marcada como
+# desatualizada (eventos abaixo) e recalculada na próxima atualização.
+class IndicadorConfiabilidade(db.Model):
+    # Nome da tabela no banco de dados
+    __tablename__ = 'indicadores_confiabilidade'
+
+    ### Colunas ###
+
+    # Equipamento (uma linha por equipamento)
+    id_equipamento = db.Column(db.Integer,
+                               db.ForeignKey('equipamentos.id', ondelete='CASCADE'),
+                               primary_key=True)
+
+    # Número de manutenções (exceto a inicial), por tipo
+    num_manutencoes = db.Column(db.Integer, nullable=False, default=0)
+    num_preventivas = db.Column(db.Integer, nullable=False, default=0)
+    num_corretivas = db.Column(db.Integer, nullable=False, default=0)
+    num_trocas = db.Column(db.Integer, nullable=False, default=0)
+
+    # Número de falhas (manutenções corretivas e trocas)
+    num_falhas = db.Column(db.Integer, nullable=False, default=0)
+
+    # Número de reparos concluídos (falhas com data de conclusão)
+    num_reparos = db.Column(db.Integer, nullable=False, default=0)
+
+    # Data da manutenção inicial (ou da primeira registrada)
+    data_inicio = db.Column(db.Date)
+
+    # Data de abertura da manutenção em andamento (None, caso não haja)
+    inicio_manutencao_aberta = db.Column(db.Date)
+
+    # Dias parado em manutenções concluídas (todas, exceto a inicial)
+    # Somado ao tempo da manutenção em andamento, é usado como indicador de custo
+    # do ciclo de vida
+    dias_parado = db.Column(db.Integer, nullable=False, default=0)
+
+    # Soma das durações dos reparos concluídos [dias]
+    dias_reparo = db.Column(db.Integer, nullable=False, default=0)
+
+    # Tempo médio de reparo [dias]
+    mttr = db.Column(db.Float)
+
+    # Razão entre manutenções corretivas e preventivas
+    razao_corretiva_preventiva = db.Column(db.Float)
+
+    # Data e hora do último cálculo
+    atualizado_em = db.Column(db.DateTime)
+
+    # Indica que o histórico de manutenções mudou desde o último cálculo
+    desatualizado = db.Column(db.Boolean, nullable=False, default=False, index=True)
+
+    # Equipamento dos indicadores
+    equipamento = db.relationship('Equipamento',
+                                  backref=db.backref('indicador_confiabilidade',
+                                                     uselist=False,
+                                                     passive_deletes=True))
+
+    ### Métodos ###
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Indicadores de Confiabilidade: Equipamento %d>' % self.id_equipamento
+
+
+# Marca os indicadores dos equipamentos dados como desatualizados
+def marcar_indicadores_desatualizados(conexao, ids_equipamentos):
+    indicadores = IndicadorConfiabilidade.__table__
+
+    conexao.execute(indicadores.update()
+                    .where(indicadores.c.id_equipamento.in_(ids_equipamentos))
+                    .values(desatualizado=True))
+
+
+##### Eventos #####
+
+
+# Manutenção criada, alterada ou excluída: os indicadores do seu equipamento
+# (e do equipamento anterior, caso tenha sido trocado) ficam desatualizados
+def marcar_indicadores_manutencao(mapper, conexao, manutencao):
+    ids = set([manutencao.id_equipamento])
+
+    ids.update(inspect(manutencao).attrs.id_equipamento.history.deleted)
+
+    ids.discard(None)
+
+    if ids:
+        marcar_indicadores_desatualizados(conexao, list(ids))
+
+
+event.listen(Manutencao, 'after_insert', marcar_indicadores_manutencao)
+event.listen(Manutencao, 'after_update', marcar_indicadores_manutencao)
+event.listen(Manutencao, 'after_delete', marcar_indicadores_manutencao)
+
+
+########## Agenda de Manutenções Preventivas ##########
+
+
+# As manutenções preventivas futuras de cada equipamento são materializadas como
+# manutenções com status "Agendada" (ver app/util/agenda.py). Um equipamento
+# cujos dados de agendamento mudam é marcado com "agenda_desatualizada", e apenas
+# os equipamentos marcados têm suas manutenções agendadas geradas novamente.
+# Os comandos em lote de app/util/manutencoes.py marcam os equipamentos diretamente.
+
+
+# Equipamento alterado pelo ORM: marcar a agenda como desatualizada caso algum
+# dado usado no agendamento tenha mudado
+@event.listens_for(Equipamento, 'before_update', propagate=True)
+def marcar_agenda_equipamento(mapper, conexao, equipamento):
+    if alterado(equipamento, 'proxima_manutencao', 'intervalo_manutencao',
+                'em_uso', 'em_manutencao'):
+        equipamento.agenda_desatualizada = True
+
+
+########## Versão dos Usuários ##########
+
+
+# A versão de um usuário é incrementada a cada alteração do seu cadastro e, para
+# todos os usuários de um cargo, a cada alteração das permissões do cargo. As
+# cópias em cache dos usuários da sessão são usadas apenas enquanto a versão do
+# usuário no banco de dados não muda (ver app/util/usuarios.py).
+
+
+# Usuário alterado pelo ORM: incrementar a versão (no próprio UPDATE, para não
+# repetir uma versão já incrementada pela alteração do cargo)
+@event.listens_for(Usuario, 'before_update')
+def incrementar_versao_usuario(mapper, conexao, usuario):
+    if alterado(usuario, 'nome', 'email', 'senha_hash', 'verificado', 'confirmado',
+                'id_cargo', 'cargo', 'id_unidade_responsavel'):
+        usuario.versao = Usuario.versao + 1
+
+
+# Cargo alterado ou excluído pelo ORM: incrementar a versão dos seus usuários
+@event.listens_for(Cargo, 'after_update')
+@event.listens_for(Cargo, 'after_delete')
+def incrementar_versao_usuarios_cargo(mapper, conexao, cargo):
+    usuarios = Usuario.__table__
+
+    conexao.execute(usuarios.update()
+                            .where(usuarios.c.id_cargo == cargo.id)
+                            .values(versao=usuarios.c.versao + 1))
+
+
+########## Tarefas de Exportação em Segundo Plano ##########
+
+
+# Exportações grandes não são geradas durante o request: uma tarefa é criada na
+# fila (esta tabela) e executada por um processo separado ("python launcher.py
+# executar_tarefas", ver app/util/tarefas.py), que registra o progresso e guarda
+# o arquivo gerado (compactado) para download.
+class TarefaExportacao(db.Model):
+    # Nome da tabela no banco de dados
+    __tablename__ = 'tarefas_exportacao'
+
+    # Nome formatado no singular e plural (para eventual exibição)
+    nome_formatado_singular = 'Exportação'
+    nome_formatado_plural = 'Exportações'
+
+    # Endpoint a ser utilizado no painel de administração
+    endpoint = 'tarefaexportacao'
+
+    ### Colunas ###
+
+    # ID na tabela
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Usuário que solicitou a exportação
+    id_usuario = db.Column(db.Integer,
+                           db.ForeignKey('usuarios.id', ondelete='CASCADE'),
+                           index=True)
+
+    # Endpoint e nome da view de listagem exportada
+    endpoint_view = db.Column(db.String(64), nullable=False)
+    nome_view = db.Column(db.String(64), nullable=False)
+
+    # Formato do arquivo ('csv' ou 'xlsx')
+    formato = db.Column(db.String(8), nullable=False)
+
+    # Parâmetros da listagem (query string com busca, filtros e ordenação)
+    parametros = db.Column(db.Text, nullable=False, default='')
+
+    # Status da tarefa ('Pendente', 'Em Execução', 'Concluída' ou 'Falha')
+    status = db.Column(db.String(16), nullable=False, default='Pendente')
+
+    # Progresso: linhas já exportadas e total de linhas
+    linhas_exportadas = db.Column(db.Integer, nullable=False, default=0)
+    total_linhas = db.Column(db.Integer)
+
+    # Datas e horas de criação, início e conclusão da tarefa
+    criada_em = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    iniciada_em = db.Column(db.DateTime)
+    concluida_em = db.Column(db.DateTime)
+
+    # Mensagem de erro (tarefas com falha)
+    erro = db.Column(db.Text)
+
+    # Arquivo gerado: nome, tamanho [bytes] e conteúdo compactado (CSV com gzip;
+    # o XLSX já é compactado). O conteúdo só é carregado no download.
+    nome_arquivo = db.Column(db.String(128))
+    tamanho_arquivo = db.Column(db.Integer)
+    arquivo = db.deferred(db.Column(db.LargeBinary))
+
+    # Usuário que solicitou a exportação
+    usuario = db.relationship('Usuario',
+                              backref=db.backref('tarefas_exportacao',
+                                                 lazy='dynamic',
+                                                 passive_deletes=True))
+
+    # Fila: tarefas pendentes, por ordem de criação
+    __table_args__ = (db.Index('ix_tarefas_exportacao_pendentes', 'criada_em',
+                               postgresql_where=db.text("status = 'Pendente'")),)
+
+    ### Métodos ###
+
+    # Progresso da exportação [%]
+    @property
+    def progresso(self):
+        if self.status == 'Concluída':
+            return 100
+
+        if not self.total_linhas:
+            return 0
+
+        return min(100, 100 * self.linhas_exportadas // self.total_linhas)
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Exportação: %s [%s]>' % (self.nome_view, self.status)
+
+    # Representação na interface
+    def __str__(self):
+        return '%s (%s) [%s]' % (self.nome_view, self.formato.upper(), self.status)
+
+
+########## Registro de Auditoria do Painel de Administração ##########
+
+
+# Alterações (criação, edição e exclusão) feitas nas views do painel de
+# administração. Os registros são gravados em segundo plano, em lotes
+# ('util/auditoria.py'), e consultados por modelo e id do registro alterado.
+class RegistroAuditoria(db.Model):
+    # Nome da tabela no banco de dados
+    __tablename__ = 'registros_auditoria'
+
+    # Nome formatado no singular e plural (para eventual exibição)
+    nome_formatado_singular = 'Registro de Auditoria'
+    nome_formatado_plural = 'Auditoria'
+
+    # Endpoint a ser utilizado no painel de administração
+    endpoint = 'registroauditoria'
+
+    ### Colunas ###
+
+    # ID na tabela
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Data e hora da alteração
+    data_hora = db.Column(db.DateTime, nullable=False, index=True)
+
+    # Usuário que fez a alteração (o email é mantido caso o usuário seja excluído)
+    id_usuario = db.Column(db.Integer,
+                           db.ForeignKey('usuarios.id', ondelete='SET NULL'),
+                           index=True)
+    email_usuario = db.Column(db.String(64))
+
+    # Modelo (endpoint) e id do registro alterado
+    modelo = db.Column(db.String(64), nullable=False)
+    id_registro = db.Column(db.Integer, nullable=False)
+
+    # Operação ('Criação', 'Edição' ou 'Exclusão')
+    operacao = db.Column(db.String(16), nullable=False)
+
+    # Alterações, em JSON: {campo: [valor anterior, valor novo]}
+    alteracoes = db.Column(db.Text)
+
+    # Usuário que fez a alteração
+    usuario = db.relationship('Usuario',
+                              backref=db.backref('registros_auditoria',
+                                                 lazy='dynamic',
+                                                 passive_deletes=True))
+
+    # Histórico de um registro (por modelo e id, mais recentes primeiro)
+    __table_args__ = (db.Index('ix_registros_auditoria_registro',
+                               'modelo', 'id_registro', 'data_hora'),)
+
+    ### Métodos ###
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Registro de Auditoria: %s %s %d>' % \
+            (self.operacao, self.modelo, self.id_registro)
+
+    # Representação na interface
+    def __str__(self):
+        return '%s de %s %d' % (self.operacao, self.modelo, self.id_registro)
+
+
+########## Arquivo de Equipamentos Retirados e Manutenções Antigas ##########
+
+
+# Equipamentos fora de uso há muito tempo (com todo o seu histórico) e
+# manutenções concluídas antigas são movidos das tabelas principais para tabelas
+# de arquivo com as mesmas colunas (sem chaves estrangeiras, mantendo os ids),
+# pelo comando "python launcher.py arquivar" (app/util/arquivo.py). Assim, as
+# tabelas principais e seus índices contêm apenas os dados em uso. As visões
+# "historico_equipamentos" e "historico_manutencoes" (UNION ALL das tabelas
+# principais e de arquivo, criadas pela migração) dão acesso ao histórico completo.
+
+
+# Tabela de arquivo de uma tabela principal ("<tabela>_arquivo"), com a data e
+# hora do arquivamento de cada linha (os ids são os da tabela principal)
+def tabela_arquivo(tabela):
+    colunas = [db.Column(coluna.name, coluna.type, primary_key=coluna.primary_key,
+                         nullable=coluna.nullable, autoincrement=False)
+               for coluna in tabela.columns]
+
+    colunas.append(db.Column('arquivado_em', db.DateTime, nullable=False))
+
+    return db.Table(tabela.name + '_arquivo', db.metadata, *colunas)
+
+
+# Tabelas de arquivo (tabela principal -> tabela de arquivo)
+# As tabelas dos tipos de equipamentos vêm antes da tabela de equipamentos, e as
+# manutenções antes de todas (ordem em que as linhas são movidas)
+TABELAS_ARQUIVO = OrderedDict((tabela, tabela_arquivo(tabela)) for tabela in
+                              [Manutencao.__table__, Extintor.__table__,
+                               CondicionadorAr.__table__, Equipamento.__table__])
+
+# Histórico de manutenções arquivadas de um equipamento
+db.Index('ix_manutencoes_arquivo_equipamento_abertura',
+         TABELAS_ARQUIVO[Manutencao.__table__].c.id_equipamento,
+         TABELAS_ARQUIVO[Manutencao.__table__].c.data_abertura)
+
+
+##### Visões do Histórico #####
+
+
+# As visões não fazem parte dos metadados das tabelas (não são criadas por
+# "create_all" nem pelo autogenerate das migrações)
+metadados_visoes = db.MetaData()
+
+
+# Histórico de equipamentos (em uso, retirados e arquivados) - somente leitura
+class HistoricoEquipamento(db.Model):
+    # Visão no banco de dados
+    __table__ = db.Table('historico_equipamentos', metadados_visoes,
+                         db.Column('id', db.Integer, primary_key=True),
+                         db.Column('tombamento', db.Integer),
+                         db.Column('tipo_equipamento', db.String(64)),
+                         db.Column('categoria_equipamento', db.String(64)),
+                         db.Column('fabricante', db.String(64)),
+                         db.Column('caminho_local', db.Text),
+                         db.Column('em_uso', db.Boolean),
+                         db.Column('arquivado', db.Boolean))
+
+    # Nome formatado no singular e plural (para eventual exibição)
+    nome_formatado_singular = 'Equipamento (Histórico)'
+    nome_formatado_plural = 'Equipamentos (Histórico)'
+
+    # Endpoint a ser utilizado no painel de administração
+    endpoint = 'historicoequipamento'
+
+    # Manutenções do equipamento (em uso e arquivadas)
+    manutencoes = db.relationship('HistoricoManutencao', lazy='dynamic', viewonly=True,
+        primaryjoin='foreign(HistoricoManutencao.id_equipamento) == HistoricoEquipamento.id',
+        backref=db.backref('equipamento', viewonly=True))
+
+    ### Métodos ###
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Histórico de %s: %d>' % (self.tipo_equipamento, self.tombamento)
+
+    # Representação na interface
+    def __str__(self):
+        return '%s %d [%s]' % (self.tipo_equipamento, self.tombamento, self.caminho_local)
+
+
+# Histórico de manutenções (principais e arquivadas) - somente leitura
+class HistoricoManutencao(db.Model):
+    # Visão no banco de dados
+    __table__ = db.Table('historico_manutencoes', metadados_visoes,
+                         db.Column('id', db.Integer, primary_key=True),
+                         db.Column('num_ordem_servico', db.Integer),
+                         db.Column('id_equipamento', db.Integer),
+                         db.Column('data_abertura', db.Date),
+                         db.Column('data_conclusao', db.Date),
+                         db.Column('tipo_manutencao', db.String(64)),
+                         db.Column('descricao_servico', db.Text),
+                         db.Column('status', db.String(64)),
+                         db.Column('arquivada', db.Boolean))
+
+    # Nome formatado no singular e plural (para eventual exibição)
+    nome_formatado_singular = 'Manutenção (Histórico)'
+    nome_formatado_plural = 'Manutenções (Histórico)'
+
+    # Endpoint a ser utilizado no painel de administração
+    endpoint = 'historicomanutencao'
+
+    ### Métodos ###
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Histórico de Manutenção: %d [%s]>' % (self.num_ordem_servico,
+                                                       self.tipo_manutencao)
+
+    # Representação na interface
+    def __str__(self):
+        return '%d [%s] %s em %s' % (self.num_ordem_servico, self.tipo_manutencao,
+            self.status, (self.data_conclusao or self.data_abertura).strftime('%d.%m.%Y'))
+
+
+########## Particionamento por Ano ##########
+
+
+# As tabelas de manutenções e de contas crescem continuamente e são consultadas
+# principalmente por intervalos recentes. No PostgreSQL (versão 11 ou superior),
+# elas são particionadas por intervalo de ano da coluna de data (PARTITION BY
+# RANGE), com uma partição "<tabela>_<ano>" por ano e uma partição padrão
+# "<tabela>_padrao" para as datas fora dos anos criados. As consultas filtradas
+# pela data leem apenas as partições dos anos envolvidos, e os anos antigos podem
+# ser desanexados sem reescrever a tabela.
+#
+# O particionamento é feito pela migração (o SQLAlchemy 1.1 não o declara nos
+# modelos): no banco, a chave primária passa a incluir a coluna de data, mas os
+# modelos continuam identificados apenas pelo id (gerado pela mesma sequência).
+# As partições dos próximos anos são criadas pelo comando
+# "python launcher.py criar_particoes" (app/util/particoes.py), também executado
+# no deploy.
+
+
+# Tabelas particionadas (tabela -> coluna de data do particionamento)
+TABELAS_PARTICIONADAS = OrderedDict([(Manutencao.__table__, 'data_abertura'),
+                                     (Conta.__table__, 'data_leitura')])
+
+
+########## Caixa de Saída de Emails ##########
+
+
+# Os emails da aplicação não são enviados no request: a mensagem já montada é
+# gravada na caixa de saída na mesma transação do request (se o request falhar,
+# o email não é enviado) e enviada depois pelo comando
+# "python launcher.py enviar_emails" (app/util/caixa_saida.py), que tenta
+# novamente as mensagens com falha, com esperas crescentes.
+
+
+# Mensagem de email a enviar (ou já enviada)
+class MensagemSaida(db.Model):
+    # Nome da tabela no banco de dados
+    __tablename__ = 'caixa_saida'
+
+    # Nome formatado no singular e plural (para eventual exibição)
+    nome_formatado_singular = 'Email'
+    nome_formatado_plural = 'Caixa de Saída'
+
+    # Endpoint a ser utilizado no painel de administração
+    endpoint = 'mensagemsaida'
+
+    ### Colunas ###
+
+    # ID na tabela
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Remetente e destinatários (lista em JSON)
+    remetente = db.Column(db.String(128), nullable=False)
+    destinatarios = db.Column(db.Text, nullable=False)
+
+    # Assunto e conteúdo (texto e HTML)
+    assunto = db.Column(db.String(256), nullable=False)
+    corpo = db.Column(db.Text)
+    html = db.Column(db.Text)
+
+    # Identificação do conteúdo (hash dos destinatários, assunto e conteúdo),
+    # usada para descartar mensagens repetidas
+    chave = db.Column(db.String(40), nullable=False, index=True)
+
+    # Status da mensagem ('Pendente', 'Enviada' ou 'Falha')
+    status = db.Column(db.String(16), nullable=False, default='Pendente')
+
+    # Número de tentativas de envio já feitas e data e hora da próxima
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+
+    # Datas e horas de criação e de envio da mensagem
+    criada_em = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    enviada_em = db.Column(db.DateTime)
+
+    # Mensagem de erro da última tentativa com falha
+    erro = db.Column(db.Text)
+
+    # Fila: mensagens pendentes, pela data e hora da próxima tentativa
+    __table_args__ = (db.Index('ix_caixa_saida_pendentes', 'proxima_tentativa',
+                               postgresql_where=db.text("status = 'Pendente'")),)
+
+    ### Métodos ###
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Email: %s [%s]>' % (self.assunto, self.status)
+
+    # Representação na interface
+    def __str__(self):
+        return '%s [%s]' % (self.assunto, self.status)
@@ -33,3 +33,8 @@ def pagina_nao_encontrada(e):
 def erro_interno_servidor(e):
     return render_template('erros/500.html'), 500
 
+
+# Erro 503 - Serviço Indisponível (ex.: muitos logins simultâneos)
+@principal.app_errorhandler(503)
+def servico_indisponivel(e):
+    return render_template('erros/503.html', descricao=e.description), 503
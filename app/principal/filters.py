@@ -13,6 +13,8 @@ from flask import flash
 from flask_admin.contrib.sqla.filters import *
 from flask_admin.model.base import FilterGroup
 
+from ..administracao.filters import FiltroSubarvoreLocal
+
 
 ########## Funções Auxiliares ##########
 
@@ -36,6 +38,33 @@ def FiltrosOpcoes(query, coluna, nome):
             FilterInList(column=coluna, name=nome, options=opcoes)]     # Na lista
 
 
+# Gera as opções disponíveis para uma coluna de ids de outro modelo, exibindo
+# o nome do objeto referenciado (opções em ordem alfabética)
+def gerar_opcoes_ids(query, coluna_id, modelo):
+    # Obtenção dos possíveis pares (id, nome) (set = conjunto sem repetições)
+    valores = set([tuple(valor) for valor in
+                   query.join(modelo, coluna_id == modelo.id).values(modelo.id, modelo.nome)])
+
+    # Retorno de uma lista de tuples no formato (valor, texto)
+    return sorted(valores, key=lambda opcao: opcao[1])
+
+
+# Gera lista de filtros para colunas de ids de outros modelos
+# O filtro é aplicado diretamente na coluna de ids, sem joins na busca principal
+def FiltrosOpcoesIds(query, coluna_id, modelo, nome):
+    # Geração das opções
+    opcoes = gerar_opcoes_ids(query, coluna_id, modelo)
+
+    return [IntEqualFilter(column=coluna_id, name=nome, options=opcoes),     # Igual
+            IntInListFilter(column=coluna_id, name=nome, options=opcoes)]   # Na lista
+
+
+# Gera filtro de subárvore de locais (registros abaixo de um campus, centro,
+# departamento, ...) para uma coluna de ids de ambientes
+def FiltroLocal(coluna_id_ambiente, nome):
+    return [FiltroSubarvoreLocal(column=coluna_id_ambiente, name=nome)]
+
+
 # Gera lista de filtros para campos do tipo data
 def FiltrosDatas(coluna, nome):
     return [DateEqualFilterMod(column=coluna, name=nome),       # Igual
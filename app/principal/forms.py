@@ -42,3 +42,9 @@ class FormEmailContato(FormBase):
 
     enviar = SubmitField('Enviar')
 
+
+
+# Aplicação dos intervalos de manutenção simulados na previsão de manutenções
+# (os intervalos são lidos da query string da página)
+class FormAplicarIntervalos(FormBase):
+    aplicar = SubmitField('Aplicar Intervalos')
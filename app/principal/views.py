@@ -7,16 +7,23 @@
 ################################################################################
 
 from datetime import date
-from flask import render_template, redirect, url_for, request, current_app
-from flask_login import login_required
+import re
+from flask import render_template, redirect, url_for, request, current_app, \
+                  flash, abort, jsonify, send_file
+from flask_login import login_required, current_user
 from shapely import wkb
-from sqlalchemy import extract
 
 from . import principal
 from .filters import *
-from .forms import FormEmailContato
+from .forms import FormEmailContato, FormAplicarIntervalos
 from ..models import *
 from ..util.email import enviar_email
+from ..util.manutencoes import recalcular_proximas_manutencoes
+from ..util.agenda import atualizar_agenda
+from ..util.previsao import carregar_frota, projetar
+from ..util.confiabilidade import AGRUPAMENTOS, indicadores_agrupados, \
+                                  indicadores_dicionarios
+from ..util.miniaturas import arquivo_miniatura
 
 
 ########## Rotas ##########
@@ -170,8 +177,10 @@ def equipamentos():
     # Também é possível filtrar os resultados de acordo com os valores de determinadas
     # colunas.
 
-    # Query de equipamentos (adicionando joins de outras tabelas)
-    equip_query = Equipamento.query.join(Ambiente, Bloco, Departamento, Centro, Campus)
+    # Query de equipamentos
+    # Os filtros de localização usam os ids desnormalizados do equipamento,
+    # dispensando joins com as tabelas de locais
+    equip_query = Equipamento.query
 
     # Query de equipamentos em uso
     equip_em_uso_query = equip_query.filter(Equipamento.em_uso==True)
@@ -184,16 +193,17 @@ def equipamentos():
                             u'Tipo')
     filtros.extend(FiltrosOpcoes(equip_em_uso_query, Equipamento.categoria_equipamento,
                                  u'Categoria'))
-    filtros.extend(FiltrosOpcoes(equip_em_uso_query, Ambiente.nome,
-                                 u'Ambiente'))
-    filtros.extend(FiltrosOpcoes(equip_em_uso_query, Bloco.nome,
-                                 u'Bloco'))
-    filtros.extend(FiltrosOpcoes(equip_em_uso_query, Departamento.nome,
-                                 u'Departamento'))
-    filtros.extend(FiltrosOpcoes(equip_em_uso_query, Centro.nome,
-                                 u'Centro'))
-    filtros.extend(FiltrosOpcoes(equip_em_uso_query, Campus.nome,
-                                 u'Campus'))
+    filtros.extend(FiltrosOpcoesIds(equip_em_uso_query, Equipamento.id_ambiente, Ambiente,
+                                    u'Ambiente'))
+    filtros.extend(FiltrosOpcoesIds(equip_em_uso_query, Equipamento.id_bloco, Bloco,
+                                    u'Bloco'))
+    filtros.extend(FiltrosOpcoesIds(equip_em_uso_query, Equipamento.id_departamento, Departamento,
+                                    u'Departamento'))
+    filtros.extend(FiltrosOpcoesIds(equip_em_uso_query, Equipamento.id_centro, Centro,
+                                    u'Centro'))
+    filtros.extend(FiltrosOpcoesIds(equip_em_uso_query, Equipamento.id_campus, Campus,
+                                    u'Campus'))
+    filtros.extend(FiltroLocal(Equipamento.id_ambiente, u'Local'))
 
     # Criação dos grupos de filtros e dicionário de indexação dos filtros
     grupos_filtros, indice_filtros = agrupar_filtros(filtros)
@@ -235,9 +245,10 @@ def manutencoes_abertas():
     # Também é possível filtrar os resultados de acordo com os valores de determinadas
     # colunas.
 
-    # Query de manutenções (adicionando joins de outras tabelas)
-    manut_query = Manutencao.query.join(Equipamento, Ambiente, Bloco, Departamento,
-                                        Centro, Campus)
+    # Query de manutenções (adicionando join com a tabela de equipamentos)
+    # Os filtros de localização usam os ids desnormalizados do equipamento,
+    # dispensando joins com as tabelas de locais
+    manut_query = Manutencao.query.join(Manutencao.equipamento)
 
     # Query de manutenções abertas
     manut_abertas_query = manut_query.filter(Manutencao.status=='Aberta')
@@ -250,16 +261,17 @@ def manutencoes_abertas():
                             u'Tipo de Manutenção')
     filtros.extend(FiltrosOpcoes(manut_abertas_query, Equipamento.tipo_equipamento,
                                  u'Tipo de Equipamento'))
-    filtros.extend(FiltrosOpcoes(manut_abertas_query, Ambiente.nome,
-                                 u'Ambiente'))
-    filtros.extend(FiltrosOpcoes(manut_abertas_query, Bloco.nome,
-                                 u'Bloco'))
-    filtros.extend(FiltrosOpcoes(manut_abertas_query, Departamento.nome,
-                                 u'Departamento'))
-    filtros.extend(FiltrosOpcoes(manut_abertas_query, Centro.nome,
-                                 u'Centro'))
-    filtros.extend(FiltrosOpcoes(manut_abertas_query, Campus.nome,
-                                 u'Campus'))
+    filtros.extend(FiltrosOpcoesIds(manut_abertas_query, Equipamento.id_ambiente, Ambiente,
+                                    u'Ambiente'))
+    filtros.extend(FiltrosOpcoesIds(manut_abertas_query, Equipamento.id_bloco, Bloco,
+                                    u'Bloco'))
+    filtros.extend(FiltrosOpcoesIds(manut_abertas_query, Equipamento.id_departamento, Departamento,
+                                    u'Departamento'))
+    filtros.extend(FiltrosOpcoesIds(manut_abertas_query, Equipamento.id_centro, Centro,
+                                    u'Centro'))
+    filtros.extend(FiltrosOpcoesIds(manut_abertas_query, Equipamento.id_campus, Campus,
+                                    u'Campus'))
+    filtros.extend(FiltroLocal(Equipamento.id_ambiente, u'Local'))
     filtros.extend(FiltrosDatas(Manutencao.data_abertura, u'Data de Abertura'))
 
     # Criação dos grupos de filtros e dicionário de indexação dos filtros
@@ -300,36 +312,48 @@ def manutencoes_abertas():
 @principal.route('/manutencoes-agendadas')
 @login_required
 def manutencoes_agendadas():
-    # São listadas todas as manutenções preventivas agendadas.
+    # São listadas as manutenções preventivas agendadas (geradas automaticamente
+    # para uma janela de meses a partir de hoje, ver app/util/agenda.py).
+    # Manutenções de equipamentos com a agenda desatualizada (ainda não gerada
+    # novamente após uma alteração) não são exibidas.
     # Também é possível filtrar os resultados de acordo com os valores de determinadas
     # colunas.
 
-    # Query de equipamentos (adicionando joins de outras tabelas)
-    equip_query = Equipamento.query.join(Ambiente, Bloco, Departamento, Centro, Campus)
+    # Query de equipamentos
+    # Os filtros de localização usam os ids desnormalizados do equipamento,
+    # dispensando joins com as tabelas de locais
+    equip_query = Equipamento.query
 
     # Query de equipamentos em uso
     equip_em_uso_query = equip_query.filter(Equipamento.em_uso==True)
 
     # Query de equipamentos em uso com manutenção agendada (fora de manutenção)
+    # (usada para gerar as opções dos filtros)
     equip_man_agendada_query = equip_em_uso_query.filter(Equipamento.em_manutencao==False)
 
+    # Query de manutenções agendadas (com join do equipamento para os filtros)
+    man_agendada_query = Manutencao.query.join(Manutencao.equipamento)\
+                                         .filter(Manutencao.status=='Agendada')\
+                                         .filter(Equipamento.agenda_desatualizada==False)
+
     # Definição dos filtros que podem ser aplicados (lista de filtros)
     # Deve-se indicar a query de base, a coluna e o nome de exibição do filtro
     # Note também que alguns tipos de dados possuem mais de um filtro ('filters.py')
 
     filtros = FiltrosOpcoes(equip_man_agendada_query, Equipamento.tipo_equipamento,
                             u'Tipo de Equipamento')
-    filtros.extend(FiltrosOpcoes(equip_man_agendada_query, Ambiente.nome,
-                                 u'Ambiente'))
-    filtros.extend(FiltrosOpcoes(equip_man_agendada_query, Bloco.nome,
-                                 u'Bloco'))
-    filtros.extend(FiltrosOpcoes(equip_man_agendada_query, Departamento.nome,
-                                 u'Departamento'))
-    filtros.extend(FiltrosOpcoes(equip_man_agendada_query, Centro.nome,
-                                 u'Centro'))
-    filtros.extend(FiltrosOpcoes(equip_man_agendada_query, Campus.nome,
-                                 u'Campus'))
-    filtros.extend(FiltrosDatas(Equipamento.proxima_manutencao, u'Próxima Manutenção'))
+    filtros.extend(FiltrosOpcoesIds(equip_man_agendada_query, Equipamento.id_ambiente, Ambiente,
+                                    u'Ambiente'))
+    filtros.extend(FiltrosOpcoesIds(equip_man_agendada_query, Equipamento.id_bloco, Bloco,
+                                    u'Bloco'))
+    filtros.extend(FiltrosOpcoesIds(equip_man_agendada_query, Equipamento.id_departamento, Departamento,
+                                    u'Departamento'))
+    filtros.extend(FiltrosOpcoesIds(equip_man_agendada_query, Equipamento.id_centro, Centro,
+                                    u'Centro'))
+    filtros.extend(FiltrosOpcoesIds(equip_man_agendada_query, Equipamento.id_campus, Campus,
+                                    u'Campus'))
+    filtros.extend(FiltroLocal(Equipamento.id_ambiente, u'Local'))
+    filtros.extend(FiltrosDatas(Manutencao.data_abertura, u'Data Prevista'))
 
     # Criação dos grupos de filtros e dicionário de indexação dos filtros
     grupos_filtros, indice_filtros = agrupar_filtros(filtros)
@@ -341,20 +365,20 @@ def manutencoes_agendadas():
     filtros_ativos = filtros_selecionados(request, indice_filtros)
 
     # Aplicação dos filtros selecionados
-    equip_filtrados_query = aplicar_filtros(equip_man_agendada_query, 
-                                            filtros, filtros_ativos)
+    man_filtradas_query = aplicar_filtros(man_agendada_query,
+                                          filtros, filtros_ativos)
 
-    # Paginação dos resultados (ordenados por data da próxima manutenção)
+    # Paginação dos resultados (ordenados por data prevista)
     page = request.args.get('page', 1, type=int)
 
-    pagination = equip_filtrados_query.order_by(Equipamento.proxima_manutencao).paginate(
+    pagination = man_filtradas_query.order_by(Manutencao.data_abertura).paginate(
         page, per_page=10, error_out=False)
 
-    # Lista de equipamentos após paginação
-    equip_filtrados = pagination.items
+    # Lista de manutenções após paginação
+    man_filtradas = pagination.items
 
     return render_template('principal/manutencoes_agendadas.html',
-                           equip_man_agendada=equip_filtrados,
+                           man_agendadas=man_filtradas,
                            data_hoje=date.today(),
                            pagination=pagination,
                            filtros=filtros,
@@ -363,6 +387,135 @@ def manutencoes_agendadas():
                            url_inicial=url_for('principal.manutencoes_agendadas'))
 
 
+# Página de Controle de Manutenções (Restrita a usuários cadastrados)
+# Aba Previsão de Manutenções
+@principal.route('/manutencoes-previsao', methods=['GET', 'POST'])
+@login_required
+def manutencoes_previsao():
+    # São projetadas as manutenções preventivas de todos os equipamentos em uso
+    # no horizonte escolhido, agregadas por semana, bloco e tipo de equipamento.
+    # Novos intervalos de manutenção por tipo podem ser simulados (query string
+    # "intervalo_<tipo>") e, por quem pode cadastrar, aplicados aos equipamentos.
+
+    # Horizonte da previsão [meses]
+    horizonte = request.args.get('horizonte', 24, type=int)
+
+    if horizonte not in (6, 12, 24, 36):
+        horizonte = 24
+
+    # Frota de equipamentos em uso (vetores, sem objetos do ORM)
+    frota = carregar_frota()
+
+    # Intervalos simulados por tipo de equipamento (identificado pelo nome, para
+    # não depender da ordem dos tipos na frota; tipos fora da frota são ignorados)
+    alteracoes = {}
+
+    for chave in request.args:
+        if not chave.startswith('intervalo_'):
+            continue
+
+        tipo = chave[len('intervalo_'):]
+        intervalo = request.args.get(chave, type=int)
+
+        if tipo in frota.nomes_tipos and intervalo is not None and intervalo > 0:
+            alteracoes[tipo] = intervalo
+
+    # Aplicação dos intervalos simulados
+    form_aplicar = FormAplicarIntervalos()
+
+    if form_aplicar.validate_on_submit():
+        if not current_user.pode_cadastrar():
+            abort(403)
+
+        atualizados = 0
+
+        for tipo, intervalo in alteracoes.items():
+            atualizados += recalcular_proximas_manutencoes(tipo, intervalo)
+
+        db.session.commit()
+
+        # Geração das manutenções agendadas dos equipamentos atualizados
+        atualizar_agenda()
+
+        flash('Intervalos aplicados a %d equipamento(s).' % atualizados, 'success')
+
+        # Redirecionar para a previsão com os intervalos atuais
+        return redirect(url_for('principal.manutencoes_previsao', horizonte=horizonte))
+
+    # Projeção das manutenções
+    projecao = projetar(frota, horizonte, alteracoes)
+
+    return render_template('principal/manutencoes_previsao.html',
+                           form_aplicar=form_aplicar,
+                           horizonte=horizonte,
+                           tipos=frota.nomes_tipos,
+                           alteracoes=alteracoes,
+                           num_equipamentos=len(frota),
+                           num_manutencoes=len(projecao),
+                           por_semana=projecao.por_semana(),
+                           por_bloco=projecao.por_bloco(),
+                           por_tipo=projecao.por_tipo())
+
+
+# Agrupamento escolhido para os indicadores de confiabilidade (query string)
+# e indicadores agrupados (apenas consulta: a tabela de indicadores é atualizada
+# pelo worker, ver app/util/confiabilidade.py)
+def consultar_indicadores():
+    agrupamento = request.args.get('agrupamento', 'tipo')
+
+    if agrupamento not in AGRUPAMENTOS:
+        agrupamento = 'tipo'
+
+    return agrupamento, indicadores_agrupados(agrupamento)
+
+
+# Página de Controle de Manutenções (Restrita a usuários cadastrados)
+# Aba Confiabilidade (MTBF, MTTR, taxa de falhas, ...)
+@principal.route('/manutencoes-confiabilidade')
+@login_required
+def manutencoes_confiabilidade():
+    agrupamento, indicadores = consultar_indicadores()
+
+    return render_template('principal/manutencoes_confiabilidade.html',
+                           agrupamento=agrupamento,
+                           agrupamentos=AGRUPAMENTOS,
+                           indicadores=indicadores)
+
+
+# Indicadores de confiabilidade em JSON (mesmos parâmetros da página)
+@principal.route('/manutencoes-confiabilidade/dados')
+@login_required
+def manutencoes_confiabilidade_dados():
+    agrupamento, indicadores = consultar_indicadores()
+
+    return jsonify(agrupamento=agrupamento,
+                   indicadores=indicadores_dicionarios(indicadores))
+
+
+# Miniaturas das geometrias (SVG) exibidas nas listagens do painel de administração
+# O conteúdo de uma miniatura nunca muda (a chave é o hash da geometria), por isso
+# o cache do navegador tem duração de um ano
+@principal.route('/miniaturas/<chave>.svg')
+@login_required
+def miniatura(chave):
+    if not re.match(r'^[0-9a-f]{40}-\d+x\d+$', chave):
+        abort(404)
+
+    caminho = arquivo_miniatura(chave)
+
+    if caminho is None:
+        abort(404)
+
+    resposta = send_file(caminho, mimetype='image/svg+xml', conditional=True,
+                         cache_timeout=365 * 24 * 60 * 60)
+
+    # Acesso restrito: cache apenas no navegador do usuário
+    resposta.cache_control.public = False
+    resposta.cache_control.private = True
+
+    return resposta
+
+
 # Página de Solicitações (Em Desenvolvimento)
 @principal.route('/solicitacoes')
 def solicitacoes():
@@ -416,7 +569,8 @@ def consumo():
             ,'valorForaPonta': []
         }
         # Query secreto para pegar as contas dos últimos 5 anos, organizados de acordo com a coluna 'data_leitura' da tabela do db
-        contas = unidade_consumidora.hist_contas.filter(extract('year', Conta.data_leitura) > date.today().year-5).order_by(Conta.data_leitura).all()
+        # (comparação direta com a data, para usar o índice (id_unidade_consumidora, data_leitura))
+        contas = unidade_consumidora.hist_contas.filter(Conta.data_leitura >= date(date.today().year-4, 1, 1)).order_by(Conta.data_leitura).all()
 
         for conta in contas:
             contas_5anos[unidade_consumidora.nome]['data'].append("%d-%d" %(conta.data_leitura.year, conta.data_leitura.month)) # Formato para a biblioteca plotly.js
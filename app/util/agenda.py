@@ -0,0 +1,181 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Geração da Agenda de Manutenções Preventivas
+################################################################################
+
+
+from datetime import date, timedelta
+from flask import current_app
+from sqlalchemy import func, literal, literal_column, or_, select, true
+
+from .. import db
+from ..models import Equipamento, Manutencao
+
+
+########## Funções ##########
+
+
+# A agenda de cada equipamento é formada por manutenções preventivas com status
+# "Agendada", uma para cada data prevista dentro de uma janela móvel a partir de
+# hoje: a próxima manutenção e as seguintes, a cada intervalo de manutenção.
+# Apenas os equipamentos com a agenda desatualizada (marcados pelos eventos do
+# ORM e pelos comandos em lote) ou cuja agenda não cobre a janela atual são
+# processados, em lotes: para cada lote, as manutenções agendadas antigas são
+# excluídas e as novas inseridas com um único INSERT ... SELECT.
+# As alterações feitas pelo painel de administração geram a agenda dos
+# equipamentos afetados logo após o commit (atualizar_agenda). A geração
+# periódica (gerar_agenda) avança a janela e processa os equipamentos alterados
+# por outros meios. Enquanto um equipamento tem a agenda desatualizada, suas
+# manutenções agendadas não são exibidas.
+
+
+# Descrição das manutenções geradas
+DESCRICAO_AGENDADA = 'Manutenção preventiva agendada automaticamente.'
+
+# Janela de agendamento padrão [meses] e número de equipamentos por lote
+JANELA_AGENDA = 12
+LOTE_AGENDA = 500
+
+# Margem além da janela até a qual a agenda é gerada [dias]
+# (evita que todos os equipamentos precisem ser processados todos os dias)
+MARGEM_AGENDA = 30
+
+
+# Ids dos equipamentos cuja agenda precisa ser gerada para a data limite dada
+def equipamentos_agenda_pendente(data_limite):
+    return [id for (id,) in
+            db.session.query(Equipamento.id)
+                      .filter(or_(Equipamento.agenda_desatualizada == True,
+                                  Equipamento.agenda_ate == None,
+                                  Equipamento.agenda_ate < data_limite))
+                      .order_by(Equipamento.id)]
+
+
+# Geração das manutenções agendadas de um lote de equipamentos, até a data dada
+# Os equipamentos do lote são bloqueados (SELECT ... FOR UPDATE) para que uma
+# alteração concorrente não tenha sua marcação de agenda desatualizada perdida
+def gerar_agenda_lote(ids, data_ate):
+    equipamentos = Equipamento.__table__
+    manutencoes = Manutencao.__table__
+
+    ids = [id for (id,) in
+           db.session.query(Equipamento.id)
+                     .filter(Equipamento.id.in_(ids))
+                     .with_for_update()]
+
+    if not ids:
+        return 0
+
+    # Agenda anterior
+    db.session.execute(manutencoes.delete()
+                                  .where(manutencoes.c.id_equipamento.in_(ids))
+                                  .where(manutencoes.c.status == 'Agendada'))
+
+    # Número máximo de manutenções por equipamento (intervalo de 1 mês), a partir
+    # da mais antiga próxima manutenção do lote (as vencidas também são agendadas)
+    mais_antiga = db.session.query(func.min(Equipamento.proxima_manutencao))\
+                            .filter(Equipamento.id.in_(ids))\
+                            .scalar()
+
+    inseridas = 0
+
+    if mais_antiga is not None and mais_antiga <= data_ate:
+        max_ordem = (data_ate - mais_antiga).days // 30
+
+        # Ordem de cada manutenção do equipamento: 0, 1, 2, ...
+        ordens = func.generate_series(0, max_ordem).alias('ordem')
+        ordem = literal_column('ordem')
+
+        data_prevista = equipamentos.c.proxima_manutencao + \
+                        ordem * equipamentos.c.intervalo_manutencao * 30
+
+        selecao = select([literal(0),
+                          equipamentos.c.id,
+                          data_prevista,
+                          literal('Preventiva'),
+                          literal(DESCRICAO_AGENDADA),
+                          literal('Agendada')])\
+                  .select_from(equipamentos.join(ordens, true()))\
+                  .where(equipamentos.c.id.in_(ids))\
+                  .where(equipamentos.c.em_uso == True)\
+                  .where(equipamentos.c.em_manutencao == False)\
+                  .where(equipamentos.c.proxima_manutencao != None)\
+                  .where(equipamentos.c.intervalo_manutencao > 0)\
+                  .where(data_prevista <= data_ate)
+
+        colunas = ['num_ordem_servico', 'id_equipamento', 'data_abertura',
+                   'tipo_manutencao', 'descricao_servico', 'status']
+
+        inseridas = db.session.execute(manutencoes.insert()
+                                                  .from_select(colunas, selecao))\
+                              .rowcount
+
+    db.session.execute(equipamentos.update()
+                                   .where(equipamentos.c.id.in_(ids))
+                                   .values(agenda_desatualizada=False,
+                                           agenda_ate=data_ate))
+
+    return inseridas
+
+
+# Data até a qual a agenda é gerada para a janela dada [meses]
+def data_agenda(janela):
+    return date.today() + timedelta(days=30 * janela + MARGEM_AGENDA)
+
+
+# Geração da agenda dos equipamentos dados, em lotes, com um commit por lote
+# Retorna o número de manutenções agendadas
+def gerar_agenda_lotes(ids, data_ate, lote):
+    agendadas = 0
+
+    for inicio in range(0, len(ids), lote):
+        try:
+            agendadas += gerar_agenda_lote(ids[inicio:inicio + lote], data_ate)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+    return agendadas
+
+
+# Geração da agenda de todos os equipamentos pendentes para a janela dada (em
+# meses), em lotes de equipamentos, com um commit por lote (para que a geração
+# possa ser executada periodicamente sem manter bloqueios longos)
+# Retorna (número de equipamentos processados, número de manutenções agendadas)
+def gerar_agenda(janela=JANELA_AGENDA, lote=LOTE_AGENDA):
+    data_limite = date.today() + timedelta(days=30 * janela)
+
+    ids = equipamentos_agenda_pendente(data_limite)
+
+    return len(ids), gerar_agenda_lotes(ids, data_agenda(janela), lote)
+
+
+# Geração imediata da agenda dos equipamentos dados (ou de todos, caso não sejam
+# dados) que estejam com a agenda desatualizada, a ser chamada após o commit de
+# uma alteração (as alterações já estão gravadas: uma falha é apenas registrada
+# no log, e os equipamentos continuam marcados para a próxima geração periódica)
+# Retorna o número de manutenções agendadas
+def atualizar_agenda(ids=None, janela=JANELA_AGENDA, lote=LOTE_AGENDA):
+    if ids is not None and not ids:
+        return 0
+
+    try:
+        pendentes = db.session.query(Equipamento.id)\
+                              .filter(Equipamento.agenda_desatualizada == True)\
+                              .order_by(Equipamento.id)
+
+        if ids is not None:
+            pendentes = pendentes.filter(Equipamento.id.in_(ids))
+
+        return gerar_agenda_lotes([id for (id,) in pendentes], data_agenda(janela), lote)
+
+    except Exception:
+        db.session.rollback()
+
+        current_app.logger.exception('Falha na geração da agenda após uma alteração.')
+
+        return 0
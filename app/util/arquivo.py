@@ -0,0 +1,180 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Arquivamento de Equipamentos Retirados e Manutenções Antigas
+################################################################################
+
+
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select, exists, literal, or_
+
+from .. import db
+from ..models import Equipamento, Manutencao, IndicadorConfiabilidade, TABELAS_ARQUIVO
+
+
+########## Configurações ##########
+
+
+# Tempo mínimo desde a última manutenção de um equipamento fora de uso para
+# que ele seja arquivado [dias]
+PRAZO_EQUIPAMENTOS = 365
+
+# Tempo mínimo desde a conclusão de uma manutenção para que ela seja arquivada [dias]
+PRAZO_MANUTENCOES = 730
+
+# Número máximo de equipamentos ou manutenções movidos por transação
+LOTE_ARQUIVO = 1000
+
+
+########## Funções ##########
+
+
+# As linhas são movidas em lotes, com um commit por lote: cada lote é
+# selecionado com SELECT ... FOR UPDATE SKIP LOCKED (linhas em edição ficam para
+# a próxima execução), copiado com um único INSERT ... SELECT para a tabela de
+# arquivo e excluído da tabela principal com um único DELETE.
+#
+# - Equipamentos: fora de uso, sem manutenção aberta e sem manutenções há mais de
+#   PRAZO_EQUIPAMENTOS dias. São arquivados com as linhas da tabela do seu tipo e
+#   todas as suas manutenções (as agendadas são apenas excluídas).
+# - Manutenções: concluídas há mais de PRAZO_MANUTENCOES dias, exceto a última
+#   concluída de cada equipamento (usada no cálculo da próxima manutenção).
+#
+# Os indicadores de confiabilidade são calculados sobre o histórico completo
+# (visão "historico_manutencoes") e não mudam com o arquivamento.
+
+
+# Cópia das linhas de uma tabela principal que satisfazem a condição para a sua
+# tabela de arquivo, seguida da sua exclusão
+# Retorna o número de linhas movidas
+def mover_linhas(tabela, condicao, arquivado_em):
+    arquivo = TABELAS_ARQUIVO[tabela]
+
+    colunas = [coluna.name for coluna in tabela.columns]
+
+    selecao = select(list(tabela.columns) +
+                     [literal(arquivado_em, arquivo.c.arquivado_em.type)])\
+              .where(condicao)
+
+    db.session.execute(arquivo.insert().from_select(colunas + ['arquivado_em'], selecao))
+
+    return db.session.execute(tabela.delete().where(condicao)).rowcount
+
+
+# Arquivamento de um lote de equipamentos retirados antes da data limite
+# Retorna o número de equipamentos arquivados
+def arquivar_lote_equipamentos(limite, lote, arquivado_em):
+    equipamentos = Equipamento.__table__
+    manutencoes = Manutencao.__table__
+
+    # Data da última manutenção (aberta ou concluída) do equipamento
+    ultima = select([func.max(func.coalesce(manutencoes.c.data_conclusao,
+                                            manutencoes.c.data_abertura))])\
+             .where(manutencoes.c.id_equipamento == equipamentos.c.id)\
+             .where(manutencoes.c.status != 'Agendada')\
+             .as_scalar()
+
+    aberta = exists().where(manutencoes.c.id_equipamento == equipamentos.c.id)\
+                     .where(manutencoes.c.status == 'Aberta')
+
+    ids = [id for (id,) in db.session.execute(
+               select([equipamentos.c.id])
+               .where(equipamentos.c.em_uso == False)
+               .where(equipamentos.c.em_manutencao == False)
+               .where(~aberta)
+               .where(or_(ultima == None, ultima < limite))
+               .order_by(equipamentos.c.id)
+               .limit(lote)
+               .with_for_update(skip_locked=True))]
+
+    if not ids:
+        return 0
+
+    # Manutenções agendadas (ainda não ocorreram e não fazem parte do histórico)
+    db.session.execute(manutencoes.delete()
+                                  .where(manutencoes.c.id_equipamento.in_(ids))
+                                  .where(manutencoes.c.status == 'Agendada'))
+
+    # Indicadores de confiabilidade (calculados apenas para equipamentos ativos)
+    indicadores = IndicadorConfiabilidade.__table__
+
+    db.session.execute(indicadores.delete()
+                                  .where(indicadores.c.id_equipamento.in_(ids)))
+
+    # Manutenções, tabelas dos tipos e, por último, a tabela de equipamentos
+    for tabela in TABELAS_ARQUIVO:
+        if tabela is manutencoes:
+            condicao = manutencoes.c.id_equipamento.in_(ids)
+        else:
+            condicao = tabela.c.id.in_(ids)
+
+        mover_linhas(tabela, condicao, arquivado_em)
+
+    return len(ids)
+
+
+# Arquivamento de um lote de manutenções concluídas antes da data limite
+# Retorna o número de manutenções arquivadas
+def arquivar_lote_manutencoes(limite, lote, arquivado_em):
+    manutencoes = Manutencao.__table__
+    posteriores = manutencoes.alias('posteriores')
+
+    # Existe uma manutenção concluída depois desta (não é a última do equipamento)
+    posterior = exists().where(posteriores.c.id_equipamento == manutencoes.c.id_equipamento)\
+                        .where(posteriores.c.status == u'Concluída')\
+                        .where(posteriores.c.data_conclusao > manutencoes.c.data_conclusao)
+
+    ids = [id for (id,) in db.session.execute(
+               select([manutencoes.c.id])
+               .where(manutencoes.c.status == u'Concluída')
+               .where(manutencoes.c.data_conclusao < limite)
+               .where(posterior)
+               .order_by(manutencoes.c.id)
+               .limit(lote)
+               .with_for_update(skip_locked=True))]
+
+    if not ids:
+        return 0
+
+    return mover_linhas(manutencoes, manutencoes.c.id.in_(ids), arquivado_em)
+
+
+# Execução de uma função de arquivamento em lotes até que não haja mais linhas
+# a mover, com um commit por lote
+# Retorna o total de linhas movidas
+def arquivar_em_lotes(arquivar_lote, limite, lote, arquivado_em):
+    total = 0
+
+    while True:
+        try:
+            movidas = arquivar_lote(limite, lote, arquivado_em)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+        if not movidas:
+            return total
+
+        total += movidas
+
+
+# Arquivamento dos equipamentos retirados e das manutenções antigas
+# Os prazos são dados em dias
+# Retorna (número de equipamentos arquivados, número de manutenções arquivadas)
+def arquivar(prazo_equipamentos=PRAZO_EQUIPAMENTOS, prazo_manutencoes=PRAZO_MANUTENCOES,
+             lote=LOTE_ARQUIVO):
+    hoje = date.today()
+    arquivado_em = datetime.now()
+
+    equipamentos = arquivar_em_lotes(arquivar_lote_equipamentos,
+                                     hoje - timedelta(days=prazo_equipamentos),
+                                     lote, arquivado_em)
+
+    manutencoes = arquivar_em_lotes(arquivar_lote_manutencoes,
+                                    hoje - timedelta(days=prazo_manutencoes),
+                                    lote, arquivado_em)
+
+    return equipamentos, manutencoes
@@ -0,0 +1,284 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Registro de Auditoria das Alterações Feitas no Painel de Administração
+################################################################################
+
+
+import atexit, json, os, threading, time, Queue
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy.types import LargeBinary
+from geoalchemy2.types import Geometry
+
+from .. import db
+from ..models import RegistroAuditoria
+
+
+########## Configurações ##########
+
+
+# Número máximo de registros gravados por inserção
+LOTE_AUDITORIA = 200
+
+# Tempo máximo de espera para completar um lote antes de gravá-lo [s]
+INTERVALO_AUDITORIA = 2
+
+# Tamanho máximo da fila (acima dele, quem registra espera a gravação)
+TAMANHO_FILA_AUDITORIA = 10000
+
+# Tempo máximo de espera pela gravação dos registros pendentes ao encerrar [s]
+ESPERA_ENCERRAMENTO = 10
+
+# Valor registrado no lugar de campos sensíveis ou extensos (senhas, geometrias,
+# arquivos), dos quais se registra apenas que foram alterados
+VALOR_OMITIDO = u'(omitido)'
+
+
+########## Alterações dos Modelos ##########
+
+
+# As alterações são obtidas do histórico de atributos do SQLAlchemy, antes de
+# cada flush (depois dele, o histórico é descartado), inclusive dos automáticos
+# feitos pelas consultas dos procedimentos adicionais das views: apenas os campos
+# alterados são registrados, como [valor anterior, valor novo]. Relações
+# many-to-one são registradas pelo id do registro relacionado.
+
+
+# Campo cujo valor não é registrado
+def campo_omitido(coluna):
+    return 'senha' in coluna.key or isinstance(coluna.type, (Geometry, LargeBinary))
+
+
+# Valor de um campo no registro (serializável em JSON)
+def valor_auditoria(valor):
+    if valor is None or isinstance(valor, (bool, int, long, float)):
+        return valor
+
+    # Registros relacionados: pelo id
+    if isinstance(valor, db.Model):
+        return getattr(valor, 'id', None)
+
+    if isinstance(valor, str):
+        return valor.decode('utf-8', 'replace')
+
+    return unicode(valor)
+
+
+# Alterações de um modelo (criado ou editado) ainda não enviadas ao banco
+def alteracoes_modelo(model):
+    estado = inspect(model)
+    mapeador = estado.mapper
+
+    alteracoes = {}
+
+    for propriedade in mapeador.column_attrs:
+        coluna = propriedade.columns[0]
+
+        # Apenas colunas da tabela (não expressões, como o GeoJSON dos mapas)
+        if not isinstance(coluna, db.Column):
+            continue
+
+        historico = estado.attrs[propriedade.key].history
+
+        anterior = historico.deleted[0] if historico.deleted else None
+        novo = historico.added[0] if historico.added else None
+
+        if anterior is None and novo is None or anterior == novo:
+            continue
+
+        if campo_omitido(coluna):
+            alteracoes[propriedade.key] = [VALOR_OMITIDO, VALOR_OMITIDO]
+        else:
+            alteracoes[propriedade.key] = [valor_auditoria(anterior), valor_auditoria(novo)]
+
+    for relacao in mapeador.relationships:
+        if relacao.direction is not MANYTOONE or relacao.viewonly:
+            continue
+
+        historico = estado.attrs[relacao.key].history
+
+        if not historico.added:
+            continue
+
+        anterior = historico.deleted[0] if historico.deleted else None
+        novo = historico.added[0]
+
+        if anterior is not novo:
+            alteracoes[relacao.key] = [valor_auditoria(anterior), valor_auditoria(novo)]
+
+    return alteracoes
+
+
+# Valores de um modelo a ser excluído (apenas os já carregados)
+def valores_modelo(model):
+    estado = inspect(model)
+
+    valores = {}
+
+    for propriedade in estado.mapper.column_attrs:
+        coluna = propriedade.columns[0]
+
+        if not isinstance(coluna, db.Column) or estado.dict.get(propriedade.key) is None:
+            continue
+
+        if campo_omitido(coluna):
+            valor = VALOR_OMITIDO
+        else:
+            valor = valor_auditoria(estado.dict[propriedade.key])
+
+        valores[propriedade.key] = [valor, None]
+
+    return valores
+
+
+# Coletor das alterações de um modelo durante uma operação (bloco "with")
+# As alterações de vários flushes são acumuladas: de cada campo, ficam o valor
+# anterior ao primeiro e o valor posterior ao último
+class ColetorAlteracoes(object):
+    # Inicialização (sessão do SQLAlchemy, não a "scoped_session")
+    def __init__(self, sessao, model):
+        self.sessao = sessao
+        self.model = model
+        self.acumuladas = {}
+
+        # Função registrada no evento (a mesma deve ser removida ao final)
+        self.ouvinte = self.antes_flush
+
+    def __enter__(self):
+        event.listen(self.sessao, 'before_flush', self.ouvinte)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.sessao, 'before_flush', self.ouvinte)
+
+    # Acumulação das alterações ainda não enviadas ao banco
+    def antes_flush(self, sessao, contexto, instancias):
+        for campo, (anterior, novo) in alteracoes_modelo(self.model).items():
+            if campo in self.acumuladas:
+                anterior = self.acumuladas[campo][0]
+
+            self.acumuladas[campo] = [anterior, novo]
+
+    # Alterações da operação (sem os campos que voltaram ao valor anterior)
+    @property
+    def alteracoes(self):
+        return dict((campo, valores) for campo, valores in self.acumuladas.items()
+                    if valores[0] != valores[1] or valores[0] == VALOR_OMITIDO)
+
+
+########## Gravação em Segundo Plano ##########
+
+
+# Os registros não são gravados no request que fez a alteração: eles são
+# colocados numa fila do processo e gravados por uma thread em segundo plano, em
+# lotes (uma inserção de várias linhas por lote). A thread é iniciada no primeiro
+# registro de cada processo (inclusive em cada worker criado por fork) e, ao
+# encerrar o processo, os registros ainda na fila são gravados.
+
+
+# Fila dos registros a gravar (dicionários com as colunas da tabela)
+fila = Queue.Queue(TAMANHO_FILA_AUDITORIA)
+
+# Thread de gravação e processo em que foi iniciada
+gravador = None
+processo_gravador = None
+
+# Trava de inicialização da thread
+trava_gravador = threading.Lock()
+
+# Marcador de encerramento da thread
+FIM = object()
+
+
+# Gravação de um lote de registros (uma inserção de várias linhas)
+def gravar_registros(app, registros):
+    with app.app_context():
+        try:
+            db.engine.execute(RegistroAuditoria.__table__.insert().values(registros))
+        except Exception:
+            app.logger.exception('Falha na gravação de %d registro(s) de auditoria.'
+                                 % len(registros))
+
+
+# Execução da thread de gravação
+# Cada lote é gravado quando atinge LOTE_AUDITORIA registros ou quando passa
+# INTERVALO_AUDITORIA segundos desde o seu primeiro registro
+def executar_gravador(app):
+    encerrar = False
+
+    while not encerrar:
+        registro = fila.get()
+
+        if registro is FIM:
+            break
+
+        registros = [registro]
+        prazo = time.time() + INTERVALO_AUDITORIA
+
+        while len(registros) < LOTE_AUDITORIA:
+            restante = prazo - time.time()
+
+            if restante <= 0:
+                break
+
+            try:
+                registro = fila.get(timeout=restante)
+            except Queue.Empty:
+                break
+
+            if registro is FIM:
+                encerrar = True
+                break
+
+            registros.append(registro)
+
+        gravar_registros(app, registros)
+
+
+# Início da thread de gravação do processo atual (caso ainda não exista)
+def iniciar_gravador(app):
+    global gravador, processo_gravador
+
+    with trava_gravador:
+        if gravador is not None and gravador.is_alive() and \
+           processo_gravador == os.getpid():
+            return
+
+        gravador = threading.Thread(target=executar_gravador, args=(app,),
+                                    name='gravador-auditoria')
+        gravador.daemon = True
+        gravador.start()
+
+        processo_gravador = os.getpid()
+
+
+# Encerramento da thread, gravando os registros pendentes
+@atexit.register
+def encerrar_gravador():
+    if gravador is None or not gravador.is_alive() or processo_gravador != os.getpid():
+        return
+
+    fila.put(FIM)
+    gravador.join(ESPERA_ENCERRAMENTO)
+
+
+# Registro de uma operação ('Criação', 'Edição' ou 'Exclusão') sobre um modelo
+# Feito somente após o commit da operação, no contexto do request (o id é dado
+# à parte, pois após o commit os atributos do modelo precisariam ser recarregados)
+def registrar_operacao(operacao, model, id_registro, alteracoes, usuario):
+    app = current_app._get_current_object()
+
+    iniciar_gravador(app)
+
+    fila.put(dict(data_hora=datetime.now(),
+                  id_usuario=getattr(usuario, 'id', None),
+                  email_usuario=getattr(usuario, 'email', None),
+                  modelo=getattr(type(model), 'endpoint', type(model).__name__),
+                  id_registro=id_registro,
+                  operacao=operacao,
+                  alteracoes=json.dumps(alteracoes, sort_keys=True)))
@@ -0,0 +1,218 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Envio dos Emails da Caixa de Saída
+################################################################################
+
+
+import json, time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask_mail import Message
+
+from .. import db
+from ..models import MensagemSaida
+from .email import ERROS_SMTP, abrir_conexao, fechar_conexao
+
+
+########## Configurações ##########
+
+
+# Número máximo de mensagens enviadas por transação (e por conexão SMTP)
+LOTE_CAIXA_SAIDA = 50
+
+# Intervalo entre as verificações da caixa de saída quando não há mensagens [s]
+INTERVALO_CAIXA_SAIDA = 5
+
+# Número máximo de tentativas de envio de uma mensagem
+TENTATIVAS_CAIXA_SAIDA = 8
+
+# Espera após a primeira falha de envio, dobrada a cada nova falha, e espera
+# máxima entre tentativas [s]
+ESPERA_INICIAL = 60
+ESPERA_MAXIMA = 6 * 60 * 60
+
+# Prazo de permanência das mensagens enviadas ou com falha [dias]
+PRAZO_CAIXA_SAIDA = 30
+
+# Intervalo entre as remoções das mensagens antigas pelo worker [s]
+INTERVALO_LIMPEZA = 60 * 60
+
+
+########## Funções ##########
+
+
+# As mensagens pendentes são retiradas da caixa de saída em lotes, com
+# SELECT ... FOR UPDATE SKIP LOCKED (vários workers podem ser executados em
+# paralelo sem enviar a mesma mensagem), e enviadas por uma única conexão SMTP,
+# agrupadas por destinatários. O status de cada mensagem do lote é gravado num
+# único commit ao final do lote: caso o worker seja interrompido no meio de um
+# lote, as mensagens do lote voltam a ficar pendentes (podendo ser enviadas duas
+# vezes, mas nunca perdidas). Cada falha adia a próxima tentativa da mensagem
+# (ESPERA_INICIAL, dobrada a cada falha); após TENTATIVAS_CAIXA_SAIDA falhas,
+# ela recebe o status "Falha".
+
+
+# Mensagem de email (Flask-Mail) a partir do seu registro na caixa de saída
+def mensagem_email(registro):
+    return Message(registro.assunto,
+                   sender=registro.remetente,
+                   recipients=json.loads(registro.destinatarios),
+                   body=registro.corpo,
+                   html=registro.html)
+
+
+# Espera até a próxima tentativa de envio após um número de falhas [s]
+def espera_tentativa(tentativas):
+    return min(ESPERA_INICIAL * 2 ** (tentativas - 1), ESPERA_MAXIMA)
+
+
+# Registro de uma falha de envio (definitiva, no caso de mensagens inválidas)
+def registrar_falha(registro, erro, definitiva=False):
+    registro.tentativas += 1
+    registro.erro = unicode(erro)
+
+    if definitiva or registro.tentativas >= TENTATIVAS_CAIXA_SAIDA:
+        registro.status = 'Falha'
+    else:
+        registro.proxima_tentativa = datetime.now() + \
+            timedelta(seconds=espera_tentativa(registro.tentativas))
+
+
+# Retirada de um lote de mensagens pendentes cuja próxima tentativa já chegou
+# As mensagens são ordenadas por destinatários (as do mesmo destinatário são
+# enviadas em sequência)
+def retirar_lote(lote):
+    registros = MensagemSaida.query\
+        .filter(MensagemSaida.status == 'Pendente')\
+        .filter(MensagemSaida.proxima_tentativa <= datetime.now())\
+        .order_by(MensagemSaida.proxima_tentativa)\
+        .limit(lote)\
+        .with_for_update(skip_locked=True)\
+        .all()
+
+    return sorted(registros, key=lambda registro: registro.destinatarios)
+
+
+# Envio de um lote de mensagens pendentes
+# Retorna (mensagens enviadas, falhas), ou None caso não haja mensagens
+def enviar_lote(lote=LOTE_CAIXA_SAIDA):
+    registros = retirar_lote(lote)
+
+    if not registros:
+        db.session.rollback()
+        return None
+
+    enviadas = falhas = 0
+    conexao = None
+
+    for indice, registro in enumerate(registros):
+        try:
+            if conexao is None:
+                conexao = abrir_conexao()
+
+        except ERROS_SMTP as ex:
+            # Servidor indisponível: as demais mensagens do lote também são adiadas
+            for restante in registros[indice:]:
+                registrar_falha(restante, ex)
+
+            falhas += len(registros) - indice
+            break
+
+        try:
+            conexao.send(mensagem_email(registro))
+
+        except ERROS_SMTP as ex:
+            # Conexão descartada (refeita para a próxima mensagem)
+            fechar_conexao(conexao)
+            conexao = None
+
+            registrar_falha(registro, ex)
+            falhas += 1
+
+        except Exception as ex:
+            # Mensagem inválida (sem destinatários, cabeçalhos inválidos, ...)
+            registrar_falha(registro, ex, definitiva=True)
+            falhas += 1
+
+        else:
+            registro.status = 'Enviada'
+            registro.enviada_em = datetime.now()
+            registro.erro = None
+            enviadas += 1
+
+    fechar_conexao(conexao)
+
+    db.session.commit()
+
+    return enviadas, falhas
+
+
+# Remoção das mensagens enviadas ou com falha há mais do que o prazo dado [dias]
+def remover_mensagens_antigas(prazo=PRAZO_CAIXA_SAIDA):
+    limite = datetime.now() - timedelta(days=prazo)
+
+    removidas = MensagemSaida.query\
+        .filter(MensagemSaida.status.in_(['Enviada', 'Falha']))\
+        .filter(MensagemSaida.criada_em < limite)\
+        .delete(synchronize_session=False)
+
+    db.session.commit()
+
+    return removidas
+
+
+# Envio contínuo das mensagens da caixa de saída (ou apenas das pendentes, com
+# "uma_vez")
+# As mensagens antigas são removidas ao iniciar e, depois, a cada
+# INTERVALO_LIMPEZA (quando a caixa de saída está vazia)
+# Retorna (mensagens enviadas, falhas)
+def enviar_emails(uma_vez=False, intervalo=INTERVALO_CAIXA_SAIDA, lote=LOTE_CAIXA_SAIDA):
+    enviadas = falhas = 0
+
+    remover_mensagens_antigas()
+    ultima_limpeza = time.time()
+
+    while True:
+        resultado = enviar_lote(lote)
+
+        if resultado is not None:
+            enviadas += resultado[0]
+            falhas += resultado[1]
+        elif uma_vez:
+            return enviadas, falhas
+        else:
+            if time.time() - ultima_limpeza >= INTERVALO_LIMPEZA:
+                remover_mensagens_antigas()
+                ultima_limpeza = time.time()
+
+            time.sleep(intervalo)
+
+
+# Métricas da caixa de saída
+# Retorna um dicionário ordenado {descrição: valor}
+def metricas_caixa_saida():
+    agora = datetime.now()
+
+    pendentes = MensagemSaida.query.filter(MensagemSaida.status == 'Pendente')
+
+    mais_antiga = db.session.query(db.func.min(MensagemSaida.criada_em))\
+                            .filter(MensagemSaida.status == 'Pendente').scalar()
+
+    return OrderedDict([
+        ('Pendentes', pendentes.count()),
+        ('Pendentes aguardando nova tentativa',
+         pendentes.filter(MensagemSaida.tentativas > 0).count()),
+        ('Espera da pendente mais antiga [s]',
+         int((agora - mais_antiga).total_seconds()) if mais_antiga else 0),
+        ('Enviadas na última hora',
+         MensagemSaida.query.filter(MensagemSaida.status == 'Enviada')
+                            .filter(MensagemSaida.enviada_em >= agora - timedelta(hours=1))
+                            .count()),
+        ('Enviadas (total)',
+         MensagemSaida.query.filter(MensagemSaida.status == 'Enviada').count()),
+        ('Com falha definitiva',
+         MensagemSaida.query.filter(MensagemSaida.status == 'Falha').count()),
+    ])
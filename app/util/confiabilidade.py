@@ -0,0 +1,307 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Indicadores de Confiabilidade dos Equipamentos
+################################################################################
+
+
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .. import db
+from ..models import Bloco, Equipamento, HistoricoManutencao, IndicadorConfiabilidade
+
+
+########## Configurações ##########
+
+
+# Intervalo entre as atualizações dos indicadores pelo worker [s]
+INTERVALO_INDICADORES = 60
+
+# Chave da trava (advisory lock) que impede atualizações simultâneas
+TRAVA_INDICADORES = 7340193
+
+
+########## Cálculo dos Indicadores ##########
+
+
+# Marcador de "nenhuma manutenção em andamento" nos vetores de datas (em dias)
+SEM_ABERTA = np.iinfo(np.int64).max
+
+
+# Os indicadores são calculados sobre vetores com as manutenções ordenadas por
+# equipamento: cada equipamento ocupa um trecho contíguo dos vetores e as somas
+# por equipamento são feitas de uma só vez com np.add.reduceat.
+#
+# - Falhas: manutenções corretivas e trocas
+# - Tempo de vida: dias desde a manutenção inicial (ou a primeira registrada)
+# - Tempo parado: soma das durações das manutenções (as abertas até hoje)
+# - MTBF: (tempo de vida - tempo parado) / falhas
+# - MTTR: duração média dos reparos (falhas concluídas)
+#
+# Apenas os valores que não dependem da data atual são gravados: a data de
+# início, os dias parado em manutenções concluídas e a abertura da manutenção em
+# andamento. O tempo de vida, o tempo parado total, o MTBF e a taxa de falhas
+# são calculados na consulta (indicadores_agrupados), a partir da data atual.
+
+
+# Carregamento das manutenções dos equipamentos dados (ou de todos) em vetores,
+# com uma única consulta ordenada por equipamento
+# (as manutenções agendadas ainda não ocorreram e são desconsideradas)
+# O histórico inclui as manutenções arquivadas (app/util/arquivo.py)
+def carregar_manutencoes(ids=None):
+    query = db.session.query(HistoricoManutencao.id_equipamento,
+                             HistoricoManutencao.tipo_manutencao,
+                             HistoricoManutencao.data_abertura,
+                             HistoricoManutencao.data_conclusao)\
+                      .filter(HistoricoManutencao.id_equipamento != None)\
+                      .filter(HistoricoManutencao.status != 'Agendada')
+
+    if ids is not None:
+        query = query.filter(HistoricoManutencao.id_equipamento.in_(ids))
+
+    linhas = query.order_by(HistoricoManutencao.id_equipamento,
+                            HistoricoManutencao.data_abertura).all()
+
+    return (np.array([linha[0] for linha in linhas], dtype=np.int64),
+            np.array([linha[1] or '' for linha in linhas], dtype=object),
+            np.array([linha[2] for linha in linhas], dtype='datetime64[D]'),
+            np.array([linha[3] for linha in linhas], dtype='datetime64[D]'))
+
+
+# Linha de indicadores de um equipamento sem histórico de manutenções
+def indicadores_vazios(id_equipamento, agora):
+    return dict(id_equipamento=id_equipamento,
+                num_manutencoes=0,
+                num_preventivas=0,
+                num_corretivas=0,
+                num_trocas=0,
+                num_falhas=0,
+                num_reparos=0,
+                data_inicio=None,
+                inicio_manutencao_aberta=None,
+                dias_parado=0,
+                dias_reparo=0,
+                mttr=None,
+                razao_corretiva_preventiva=None,
+                atualizado_em=agora,
+                desatualizado=False)
+
+
+# Cálculo vetorizado dos indicadores de cada equipamento
+# Retorna a lista de dicionários (um por equipamento com manutenções) pronta
+# para gravação na tabela de indicadores
+def calcular_indicadores(equipamentos, tipos, aberturas, conclusoes):
+    if not len(equipamentos):
+        return []
+
+    # Início do trecho de cada equipamento
+    ids, inicios = np.unique(equipamentos, return_index=True)
+
+    # Somas por equipamento
+    def somar(valores):
+        return np.add.reduceat(valores.astype(np.int64), inicios)
+
+    inicial = tipos == 'Inicial'
+    preventiva = tipos == 'Preventiva'
+    corretiva = tipos == 'Corretiva'
+    troca = tipos == 'Troca'
+    falha = corretiva | troca
+    concluida = ~np.isnat(conclusoes)
+
+    # Duração de cada manutenção concluída [dias]
+    duracoes = np.where(concluida, (conclusoes - aberturas).astype(np.int64), 0)
+    duracoes = np.maximum(duracoes, 0)
+
+    num_preventivas = somar(preventiva)
+    num_corretivas = somar(corretiva)
+    num_trocas = somar(troca)
+    num_falhas = num_corretivas + num_trocas
+    num_reparos = somar(falha & concluida)
+
+    datas_inicio = np.minimum.reduceat(aberturas, inicios)
+    dias_parado = somar(np.where(inicial, 0, duracoes))
+    dias_reparo = somar(np.where(falha & concluida, duracoes, 0))
+
+    # Abertura da manutenção em andamento (a mais antiga, caso haja mais de uma),
+    # em dias desde 1970 (SEM_ABERTA, caso não haja)
+    abertas = np.where(~inicial & ~concluida, aberturas.astype(np.int64), SEM_ABERTA)
+    inicios_abertas = np.minimum.reduceat(abertas, inicios)
+
+    # Divisões com denominador nulo resultam em NaN (gravado como NULL)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mttr = np.where(num_reparos > 0, dias_reparo / num_reparos.astype(np.float64),
+                        np.nan)
+        razao = np.where(num_preventivas > 0,
+                         num_corretivas / num_preventivas.astype(np.float64), np.nan)
+
+    agora = datetime.now()
+
+    def valor(x):
+        return None if np.isnan(x) else float(x)
+
+    def data(dias):
+        return None if dias == SEM_ABERTA else np.datetime64(int(dias), 'D').astype(object)
+
+    return [dict(id_equipamento=int(ids[i]),
+                 num_manutencoes=int(num_preventivas[i] + num_falhas[i]),
+                 num_preventivas=int(num_preventivas[i]),
+                 num_corretivas=int(num_corretivas[i]),
+                 num_trocas=int(num_trocas[i]),
+                 num_falhas=int(num_falhas[i]),
+                 num_reparos=int(num_reparos[i]),
+                 data_inicio=datas_inicio[i].astype(object),
+                 inicio_manutencao_aberta=data(inicios_abertas[i]),
+                 dias_parado=int(dias_parado[i]),
+                 dias_reparo=int(dias_reparo[i]),
+                 mttr=valor(mttr[i]),
+                 razao_corretiva_preventiva=valor(razao[i]),
+                 atualizado_em=agora,
+                 desatualizado=False)
+            for i in range(len(ids))]
+
+
+########## Atualização dos Indicadores ##########
+
+
+# A tabela de indicadores é atualizada apenas pelo comando
+# "python launcher.py atualizar_indicadores" (processo "indicadores" do
+# Procfile); as páginas apenas a consultam. As atualizações são serializadas por
+# uma trava (pg_advisory_xact_lock) e gravadas com INSERT ... ON CONFLICT DO
+# UPDATE. As linhas desatualizadas são bloqueadas (SELECT ... FOR UPDATE) até o
+# commit, de modo que uma alteração concorrente de manutenção volte a marcá-las
+# após a gravação, em vez de ter sua marcação perdida.
+
+
+# Ids dos equipamentos com indicadores desatualizados ou ainda não calculados
+def equipamentos_pendentes():
+    desatualizados = db.session.query(IndicadorConfiabilidade.id_equipamento)\
+                               .filter(IndicadorConfiabilidade.desatualizado == True)\
+                               .with_for_update()
+
+    sem_indicadores = db.session.query(Equipamento.id)\
+                                .outerjoin(IndicadorConfiabilidade,
+                                           IndicadorConfiabilidade.id_equipamento ==
+                                               Equipamento.id)\
+                                .filter(IndicadorConfiabilidade.id_equipamento == None)
+
+    return [id for (id,) in desatualizados] + [id for (id,) in sem_indicadores]
+
+
+# Atualização incremental da tabela de indicadores: apenas os equipamentos
+# pendentes são recalculados (ou todos, caso pedido), em lote. Equipamentos sem
+# histórico de manutenções recebem uma linha zerada.
+# Retorna o número de equipamentos recalculados (o commit fica a cargo de quem chama)
+def atualizar_indicadores(todos=False):
+    indicadores = IndicadorConfiabilidade.__table__
+
+    db.session.execute(select([func.pg_advisory_xact_lock(TRAVA_INDICADORES)]))
+
+    if todos:
+        ids = [id for (id,) in db.session.query(Equipamento.id)]
+    else:
+        ids = equipamentos_pendentes()
+
+    if not ids:
+        return 0
+
+    linhas = calcular_indicadores(*carregar_manutencoes(None if todos else ids))
+
+    # Equipamentos sem histórico
+    agora = datetime.now()
+    calculados = set(linha['id_equipamento'] for linha in linhas)
+
+    linhas.extend(indicadores_vazios(id, agora) for id in ids if id not in calculados)
+
+    insercao = insert(indicadores)
+
+    db.session.execute(insercao.on_conflict_do_update(
+                           index_elements=[indicadores.c.id_equipamento],
+                           set_=dict((coluna.name, insercao.excluded[coluna.name])
+                                     for coluna in indicadores.columns
+                                     if not coluna.primary_key)),
+                       linhas)
+
+    return len(ids)
+
+
+# Atualização contínua dos indicadores (worker): os equipamentos pendentes são
+# recalculados a cada intervalo [s], com um commit por atualização
+def atualizar_indicadores_continuamente(intervalo=INTERVALO_INDICADORES):
+    while True:
+        try:
+            atualizar_indicadores()
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+        time.sleep(intervalo)
+
+
+########## Consulta dos Indicadores ##########
+
+
+# Agrupamentos disponíveis: nome -> (título, colunas de agrupamento)
+AGRUPAMENTOS = {
+    'equipamento': ('Equipamento', [Equipamento.id, Equipamento.tipo_equipamento,
+                                    Equipamento.tombamento]),
+    'tipo': ('Tipo de Equipamento', [Equipamento.tipo_equipamento]),
+    'fabricante': ('Fabricante', [Equipamento.fabricante]),
+    'bloco': ('Bloco', [Bloco.nome]),
+}
+
+
+# Indicadores agregados por equipamento, tipo, fabricante ou bloco
+# Os indicadores do grupo são calculados a partir das somas dos equipamentos
+# (ex.: MTBF = soma dos tempos em operação / soma das falhas), e os tempos de
+# cada equipamento a partir da data atual
+def indicadores_agrupados(agrupamento='tipo'):
+    titulo, colunas = AGRUPAMENTOS[agrupamento]
+
+    i = IndicadorConfiabilidade
+    hoje = func.current_date()
+
+    # Tempo de vida e tempo parado (incluindo a manutenção em andamento) [dias]
+    dias_vida = func.coalesce(func.greatest(hoje - i.data_inicio, 0), 0)
+    dias_parado = i.dias_parado + \
+        func.coalesce(func.greatest(hoje - i.inicio_manutencao_aberta, 0), 0)
+
+    num_falhas = func.sum(i.num_falhas)
+    num_reparos = func.sum(i.num_reparos)
+    num_preventivas = func.sum(i.num_preventivas)
+    num_corretivas = func.sum(i.num_corretivas)
+    dias_operacao = func.sum(func.greatest(dias_vida - dias_parado, 0))
+
+    query = db.session.query(*(colunas + [
+                func.count(i.id_equipamento).label('num_equipamentos'),
+                func.sum(i.num_manutencoes).label('num_manutencoes'),
+                num_preventivas.label('num_preventivas'),
+                num_corretivas.label('num_corretivas'),
+                func.sum(i.num_trocas).label('num_trocas'),
+                func.sum(dias_parado).label('dias_parado'),
+                (dias_operacao * 1.0 / func.nullif(num_falhas, 0)).label('mtbf'),
+                (func.sum(i.dias_reparo) * 1.0 / func.nullif(num_reparos, 0)).label('mttr'),
+                (num_falhas * 365.0 / func.nullif(dias_operacao, 0)).label('taxa_falhas'),
+                (num_corretivas * 1.0 / func.nullif(num_preventivas, 0))
+                    .label('razao_corretiva_preventiva')]))\
+              .select_from(i)\
+              .join(Equipamento, Equipamento.id == i.id_equipamento)
+
+    if agrupamento == 'bloco':
+        query = query.outerjoin(Bloco, Bloco.id == Equipamento.id_bloco)
+
+    return query.group_by(*colunas).order_by(*colunas).all()
+
+
+# Conversão das linhas agregadas para dicionários (API)
+def indicadores_dicionarios(linhas):
+    return [dict((chave, float(valor) if hasattr(valor, 'as_tuple') else valor)
+                 for chave, valor in zip(linha.keys(), linha))
+            for linha in linhas]
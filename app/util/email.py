@@ -7,44 +7,120 @@
 ################################################################################
 
 
-from threading import Thread
+import hashlib, json, smtplib, socket
+from datetime import datetime, timedelta
 from flask import current_app, render_template
 from flask_mail import Message
 
-from .. import mail
+from .. import db, mail
+from ..models import MensagemSaida
 
 
-########## Funções ##########
+########## Configurações ##########
 
 
-# Envio assíncrono de email (O processo ocorre paralelamente, em uma thread separada
-# do funcionamento principal da aplicação)
-def enviar_email_assinc(app, msg):
-    with app.app_context():
-        mail.send(msg)
+# Período em que uma mensagem igual a outra já enviada é descartada [s]
+# (ex.: vários cliques seguidos em "reenviar confirmação")
+JANELA_DUPLICATAS = 10 * 60
 
+# Falhas de conexão ou de envio após as quais a conexão SMTP é descartada
+ERROS_SMTP = (smtplib.SMTPException, socket.error)
+
+
+########## Mensagens ##########
 
-# Preparação para envio do email
-def enviar_email(para, assunto, template, **kwargs):
-    # Obter aplicação sendo utilizada
-    app = current_app._get_current_object()
 
+# Criação de uma mensagem (sem envio)
+def criar_mensagem(para, assunto, template, **kwargs):
     # Caso haja apenas um destinatário, colocá-lo em uma lista
     if not isinstance(para, list):
         para = [para]
 
-    # Criação da mensagem
-
-    msg = Message(assunto, sender=app.config['MAIL_SENDER'],
+    msg = Message(assunto, sender=current_app.config['MAIL_SENDER'],
                   recipients=para)
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
 
-    # Criando uma thread para que o email possa ser enviado de modo assíncrono,
-    # ou seja, a aplicação não precisa esperar até que o email seja enviado
+    return msg
+
+
+# Identificação do conteúdo de uma mensagem (hash dos destinatários, em ordem e
+# sem diferenciar maiúsculas, do assunto e do conteúdo)
+def chave_mensagem(msg):
+    conteudo = json.dumps([sorted(endereco.lower() for endereco in msg.send_to),
+                           msg.subject, msg.body, msg.html])
+
+    return hashlib.sha1(conteudo).hexdigest()
+
+
+# Mensagem igual já pendente ou enviada há pouco tempo (None, caso não haja)
+def mensagem_repetida(chave):
+    limite = datetime.now() - timedelta(seconds=JANELA_DUPLICATAS)
+
+    return MensagemSaida.query.filter(MensagemSaida.chave == chave)\
+                              .filter(db.or_(MensagemSaida.status == 'Pendente',
+                                             MensagemSaida.criada_em >= limite))\
+                              .first()
+
+
+########## Conexões SMTP ##########
+
+
+# Abertura de uma conexão SMTP (mantida aberta entre os envios, fora de um bloco "with")
+def abrir_conexao():
+    return mail.connect().__enter__()
+
+
+# Fechamento de uma conexão SMTP (ignorando falhas, já que ela não será mais usada)
+def fechar_conexao(conexao):
+    if conexao is None:
+        return
+
+    try:
+        conexao.__exit__(None, None, None)
+    except ERROS_SMTP:
+        pass
+
+
+########## Funções ##########
+
+
+# Envio de email pela caixa de saída: a mensagem é criada no request e gravada
+# na sessão do banco de dados, sendo confirmada com o commit do próprio request;
+# o envio é feito pelo comando "python launcher.py enviar_emails"
+# (app/util/caixa_saida.py). Mensagens repetidas não são gravadas novamente.
+# Retorna o registro da mensagem na caixa de saída
+def enviar_email(para, assunto, template, **kwargs):
+    msg = criar_mensagem(para, assunto, template, **kwargs)
+
+    chave = chave_mensagem(msg)
+
+    repetida = mensagem_repetida(chave)
+
+    if repetida is not None:
+        return repetida
+
+    registro = MensagemSaida(remetente=msg.sender,
+                             destinatarios=json.dumps(msg.recipients),
+                             assunto=msg.subject,
+                             corpo=msg.body,
+                             html=msg.html,
+                             chave=chave)
+
+    db.session.add(registro)
+
+    return registro
+
 
-    thr = Thread(target=enviar_email_assinc, args=[app, msg])
-    thr.start()
+# Envio síncrono de várias mensagens por uma única conexão SMTP
+# (adequado para tarefas em lote, como os resumos de manutenções vencidas)
+# Retorna o número de mensagens enviadas
+def enviar_emails_lote(mensagens):
+    enviadas = 0
 
-    return thr
+    with mail.connect() as conexao:
+        for msg in mensagens:
+            conexao.send(msg)
+            enviadas += 1
 
+    return enviadas
@@ -0,0 +1,114 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Exportação dos Dados das Listagens (CSV e XLSX)
+################################################################################
+
+
+import csv, os, tempfile
+
+from flask_admin._compat import as_unicode, csv_encode
+
+# Dependência opcional: sem ela, apenas a exportação em CSV fica disponível
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+
+########## Configurações ##########
+
+
+# Número de linhas lidas do banco de dados por vez (cursor do lado do servidor)
+LOTE_EXPORTACAO = 1000
+
+# Tamanho dos blocos de leitura dos arquivos gerados [bytes]
+BLOCO_ARQUIVO = 64 * 1024
+
+# Formatos de exportação disponíveis
+FORMATOS_EXPORTACAO = ['csv', 'xlsx'] if Workbook is not None else ['csv']
+
+# Tipos MIME dos formatos de exportação
+TIPOS_MIME = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+
+########## Funções ##########
+
+
+# As exportações nunca guardam o resultado inteiro em memória: as linhas são
+# lidas do banco de dados em lotes e escritas uma a uma. O CSV é gerado como
+# uma sequência de linhas de texto (enviadas na resposta à medida que são
+# produzidas); o XLSX, que é um arquivo compactado, é escrito em modo
+# "write-only" (sem manter as células em memória) num arquivo temporário, lido
+# depois em blocos.
+
+
+# Escritor de CSV que apenas retorna cada linha escrita
+class Eco(object):
+    def write(self, valor):
+        return valor
+
+
+# Linhas de texto de um CSV, a partir dos títulos das colunas e das linhas de valores
+def gerar_csv(titulos, linhas):
+    escritor = csv.writer(Eco())
+
+    yield escritor.writerow([csv_encode(titulo) for titulo in titulos])
+
+    for linha in linhas:
+        yield escritor.writerow([csv_encode(valor) for valor in linha])
+
+
+# Valor de uma célula do XLSX (textos sempre como unicode)
+def valor_xlsx(valor):
+    if valor is None or isinstance(valor, (bool, int, long, float)):
+        return valor
+
+    return as_unicode(valor)
+
+
+# Escrita de um XLSX no arquivo dado (caminho ou objeto de arquivo)
+def gerar_xlsx(titulos, linhas, arquivo, nome_planilha='Dados'):
+    planilha_xlsx = Workbook(write_only=True)
+    planilha = planilha_xlsx.create_sheet(title=nome_planilha)
+
+    planilha.append([as_unicode(titulo) for titulo in titulos])
+
+    for linha in linhas:
+        planilha.append([valor_xlsx(valor) for valor in linha])
+
+    planilha_xlsx.save(arquivo)
+
+
+# Arquivo temporário (caminho) com o XLSX gerado
+def arquivo_xlsx(titulos, linhas, nome_planilha='Dados'):
+    descritor, caminho = tempfile.mkstemp(suffix='.xlsx')
+    os.close(descritor)
+
+    try:
+        gerar_xlsx(titulos, linhas, caminho, nome_planilha)
+    except:
+        os.remove(caminho)
+        raise
+
+    return caminho
+
+
+# Leitura de um arquivo em blocos, removendo-o ao final
+def ler_e_remover(caminho):
+    try:
+        with open(caminho, 'rb') as arquivo:
+            while True:
+                bloco = arquivo.read(BLOCO_ARQUIVO)
+
+                if not bloco:
+                    break
+
+                yield bloco
+    finally:
+        os.remove(caminho)
@@ -0,0 +1,438 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Importação em Lote de Equipamentos (CSV)
+################################################################################
+
+
+import codecs, csv
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select
+
+from .. import db
+from ..models import Ambiente, Equipamento, Extintor, CondicionadorAr, Manutencao
+
+
+########## Configurações ##########
+
+
+# Número de equipamentos inseridos por comando INSERT (várias linhas por comando)
+LOTE_IMPORTACAO = 500
+
+# Descrição da manutenção inicial criada para cada equipamento importado
+DESCRICAO_INICIAL = 'Manutenção inicial criada na importação do equipamento.'
+
+# Valores aceitos nas colunas de seleção (os mesmos dos formulários de criação)
+CLASSIFICACOES_EXTINTOR = [u'Água [A]', u'Espuma [AB]', u'CO2 [BC]',
+                           u'Pó Químico [BC]', u'Pó Químico [ABC]']
+
+CLASSIFICACOES_CONDICIONADOR = [u'Split', u'Janela', u'Teto Aparente', u'Piso Aparente']
+
+TENSOES_CONDICIONADOR = [220, 380]
+
+EFICIENCIAS_CONDICIONADOR = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+
+# Valores aceitos para verdadeiro e falso (coluna em_uso)
+VERDADEIROS = [u'sim', u's', u'true', u'1', u'x']
+FALSOS = [u'não', u'nao', u'n', u'false', u'0']
+
+
+########## Leitura e Validação dos Campos ##########
+
+
+# Cada linha do arquivo é validada com as mesmas regras dos formulários de criação.
+# As referências e restrições que dependem do banco de dados (ambientes existentes
+# e tombamentos já cadastrados) são carregadas uma única vez antes da validação,
+# de modo que nenhuma consulta é feita por linha. Os erros são acumulados por
+# linha e por campo, para que o arquivo inteiro possa ser corrigido de uma vez.
+
+
+# Erro de validação de um campo
+class ErroCampo(Exception):
+    pass
+
+
+# Texto de um campo (sem espaços nas extremidades; None, caso vazio)
+def texto(valor):
+    valor = (valor or '').strip()
+
+    return valor or None
+
+
+# Número inteiro não negativo
+def inteiro(valor, obrigatorio=True, padrao=None):
+    valor = texto(valor)
+
+    if valor is None:
+        if obrigatorio and padrao is None:
+            raise ErroCampo(u'campo obrigatório')
+        return padrao
+
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise ErroCampo(u'"%s" não é um número inteiro' % valor)
+
+    if numero < 0:
+        raise ErroCampo(u'o valor não pode ser negativo')
+
+    return numero
+
+
+# Número real não negativo (aceita vírgula decimal)
+def real(valor):
+    valor = texto(valor)
+
+    if valor is None:
+        raise ErroCampo(u'campo obrigatório')
+
+    try:
+        numero = float(valor.replace(',', '.'))
+    except ValueError:
+        raise ErroCampo(u'"%s" não é um número' % valor)
+
+    if numero < 0:
+        raise ErroCampo(u'o valor não pode ser negativo')
+
+    return numero
+
+
+# Valor dentre as opções dadas (sem diferenciar maiúsculas de minúsculas)
+def opcao(valor, opcoes):
+    valor = texto(valor)
+
+    if valor is None:
+        raise ErroCampo(u'campo obrigatório')
+
+    for item in opcoes:
+        if unicode(item).lower() == valor.lower():
+            return item
+
+    raise ErroCampo(u'"%s" não é uma opção válida (%s)' %
+                    (valor, ', '.join(unicode(item) for item in opcoes)))
+
+
+# Texto obrigatório com tamanho máximo
+def texto_limitado(valor, tamanho):
+    valor = texto(valor)
+
+    if valor is None:
+        raise ErroCampo(u'campo obrigatório')
+
+    if len(valor) > tamanho:
+        raise ErroCampo(u'máximo de %d caracteres' % tamanho)
+
+    return valor
+
+
+# Valor booleano (padrão: verdadeiro)
+def booleano(valor):
+    valor = texto(valor)
+
+    if valor is None:
+        return True
+
+    if valor.lower() in VERDADEIROS:
+        return True
+
+    if valor.lower() in FALSOS:
+        return False
+
+    raise ErroCampo(u'"%s" não é sim ou não' % valor)
+
+
+# Data [dd.mm.aaaa, dd/mm/aaaa ou aaaa-mm-dd] não futura (padrão: hoje)
+def data(valor):
+    valor = texto(valor)
+
+    if valor is None:
+        return date.today()
+
+    for formato in ('%d.%m.%Y', '%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            resultado = datetime.strptime(valor, formato).date()
+            break
+        except ValueError:
+            continue
+    else:
+        raise ErroCampo(u'"%s" não é uma data (dd.mm.aaaa)' % valor)
+
+    if resultado > date.today():
+        raise ErroCampo(u'não é possível cadastrar datas no futuro')
+
+    return resultado
+
+
+########## Tipos de Equipamentos Importados ##########
+
+
+# Para cada tipo: modelo e campos específicos (coluna do arquivo -> função de
+# leitura). Os campos comuns a todos os tipos são lidos em "ler_linha".
+TIPOS_IMPORTACAO = {
+    Extintor.endpoint: (Extintor, [
+        ('classificacao', lambda valor: opcao(valor, CLASSIFICACOES_EXTINTOR)),
+        ('carga_nominal', real),
+    ]),
+
+    CondicionadorAr.endpoint: (CondicionadorAr, [
+        ('classificacao', lambda valor: opcao(valor, CLASSIFICACOES_CONDICIONADOR)),
+        ('cap_refrigeracao', inteiro),
+        ('pot_nominal', lambda valor: inteiro(valor, obrigatorio=False)),
+        ('tensao_alimentacao', lambda valor: opcao(valor, TENSOES_CONDICIONADOR)),
+        ('eficiencia', lambda valor: opcao(valor, EFICIENCIAS_CONDICIONADOR)),
+    ]),
+}
+
+
+# Colunas do arquivo para um tipo de equipamento (na ordem esperada)
+# - ambiente: id do ambiente ou seu caminho completo, como exibido nas listagens
+#   de equipamentos ("Ambiente - Bloco - Departamento - Centro - Campus")
+# - data_inicial: data da manutenção inicial (opcional, padrão: hoje)
+def colunas_importacao(tipo):
+    modelo, especificos = TIPOS_IMPORTACAO[tipo]
+
+    return ['tombamento'] + [coluna for coluna, leitura in especificos] + \
+           ['fabricante', 'ambiente', 'intervalo_manutencao', 'em_uso',
+            'info_adicional', 'data_inicial']
+
+
+########## Funções ##########
+
+
+# Leitura do arquivo CSV (UTF-8, separado por vírgulas ou ponto e vírgula)
+# Retorna lista de (número da linha, dicionário coluna -> texto)
+def ler_csv(arquivo):
+    conteudo = arquivo.read()
+
+    if conteudo.startswith(codecs.BOM_UTF8):
+        conteudo = conteudo[len(codecs.BOM_UTF8):]
+
+    linhas = conteudo.splitlines()
+
+    if not linhas:
+        return []
+
+    # Planilhas em português costumam ser exportadas com ponto e vírgula
+    separador = ';' if linhas[0].count(';') > linhas[0].count(',') else ','
+
+    leitor = csv.reader(linhas, delimiter=separador)
+
+    cabecalho = [coluna.decode('utf-8').strip().lower() for coluna in next(leitor)]
+
+    return [(numero, dict(zip(cabecalho, [valor.decode('utf-8') for valor in linha])))
+            for numero, linha in enumerate(leitor, 2)
+            if any(valor.strip() for valor in linha)]
+
+
+# Ambientes existentes, por id e por caminho completo (em minúsculas)
+# Caminhos repetidos (ambientes homônimos no mesmo bloco) são marcados como ambíguos
+def carregar_ambientes():
+    ambientes = Ambiente.__table__
+
+    por_id = {}
+    por_caminho = {}
+
+    for linha in db.session.execute(select([ambientes.c.id, ambientes.c.nome,
+                                            ambientes.c.id_bloco,
+                                            ambientes.c.id_departamento,
+                                            ambientes.c.id_centro,
+                                            ambientes.c.id_campus,
+                                            ambientes.c.caminho_local])):
+        # Campos de localização desnormalizados do equipamento (ver models.py)
+        local = dict(id_ambiente=linha.id,
+                     id_bloco=linha.id_bloco,
+                     id_departamento=linha.id_departamento,
+                     id_centro=linha.id_centro,
+                     id_campus=linha.id_campus,
+                     caminho_local=u'%s - %s' % (linha.nome, linha.caminho_local))
+
+        por_id[linha.id] = local
+
+        caminho = local['caminho_local'].lower()
+        por_caminho[caminho] = None if caminho in por_caminho else local
+
+    return por_id, por_caminho
+
+
+# Tombamentos já cadastrados (exceto 0, usado por equipamentos sem tombamento)
+def carregar_tombamentos():
+    return set(tombamento for (tombamento,) in
+               db.session.query(Equipamento.tombamento)
+                         .filter(Equipamento.tombamento != 0))
+
+
+# Local do equipamento a partir da coluna "ambiente" (id ou caminho completo)
+def ler_ambiente(valor, ambientes):
+    por_id, por_caminho = ambientes
+
+    valor = texto(valor)
+
+    if valor is None:
+        raise ErroCampo(u'campo obrigatório')
+
+    if valor.isdigit():
+        local = por_id.get(int(valor))
+    else:
+        caminho = valor.lower()
+
+        if caminho in por_caminho and por_caminho[caminho] is None:
+            raise ErroCampo(u'"%s" corresponde a mais de um ambiente (use o id)' % valor)
+
+        local = por_caminho.get(caminho)
+
+    if local is None:
+        raise ErroCampo(u'ambiente "%s" não encontrado' % valor)
+
+    return local
+
+
+# Leitura e validação de uma linha do arquivo
+# Retorna (valores do equipamento, data da manutenção inicial, erros da linha)
+def ler_linha(campos, especificos, ambientes, tombamentos):
+    valores = {}
+    erros = []
+
+    # Leitura de um campo, acumulando o erro (caso haja)
+    def ler(coluna, leitura):
+        try:
+            return leitura(campos.get(coluna))
+        except ErroCampo as ex:
+            erros.append(u'%s: %s' % (coluna, ex.args[0]))
+
+    valores['tombamento'] = ler('tombamento', lambda valor: inteiro(valor, padrao=0))
+
+    for coluna, leitura in especificos:
+        valores[coluna] = ler(coluna, leitura)
+
+    valores['fabricante'] = ler('fabricante', lambda valor: texto_limitado(valor, 64))
+    valores['intervalo_manutencao'] = ler('intervalo_manutencao', inteiro)
+    valores['em_uso'] = ler('em_uso', booleano)
+    valores['info_adicional'] = texto(campos.get('info_adicional'))
+
+    local = ler('ambiente', lambda valor: ler_ambiente(valor, ambientes))
+
+    if local is not None:
+        valores.update(local)
+
+    data_inicial = ler('data_inicial', data)
+
+    # Tombamento único (no banco de dados e no próprio arquivo)
+    if valores['tombamento']:
+        if valores['tombamento'] in tombamentos:
+            erros.append(u'tombamento: equipamento %d já cadastrado' % valores['tombamento'])
+        else:
+            tombamentos.add(valores['tombamento'])
+
+    return valores, data_inicial, erros
+
+
+# Reserva de ids da sequência de uma tabela (para inserir o equipamento e a
+# linha da tabela do seu tipo no mesmo lote, sem consultar o id de cada um)
+def reservar_ids(tabela, quantidade):
+    sequencia = '%s_id_seq' % tabela.name
+
+    return [id for (id,) in
+            db.session.execute(select([func.nextval(sequencia)])
+                               .select_from(func.generate_series(1, quantidade)))]
+
+
+# Inserção de um lote de equipamentos já validados, com as suas manutenções
+# iniciais (uma inserção de várias linhas por tabela)
+def inserir_lote(modelo, especificos, lote):
+    equipamentos = Equipamento.__table__
+    tabela_tipo = modelo.__table__
+    manutencoes = Manutencao.__table__
+
+    ids = reservar_ids(equipamentos, len(lote))
+
+    # Tipo e categoria (constantes definidos na inicialização de cada modelo)
+    tipo_equipamento = modelo.__mapper__.polymorphic_identity
+    categoria_equipamento = modelo().categoria_equipamento
+
+    linhas_equipamentos = []
+    linhas_tipo = []
+    linhas_manutencoes = []
+
+    for id, (valores, data_inicial) in zip(ids, lote):
+        # A próxima manutenção é calculada a partir da manutenção inicial,
+        # como em "agendar_proxima_manutencao"
+        proxima = data_inicial + timedelta(days=30 * valores['intervalo_manutencao'])
+
+        linhas_equipamentos.append(dict(
+            id=id,
+            tombamento=valores['tombamento'],
+            id_ambiente=valores['id_ambiente'],
+            id_bloco=valores['id_bloco'],
+            id_departamento=valores['id_departamento'],
+            id_centro=valores['id_centro'],
+            id_campus=valores['id_campus'],
+            caminho_local=valores['caminho_local'],
+            categoria_equipamento=categoria_equipamento,
+            tipo_equipamento=tipo_equipamento,
+            fabricante=valores['fabricante'],
+            intervalo_manutencao=valores['intervalo_manutencao'],
+            proxima_manutencao=proxima,
+            info_adicional=valores['info_adicional'],
+            em_uso=valores['em_uso'],
+            em_manutencao=False,
+            agenda_desatualizada=True))
+
+        linha_tipo = dict(id=id)
+
+        for coluna, leitura in especificos:
+            linha_tipo[coluna] = valores[coluna]
+
+        linhas_tipo.append(linha_tipo)
+
+        linhas_manutencoes.append(dict(
+            num_ordem_servico=0,
+            id_equipamento=id,
+            data_abertura=data_inicial,
+            data_conclusao=data_inicial,
+            tipo_manutencao='Inicial',
+            descricao_servico=DESCRICAO_INICIAL,
+            status='Concluída'))
+
+    db.session.execute(equipamentos.insert().values(linhas_equipamentos))
+    db.session.execute(tabela_tipo.insert().values(linhas_tipo))
+    db.session.execute(manutencoes.insert().values(linhas_manutencoes))
+
+
+# Importação dos equipamentos de um tipo (endpoint, ex.: 'extintor') a partir de
+# um arquivo CSV (ver "colunas_importacao")
+# Havendo erros, nada é importado, a menos que "parcial" seja dado: neste caso,
+# apenas as linhas válidas são importadas.
+# Retorna (número de equipamentos importados, lista de (linha, mensagem de erro))
+# O commit fica a cargo de quem chama (uma única transação)
+def importar_equipamentos(tipo, arquivo, parcial=False):
+    modelo, especificos = TIPOS_IMPORTACAO[tipo]
+
+    try:
+        linhas = ler_csv(arquivo)
+    except (csv.Error, UnicodeDecodeError) as ex:
+        return 0, [(1, u'Arquivo inválido: %s' % ex)]
+
+    ambientes = carregar_ambientes()
+    tombamentos = carregar_tombamentos()
+
+    validas = []
+    erros = []
+
+    for numero, campos in linhas:
+        valores, data_inicial, erros_linha = ler_linha(campos, especificos,
+                                                       ambientes, tombamentos)
+
+        if erros_linha:
+            erros.extend((numero, erro) for erro in erros_linha)
+        else:
+            validas.append((valores, data_inicial))
+
+    if erros and not parcial:
+        return 0, erros
+
+    for inicio in range(0, len(validas), LOTE_IMPORTACAO):
+        inserir_lote(modelo, especificos, validas[inicio:inicio + LOTE_IMPORTACAO])
+
+    return len(validas), erros
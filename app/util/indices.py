@@ -0,0 +1,133 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Comparação dos Planos de Execução das Consultas Frequentes
+################################################################################
+
+
+from sqlalchemy import text
+
+from .. import db
+from ..models import Conta, Equipamento, Manutencao
+
+
+########## Consultas Frequentes ##########
+
+
+# Cada consulta é dada por (descrição, SQL, índices que a atendem)
+# Os parâmetros são obtidos do próprio banco de dados (ver "parametros_exemplo")
+CONSULTAS = [
+    ('Manutenções agendadas (listagem)',
+     """SELECT * FROM equipamentos
+        WHERE em_uso = true AND em_manutencao = false
+        ORDER BY proxima_manutencao LIMIT 10""",
+     ['ix_equipamentos_agendados']),
+
+    ('Manutenções abertas (listagem)',
+     """SELECT * FROM manutencoes
+        WHERE status = 'Aberta'
+        ORDER BY data_abertura LIMIT 10""",
+     ['ix_manutencoes_abertas']),
+
+    ('Última manutenção concluída de um equipamento',
+     """SELECT max(data_conclusao) FROM manutencoes
+        WHERE id_equipamento = :id_equipamento AND status = 'Concluída'""",
+     ['ix_manutencoes_concluidas', 'ix_manutencoes_equipamento_abertura']),
+
+    ('Histórico de manutenções de um equipamento',
+     """SELECT * FROM manutencoes
+        WHERE id_equipamento = :id_equipamento
+        ORDER BY data_abertura""",
+     ['ix_manutencoes_equipamento_abertura', 'ix_manutencoes_concluidas']),
+
+    ('Verificação de tombamento existente',
+     """SELECT id FROM equipamentos
+        WHERE tombamento = :tombamento LIMIT 1""",
+     ['ix_equipamentos_tombamento']),
+
+    ('Contas dos últimos anos de uma unidade consumidora',
+     """SELECT * FROM contas
+        WHERE id_unidade_consumidora = :id_unidade_consumidora
+          AND data_leitura >= :data_leitura
+        ORDER BY data_leitura""",
+     ['ix_contas_unidade_leitura']),
+]
+
+
+########## Funções ##########
+
+
+# Parâmetros representativos: o equipamento com mais manutenções, um tombamento
+# existente e a unidade consumidora com mais contas
+def parametros_exemplo():
+    id_equipamento = db.session.query(Manutencao.id_equipamento)\
+                               .group_by(Manutencao.id_equipamento)\
+                               .order_by(db.func.count().desc())\
+                               .limit(1).scalar()
+
+    tombamento = db.session.query(Equipamento.tombamento)\
+                           .filter(Equipamento.tombamento != 0)\
+                           .limit(1).scalar()
+
+    id_unidade_consumidora = db.session.query(Conta.id_unidade_consumidora)\
+                                       .group_by(Conta.id_unidade_consumidora)\
+                                       .order_by(db.func.count().desc())\
+                                       .limit(1).scalar()
+
+    data_leitura = db.session.query(db.func.min(Conta.data_leitura)).scalar()
+
+    return dict(id_equipamento=id_equipamento or 0, tombamento=tombamento or 0,
+                id_unidade_consumidora=id_unidade_consumidora or 0,
+                data_leitura=data_leitura or '2000-01-01')
+
+
+# Plano de execução (EXPLAIN ANALYZE) de uma consulta, como lista de linhas
+def plano_execucao(conexao, sql, parametros):
+    return [linha[0] for linha in
+            conexao.execute(text('EXPLAIN (ANALYZE, BUFFERS) ' + sql), **parametros)]
+
+
+# Configurações do planejador que impedem o uso de índices (válidas apenas na
+# transação, com SET LOCAL)
+SEM_INDICES = ['enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan']
+
+
+# Compara, para cada consulta frequente, o plano de execução com índices e sem
+# eles. Nenhum índice é removido (um DROP INDEX bloquearia a tabela para a
+# aplicação durante toda a comparação): o plano sem índices é obtido desativando
+# as buscas por índice no planejador, numa transação somente leitura desfeita ao
+# final.
+# Retorna lista de (descrição, índices esperados usados no plano, plano com
+# índices, plano sem índices)
+def comparar_indices():
+    parametros = parametros_exemplo()
+    resultados = []
+
+    conexao = db.engine.connect()
+
+    try:
+        for descricao, sql, indices in CONSULTAS:
+            transacao = conexao.begin()
+
+            try:
+                conexao.execute('SET TRANSACTION READ ONLY')
+
+                com_indices = plano_execucao(conexao, sql, parametros)
+
+                for configuracao in SEM_INDICES:
+                    conexao.execute('SET LOCAL %s = off' % configuracao)
+
+                sem_indices = plano_execucao(conexao, sql, parametros)
+            finally:
+                transacao.rollback()
+
+            usados = [indice for indice in indices
+                      if any(indice in linha for linha in com_indices)]
+
+            resultados.append((descricao, usados, com_indices, sem_indices))
+    finally:
+        conexao.close()
+
+    return resultados
@@ -0,0 +1,321 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Agendamento de Manutenções Preventivas
+################################################################################
+
+
+from datetime import date, timedelta
+from sqlalchemy import and_, exists, func, literal, select
+
+from .. import db
+from ..models import Bloco, Equipamento, Manutencao, Usuario, \
+                    marcar_indicadores_desatualizados
+from .email import criar_mensagem, enviar_emails_lote
+
+
+########## Funções ##########
+
+
+# A próxima manutenção preventiva de um equipamento é sempre calculada a partir
+# da data de conclusão da manutenção concluída mais recentemente, somando-se o
+# intervalo de manutenção do equipamento (em meses de 30 dias)
+
+
+# Data de conclusão da manutenção concluída mais recentemente de um equipamento
+# (None, caso não haja manutenções concluídas)
+def ultima_conclusao(id_equipamento):
+    return db.session.query(func.max(Manutencao.data_conclusao))\
+                     .filter(Manutencao.id_equipamento == id_equipamento)\
+                     .filter(Manutencao.status == 'Concluída')\
+                     .scalar()
+
+
+# Cálculo da data da próxima manutenção de um equipamento
+# O equipamento é apenas atualizado na sessão (o commit fica a cargo de quem chama)
+def agendar_proxima_manutencao(equipamento):
+    data_base = ultima_conclusao(equipamento.id)
+
+    if data_base is None or equipamento.intervalo_manutencao is None:
+        equipamento.proxima_manutencao = None
+    else:
+        delta = timedelta(days=30 * equipamento.intervalo_manutencao)
+        equipamento.proxima_manutencao = data_base + delta
+
+    return equipamento.proxima_manutencao
+
+
+# Recálculo em lote da data da próxima manutenção, com um único comando:
+# UPDATE equipamentos SET proxima_manutencao = (SELECT MAX(data_conclusao)
+#                                                FROM manutencoes ...) + ...
+# A última conclusão é uma subconsulta correlacionada: equipamentos sem
+# manutenções concluídas também são atualizados, ficando sem próxima manutenção
+# (como em agendar_proxima_manutencao).
+# Podem ser recalculados todos os equipamentos, apenas os de um tipo
+# (ex.: 'Extintor') ou apenas os de uma lista de ids. Caso seja dado um novo
+# intervalo de manutenção, ele é gravado nos equipamentos e usado no cálculo.
+# Retorna o número de equipamentos atualizados (o commit fica a cargo de quem chama)
+def recalcular_proximas_manutencoes(tipo_equipamento=None, intervalo_manutencao=None,
+                                    ids=None):
+    equipamentos = Equipamento.__table__
+    manutencoes = Manutencao.__table__
+
+    # Última conclusão de cada equipamento (NULL, caso não haja)
+    ultima = select([func.max(manutencoes.c.data_conclusao)])\
+             .where(manutencoes.c.id_equipamento == equipamentos.c.id)\
+             .where(manutencoes.c.status == 'Concluída')\
+             .as_scalar()
+
+    # Intervalo usado no cálculo (o atual de cada equipamento ou o novo)
+    if intervalo_manutencao is None:
+        intervalo = equipamentos.c.intervalo_manutencao
+        valores = {}
+    else:
+        intervalo = intervalo_manutencao
+        valores = {'intervalo_manutencao': intervalo_manutencao}
+
+    valores['proxima_manutencao'] = ultima + intervalo * 30
+
+    # As manutenções agendadas dos equipamentos precisam ser geradas novamente
+    valores['agenda_desatualizada'] = True
+
+    atualizacao = equipamentos.update().values(**valores)
+
+    if tipo_equipamento is not None:
+        atualizacao = atualizacao.where(equipamentos.c.tipo_equipamento == tipo_equipamento)
+
+    if ids is not None:
+        atualizacao = atualizacao.where(equipamentos.c.id.in_(ids))
+
+    return db.session.execute(atualizacao).rowcount
+
+
+########## Operações em Lote ##########
+
+
+# Operações sobre vários equipamentos/manutenções de uma só vez (ações em lote do
+# painel de administração). Cada operação é feita com comandos INSERT ... SELECT e
+# UPDATE sobre todos os itens, seguidos de um único recálculo da situação dos
+# equipamentos afetados. O commit fica a cargo de quem chama (uma única transação).
+
+
+# Recálculo da situação dos equipamentos dados:
+# - em_manutencao: há alguma manutenção aberta?
+# - inicio_manutencao: data de abertura da manutenção aberta mais antiga
+# - proxima_manutencao: a partir da manutenção concluída mais recente
+# A agenda e os indicadores de confiabilidade dos equipamentos ficam
+# desatualizados (os comandos em lote não disparam os eventos do ORM)
+def atualizar_situacao_equipamentos(ids):
+    if not ids:
+        return 0
+
+    equipamentos = Equipamento.__table__
+    manutencoes = Manutencao.__table__
+
+    # Manutenções abertas de cada equipamento (subconsultas correlacionadas)
+    abertas = and_(manutencoes.c.id_equipamento == equipamentos.c.id,
+                   manutencoes.c.status == 'Aberta')
+
+    em_manutencao = exists().where(abertas)
+
+    inicio_manutencao = select([func.min(manutencoes.c.data_abertura)])\
+                        .where(abertas)\
+                        .as_scalar()
+
+    db.session.execute(equipamentos.update()
+                                   .where(equipamentos.c.id.in_(ids))
+                                   .values(em_manutencao=em_manutencao,
+                                           inicio_manutencao=inicio_manutencao,
+                                           agenda_desatualizada=True))
+
+    marcar_indicadores_desatualizados(db.session.connection(), ids)
+
+    return recalcular_proximas_manutencoes(ids=ids)
+
+
+# Abertura de uma manutenção para cada equipamento dado (em uso e sem manutenção
+# aberta). Retorna os ids dos equipamentos em que a manutenção foi aberta.
+def abrir_manutencoes(ids, tipo_manutencao='Preventiva', data_abertura=None,
+                      descricao_servico=None):
+    return _inserir_manutencoes(ids, tipo_manutencao, 'Aberta',
+                                data_abertura or date.today(), None,
+                                descricao_servico)
+
+
+# Registro de uma manutenção já concluída para cada equipamento dado (em uso e sem
+# manutenção aberta), como após uma inspeção de todo um bloco.
+# Retorna os ids dos equipamentos em que a manutenção foi registrada.
+def registrar_manutencoes(ids, tipo_manutencao='Preventiva', data_conclusao=None,
+                          descricao_servico=None):
+    data_conclusao = data_conclusao or date.today()
+
+    return _inserir_manutencoes(ids, tipo_manutencao, 'Concluída',
+                                data_conclusao, data_conclusao, descricao_servico)
+
+
+# Inserção das manutenções (INSERT ... SELECT) e recálculo dos equipamentos
+def _inserir_manutencoes(ids, tipo_manutencao, status, data_abertura, data_conclusao,
+                         descricao_servico):
+    equipamentos = Equipamento.__table__
+    manutencoes = Manutencao.__table__
+
+    # Equipamentos aptos (em uso e sem manutenção aberta)
+    aptos = [id for (id,) in
+             db.session.query(Equipamento.id)
+                       .filter(Equipamento.id.in_(ids))
+                       .filter(Equipamento.em_uso == True)
+                       .filter(Equipamento.em_manutencao == False)]
+
+    if not aptos:
+        return []
+
+    colunas = ['num_ordem_servico', 'id_equipamento', 'data_abertura',
+               'data_conclusao', 'tipo_manutencao', 'descricao_servico', 'status']
+
+    selecao = select([literal(0),
+                      equipamentos.c.id,
+                      literal(data_abertura, manutencoes.c.data_abertura.type),
+                      literal(data_conclusao, manutencoes.c.data_conclusao.type),
+                      literal(tipo_manutencao),
+                      literal(descricao_servico, manutencoes.c.descricao_servico.type),
+                      literal(status)])\
+              .where(equipamentos.c.id.in_(aptos))
+
+    db.session.execute(manutencoes.insert().from_select(colunas, selecao))
+
+    atualizar_situacao_equipamentos(aptos)
+
+    return aptos
+
+
+# Conclusão das manutenções abertas dadas (na data dada ou hoje)
+# Seguem-se as mesmas regras da conclusão individual:
+# - Inicial: as demais manutenções iniciais do equipamento são excluídas
+# - Troca: o equipamento é colocado fora de uso
+# Retorna o número de manutenções concluídas
+def concluir_manutencoes(ids, data_conclusao=None):
+    manutencoes = Manutencao.__table__
+    equipamentos = Equipamento.__table__
+
+    # Manutenções abertas dentre as dadas e seus equipamentos
+    abertas = db.session.query(Manutencao.id, Manutencao.id_equipamento,
+                               Manutencao.tipo_manutencao)\
+                        .filter(Manutencao.id.in_(ids))\
+                        .filter(Manutencao.status == 'Aberta')\
+                        .all()
+
+    if not abertas:
+        return 0
+
+    ids_abertas = [linha.id for linha in abertas]
+    ids_equipamentos = list(set(linha.id_equipamento for linha in abertas))
+
+    db.session.execute(manutencoes.update()
+                                  .where(manutencoes.c.id.in_(ids_abertas))
+                                  .values(status='Concluída',
+                                          data_conclusao=data_conclusao or date.today()))
+
+    # Manutenções iniciais: manter apenas a que foi concluída
+    iniciais = [linha for linha in abertas if linha.tipo_manutencao == 'Inicial']
+
+    if iniciais:
+        db.session.execute(manutencoes.delete()
+            .where(manutencoes.c.tipo_manutencao == 'Inicial')
+            .where(manutencoes.c.id_equipamento.in_([linha.id_equipamento
+                                                     for linha in iniciais]))
+            .where(~manutencoes.c.id.in_([linha.id for linha in iniciais])))
+
+    # Trocas: equipamentos antigos fora de uso
+    trocas = [linha.id_equipamento for linha in abertas
+              if linha.tipo_manutencao == 'Troca']
+
+    if trocas:
+        db.session.execute(equipamentos.update()
+                                       .where(equipamentos.c.id.in_(trocas))
+                                       .values(em_uso=False,
+                                               agenda_desatualizada=True))
+
+    atualizar_situacao_equipamentos(ids_equipamentos)
+
+    return len(ids_abertas)
+
+
+########## Avisos de Manutenções Vencidas ##########
+
+
+# Equipamentos em uso (e sem manutenção aberta) cuja próxima manutenção preventiva
+# vence até a data de referência (hoje + antecedência), junto com os responsáveis
+# pela unidade responsável do seu bloco. A busca é feita em uma única consulta
+# (uma linha por par equipamento/responsável; sem responsável, email e nome são None)
+def manutencoes_vencidas(antecedencia=0):
+    data_limite = date.today() + timedelta(days=antecedencia)
+
+    return db.session.query(Equipamento.id,
+                            Equipamento.tipo_equipamento,
+                            Equipamento.tombamento,
+                            Equipamento.caminho_local,
+                            Equipamento.proxima_manutencao,
+                            Usuario.email,
+                            Usuario.nome)\
+                     .outerjoin(Bloco, Equipamento.id_bloco == Bloco.id)\
+                     .outerjoin(Usuario,
+                                and_(Usuario.id_unidade_responsavel ==
+                                         Bloco.id_unidade_responsavel,
+                                     Usuario.verificado == True))\
+                     .filter(Equipamento.em_uso == True)\
+                     .filter(Equipamento.em_manutencao == False)\
+                     .filter(Equipamento.proxima_manutencao <= data_limite)\
+                     .order_by(Equipamento.proxima_manutencao,
+                               Equipamento.tipo_equipamento,
+                               Equipamento.tombamento)\
+                     .all()
+
+
+# Agrupamento das manutenções vencidas por destinatário
+# Equipamentos de blocos sem unidade responsável (ou cuja unidade não possui
+# responsáveis verificados) são enviados aos administradores
+# Retorna um dicionário {email: (nome, [equipamentos])}
+def agrupar_por_responsavel(linhas):
+    resumos = {}
+    sem_responsavel = []
+
+    for linha in linhas:
+        if linha.email is None:
+            sem_responsavel.append(linha)
+        else:
+            resumos.setdefault(linha.email, (linha.nome, []))[1].append(linha)
+
+    if sem_responsavel:
+        for administrador in Usuario.listar_administradores():
+            equipamentos = resumos.setdefault(administrador.email,
+                                              (administrador.nome, []))[1]
+
+            # Evitar repetir equipamentos dos quais o administrador já é responsável
+            ids = set(equipamento.id for equipamento in equipamentos)
+
+            equipamentos.extend(linha for linha in sem_responsavel
+                                if linha.id not in ids)
+
+    return resumos
+
+
+# Envio de um resumo das manutenções vencidas para cada responsável
+# Todas as mensagens são enviadas por uma única conexão SMTP
+# Retorna o número de emails enviados
+def avisar_manutencoes_vencidas(antecedencia=0):
+    resumos = agrupar_por_responsavel(manutencoes_vencidas(antecedencia))
+
+    # Nada a avisar (não é necessário conectar ao servidor de email)
+    if not resumos:
+        return 0
+
+    hoje = date.today()
+
+    mensagens = (criar_mensagem(email, 'Manutenções Preventivas Vencidas',
+                                'principal/email/manutencoes_vencidas',
+                                nome=nome, equipamentos=equipamentos, hoje=hoje)
+                 for email, (nome, equipamentos) in sorted(resumos.items()))
+
+    return enviar_emails_lote(mensagens)
@@ -0,0 +1,114 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Miniaturas das Geometrias (SVG)
+################################################################################
+
+
+import os, hashlib, tempfile
+
+from flask import current_app
+from geoalchemy2.shape import to_shape
+
+
+########## Configurações ##########
+
+
+# Dimensões padrão das miniaturas [px]
+LARGURA_MINIATURA = 100
+ALTURA_MINIATURA = 70
+
+# Extensão mínima do desenho [graus] (pontos isolados não têm extensão)
+EXTENSAO_MINIMA = 0.002
+
+
+########## Funções ##########
+
+
+# As miniaturas são desenhadas a partir da própria geometria (sem mapa de fundo)
+# e guardadas em disco, com o nome dado pelo hash da geometria e das dimensões.
+# Como o conteúdo de um arquivo nunca muda, elas podem ser servidas com cache de
+# longa duração: uma geometria alterada gera uma nova chave (e um novo arquivo).
+
+
+# Pasta das miniaturas
+def pasta_miniaturas():
+    pasta = current_app.config['MINIATURAS_DIR']
+
+    if not os.path.isdir(pasta):
+        try:
+            os.makedirs(pasta)
+        except OSError:
+            # Pasta criada por outro processo
+            if not os.path.isdir(pasta):
+                raise
+
+    return pasta
+
+
+# Chave (nome do arquivo, sem extensão) da miniatura de uma geometria (WKBElement)
+def chave_miniatura(geometria, largura=LARGURA_MINIATURA, altura=ALTURA_MINIATURA):
+    dados = bytes(geometria.data)
+
+    return '%s-%dx%d' % (hashlib.sha1(dados).hexdigest(), largura, altura)
+
+
+# Desenho SVG de uma geometria (shapely) nas dimensões dadas
+# O eixo y é invertido (latitude cresce para cima) e as bordas proporcionais
+# à extensão da geometria
+def desenhar_svg(forma, largura=LARGURA_MINIATURA, altura=ALTURA_MINIATURA):
+    min_x, min_y, max_x, max_y = forma.bounds
+
+    # Extensão do desenho (com margem de 10%), mantendo a proporção da miniatura
+    extensao_x = max(max_x - min_x, EXTENSAO_MINIMA) * 1.2
+    extensao_y = max(max_y - min_y, EXTENSAO_MINIMA) * 1.2
+
+    if extensao_x / extensao_y < float(largura) / altura:
+        extensao_x = extensao_y * largura / altura
+    else:
+        extensao_y = extensao_x * altura / largura
+
+    centro_x = (min_x + max_x) / 2.0
+    centro_y = (min_y + max_y) / 2.0
+
+    caixa = (centro_x - extensao_x / 2.0, -(centro_y + extensao_y / 2.0),
+             extensao_x, extensao_y)
+
+    # Fator de escala dos traços e marcadores (proporcional a 1 px)
+    escala = extensao_x / largura
+
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+            'viewBox="%r %r %r %r" preserveAspectRatio="xMidYMid meet">'
+            '<rect x="%r" y="%r" width="%r" height="%r" fill="#f5f5f5"/>'
+            '<g transform="scale(1,-1)">%s</g></svg>') % \
+           ((largura, altura) + caixa + caixa + (forma.svg(scale_factor=escala),))
+
+
+# Caminho do arquivo de uma miniatura já gerada (None, caso não exista)
+def arquivo_miniatura(chave):
+    caminho = os.path.join(pasta_miniaturas(), chave + '.svg')
+
+    return caminho if os.path.isfile(caminho) else None
+
+
+# Geração (caso ainda não esteja em disco) da miniatura de uma geometria
+# Retorna a chave da miniatura
+def gerar_miniatura(geometria, largura=LARGURA_MINIATURA, altura=ALTURA_MINIATURA):
+    chave = chave_miniatura(geometria, largura, altura)
+
+    if arquivo_miniatura(chave) is None:
+        svg = desenhar_svg(to_shape(geometria), largura, altura)
+
+        # Escrita em arquivo temporário e renomeação (atômica), para que um
+        # request concorrente nunca sirva um arquivo incompleto
+        pasta = pasta_miniaturas()
+        descritor, temporario = tempfile.mkstemp(suffix='.svg', dir=pasta)
+
+        with os.fdopen(descritor, 'w') as arquivo:
+            arquivo.write(svg)
+
+        os.rename(temporario, os.path.join(pasta, chave + '.svg'))
+
+    return chave
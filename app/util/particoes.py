@@ -0,0 +1,133 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Partições Anuais das Tabelas de Manutenções e Contas
+################################################################################
+
+
+from datetime import date
+from sqlalchemy import text
+
+from .. import db
+from ..models import TABELAS_PARTICIONADAS
+
+
+########## Configurações ##########
+
+
+# Número de anos seguintes ao atual com partições criadas antecipadamente
+ANOS_FUTUROS = 2
+
+
+########## Funções ##########
+
+
+# Cada partição anual cobre o intervalo [1º de janeiro do ano, 1º de janeiro do
+# ano seguinte). As linhas cujas datas não têm partição própria ficam na partição
+# padrão; ao criar a partição de um ano, as linhas desse ano que estiverem na
+# partição padrão são movidas para ela na mesma transação (o PostgreSQL não
+# permite anexar uma partição cujo intervalo tenha linhas na partição padrão).
+
+
+# Nome da partição de uma tabela para um ano
+def nome_particao(tabela, ano):
+    return '%s_%d' % (tabela, ano)
+
+
+# Nome da partição padrão de uma tabela
+def nome_particao_padrao(tabela):
+    return '%s_padrao' % tabela
+
+
+# Tabela particionada no banco de dados (falso para bancos criados sem as
+# migrações, como os de teste, ou que não sejam PostgreSQL)
+def tabela_particionada(conexao, tabela):
+    if conexao.dialect.name != 'postgresql':
+        return False
+
+    return conexao.execute(text("""SELECT EXISTS (SELECT 1 FROM pg_class
+                                                  WHERE relname = :tabela
+                                                    AND relkind = 'p')"""),
+                           tabela=tabela).scalar()
+
+
+# Nomes das partições existentes de uma tabela
+def particoes_existentes(conexao, tabela):
+    return set(nome for (nome,) in conexao.execute(text(
+        """SELECT particao.relname FROM pg_inherits
+           JOIN pg_class particao ON particao.oid = pg_inherits.inhrelid
+           JOIN pg_class tabela ON tabela.oid = pg_inherits.inhparent
+           WHERE tabela.relname = :tabela"""), tabela=tabela))
+
+
+# Criação da partição de um ano, com as linhas do ano que estavam na partição padrão
+# A partição é criada à parte, preenchida e então anexada à tabela (os índices e
+# as chaves da tabela são criados na partição pelo próprio PostgreSQL)
+def criar_particao(conexao, tabela, coluna, ano):
+    particao = nome_particao(tabela, ano)
+    parametros = dict(inicio=date(ano, 1, 1), fim=date(ano + 1, 1, 1))
+
+    conexao.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (particao, tabela))
+
+    conexao.execute(text("""WITH movidas AS (DELETE FROM %s
+                                             WHERE %s >= :inicio AND %s < :fim
+                                             RETURNING *)
+                            INSERT INTO %s SELECT * FROM movidas"""
+                         % (nome_particao_padrao(tabela), coluna, coluna, particao)),
+                    **parametros)
+
+    # Os limites precisam ser literais (não parâmetros) no PostgreSQL 11
+    conexao.execute("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')"
+                    % (tabela, particao, parametros['inicio'], parametros['fim']))
+
+    return particao
+
+
+# Criação das partições que faltam, do ano atual até ANOS_FUTUROS anos à frente,
+# de todas as tabelas particionadas (uma transação por partição)
+# Deve ser agendada para execução periódica (pelo menos uma vez por ano)
+# Retorna os nomes das partições criadas
+def criar_particoes(anos=ANOS_FUTUROS):
+    ano_atual = date.today().year
+
+    criadas = []
+
+    for tabela, coluna in TABELAS_PARTICIONADAS.items():
+        with db.engine.begin() as conexao:
+            if not tabela_particionada(conexao, tabela.name):
+                continue
+
+            existentes = particoes_existentes(conexao, tabela.name)
+
+        for ano in range(ano_atual, ano_atual + anos + 1):
+            if nome_particao(tabela.name, ano) in existentes:
+                continue
+
+            with db.engine.begin() as conexao:
+                criadas.append(criar_particao(conexao, tabela.name, coluna, ano))
+
+    return criadas
+
+
+# Desanexação da partição de um ano de uma tabela particionada
+# As linhas do ano deixam a tabela (e as consultas da aplicação) sem serem
+# reescritas: a partição continua no banco como uma tabela independente, que
+# pode ser exportada ou excluída à parte (as partições de manutenções mantêm a
+# chave estrangeira para os equipamentos; para manutenções ainda consultadas no
+# histórico, prefira o arquivamento, "python launcher.py arquivar")
+# Retorna o nome da partição desanexada
+def desanexar_particao(tabela, ano):
+    if tabela not in [particionada.name for particionada in TABELAS_PARTICIONADAS]:
+        raise ValueError('Tabela não particionada: %s' % tabela)
+
+    particao = nome_particao(tabela, ano)
+
+    with db.engine.begin() as conexao:
+        if particao not in particoes_existentes(conexao, tabela):
+            raise ValueError('Partição não encontrada: %s' % particao)
+
+        conexao.execute('ALTER TABLE %s DETACH PARTITION %s' % (tabela, particao))
+
+    return particao
@@ -0,0 +1,215 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Previsão da Carga de Manutenções Preventivas
+################################################################################
+
+
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from .. import db
+from ..models import Bloco, Equipamento, Manutencao
+
+
+########## Classes ##########
+
+
+# Frota de equipamentos em uso, representada por vetores (um elemento por
+# equipamento), para que a projeção seja feita sem instanciar objetos do ORM
+class Frota(object):
+    # Inicialização
+    # tipos e blocos são guardados como códigos inteiros (índices nas listas de
+    # nomes), as datas base como datetime64[D] e os intervalos em meses
+    def __init__(self, ids, tipos, nomes_tipos, blocos, nomes_blocos,
+                 intervalos, datas_base):
+        self.ids = ids
+        self.tipos = tipos
+        self.nomes_tipos = nomes_tipos
+        self.blocos = blocos
+        self.nomes_blocos = nomes_blocos
+        self.intervalos = intervalos
+        self.datas_base = datas_base
+
+    # Número de equipamentos
+    def __len__(self):
+        return len(self.ids)
+
+    # Intervalos de manutenção (em dias) após alterações hipotéticas por tipo
+    # (dicionário {tipo de equipamento: novo intervalo em meses})
+    def intervalos_dias(self, alteracoes=None):
+        intervalos = self.intervalos.copy()
+
+        for tipo, intervalo in (alteracoes or {}).items():
+            if tipo in self.nomes_tipos:
+                intervalos[self.tipos == self.nomes_tipos.index(tipo)] = intervalo
+
+        return intervalos * 30
+
+
+# Manutenções projetadas (uma posição por manutenção prevista)
+class Projecao(object):
+    # Inicialização
+    def __init__(self, frota, inicio, fim, indices, datas):
+        self.frota = frota
+        self.inicio = inicio
+        self.fim = fim
+        self.indices = indices      # Índice do equipamento na frota
+        self.datas = datas          # Data prevista (datetime64[D])
+
+    # Número de manutenções previstas
+    def __len__(self):
+        return len(self.datas)
+
+    # Semana de cada manutenção (contada a partir da segunda-feira do início)
+    def semanas(self):
+        segunda = np.datetime64(self.inicio - timedelta(days=self.inicio.weekday()), 'D')
+
+        return (self.datas - segunda).astype(np.int64) // 7
+
+    # Total de manutenções por semana
+    # Retorna lista de (data de início da semana, total, {tipo: total})
+    def por_semana(self):
+        semanas = self.semanas()
+        tipos = self.frota.tipos[self.indices]
+
+        num_semanas = int(semanas.max()) + 1 if len(semanas) else 0
+        num_tipos = len(self.frota.nomes_tipos)
+
+        # Contagem por (semana, tipo) em uma única passada
+        contagem = np.bincount(semanas * num_tipos + tipos,
+                               minlength=num_semanas * num_tipos)\
+                     .reshape(num_semanas, num_tipos) if num_semanas else \
+                   np.zeros((0, num_tipos), dtype=np.int64)
+
+        segunda = self.inicio - timedelta(days=self.inicio.weekday())
+
+        return [(segunda + timedelta(weeks=semana),
+                 int(contagem[semana].sum()),
+                 dict((nome, int(contagem[semana, codigo]))
+                      for codigo, nome in enumerate(self.frota.nomes_tipos)))
+                for semana in range(num_semanas)]
+
+    # Total de manutenções por bloco e tipo de equipamento
+    # Retorna lista de (nome do bloco, total, {tipo: total}), em ordem decrescente
+    def por_bloco(self):
+        blocos = self.frota.blocos[self.indices]
+        tipos = self.frota.tipos[self.indices]
+
+        num_blocos = len(self.frota.nomes_blocos)
+        num_tipos = len(self.frota.nomes_tipos)
+
+        contagem = np.bincount(blocos * num_tipos + tipos,
+                               minlength=num_blocos * num_tipos)\
+                     .reshape(num_blocos, num_tipos)
+
+        totais = contagem.sum(axis=1)
+
+        return [(self.frota.nomes_blocos[bloco], int(totais[bloco]),
+                 dict((nome, int(contagem[bloco, codigo]))
+                      for codigo, nome in enumerate(self.frota.nomes_tipos)))
+                for bloco in np.argsort(-totais, kind='mergesort')
+                if totais[bloco]]
+
+    # Total de manutenções por tipo de equipamento
+    def por_tipo(self):
+        contagem = np.bincount(self.frota.tipos[self.indices],
+                               minlength=len(self.frota.nomes_tipos))
+
+        return dict((nome, int(contagem[codigo]))
+                    for codigo, nome in enumerate(self.frota.nomes_tipos))
+
+
+########## Funções ##########
+
+
+# Carregamento da frota de equipamentos em uso com uma única consulta
+# (apenas colunas, sem objetos do ORM)
+# A data base de cada equipamento é a conclusão mais recente de manutenção;
+# equipamentos sem manutenção concluída usam a próxima manutenção já agendada
+# (recuada de um intervalo) e, sem nenhuma das duas, ficam fora da previsão
+def carregar_frota(query=None):
+    ultimas = db.session.query(Manutencao.id_equipamento,
+                               func.max(Manutencao.data_conclusao).label('data_conclusao'))\
+                        .filter(Manutencao.status == 'Concluída')\
+                        .group_by(Manutencao.id_equipamento)\
+                        .subquery()
+
+    if query is None:
+        query = Equipamento.query
+
+    linhas = query.filter(Equipamento.em_uso == True)\
+                  .filter(Equipamento.intervalo_manutencao > 0)\
+                  .outerjoin(ultimas, ultimas.c.id_equipamento == Equipamento.id)\
+                  .outerjoin(Bloco, Bloco.id == Equipamento.id_bloco)\
+                  .with_entities(Equipamento.id,
+                                 Equipamento.tipo_equipamento,
+                                 Bloco.nome,
+                                 Equipamento.intervalo_manutencao,
+                                 ultimas.c.data_conclusao,
+                                 Equipamento.proxima_manutencao)\
+                  .all()
+
+    nomes_tipos = sorted(set(linha[1] for linha in linhas))
+    nomes_blocos = sorted(set(linha[2] or 'Sem Bloco' for linha in linhas))
+
+    codigos_tipos = dict((nome, codigo) for codigo, nome in enumerate(nomes_tipos))
+    codigos_blocos = dict((nome, codigo) for codigo, nome in enumerate(nomes_blocos))
+
+    ids, tipos, blocos, intervalos, datas_base = [], [], [], [], []
+
+    for id, tipo, bloco, intervalo, conclusao, proxima in linhas:
+        if conclusao is None:
+            if proxima is None:
+                continue
+
+            conclusao = proxima - timedelta(days=30 * intervalo)
+
+        ids.append(id)
+        tipos.append(codigos_tipos[tipo])
+        blocos.append(codigos_blocos[bloco or 'Sem Bloco'])
+        intervalos.append(intervalo)
+        datas_base.append(conclusao)
+
+    return Frota(np.array(ids, dtype=np.int64),
+                 np.array(tipos, dtype=np.int64), nomes_tipos,
+                 np.array(blocos, dtype=np.int64), nomes_blocos,
+                 np.array(intervalos, dtype=np.int64),
+                 np.array(datas_base, dtype='datetime64[D]'))
+
+
+# Projeção das manutenções preventivas da frota no horizonte dado (em meses)
+# Uma manutenção já vencida é considerada como realizada no início do horizonte,
+# e as seguintes a partir dela. Alterações hipotéticas de intervalo podem ser
+# dadas por tipo de equipamento ({tipo: meses}), sem alterar o banco de dados.
+# Todo o cálculo é vetorizado (np.repeat/np.arange), sem laços por equipamento
+def projetar(frota, horizonte=24, alteracoes=None, inicio=None):
+    inicio = inicio or date.today()
+    fim = inicio + timedelta(days=30 * horizonte)
+
+    inicio_d = np.datetime64(inicio, 'D')
+    fim_d = np.datetime64(fim, 'D')
+
+    dias = frota.intervalos_dias(alteracoes)
+
+    # Primeira manutenção de cada equipamento dentro do horizonte
+    primeiras = np.maximum(frota.datas_base + dias.astype('timedelta64[D]'), inicio_d)
+
+    # Número de manutenções de cada equipamento até o fim do horizonte
+    restantes = (fim_d - primeiras).astype(np.int64)
+    quantidades = np.where(restantes >= 0, restantes // dias + 1, 0)
+
+    # Expansão: uma posição por manutenção prevista
+    indices = np.repeat(np.arange(len(frota)), quantidades)
+
+    # Ordem da manutenção dentro do seu equipamento (0, 1, 2, ...)
+    deslocamentos = np.cumsum(quantidades) - quantidades
+    ordens = np.arange(len(indices)) - np.repeat(deslocamentos, quantidades)
+
+    datas = primeiras[indices] + (ordens * dias[indices]).astype('timedelta64[D]')
+
+    return Projecao(frota, inicio, fim, indices, datas)
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Geração e Verificação dos Hashes das Senhas
+################################################################################
+
+
+import atexit, multiprocessing, os, threading
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash, \
+                              DEFAULT_PBKDF2_ITERATIONS
+
+
+########## Configurações ##########
+
+
+# Valores usados quando a configuração da aplicação não os define (ver config.py)
+
+# Método do hash (no formato do Werkzeug: "pbkdf2:<algoritmo>:<iterações>")
+METODO_PADRAO = 'pbkdf2:sha256:50000'
+
+# Tamanho do sal [caracteres]
+TAMANHO_SAL_PADRAO = 16
+
+# Tempo máximo de espera pelo resultado de um processo [s]
+ESPERA_PADRAO = 10
+
+
+########## Erros ##########
+
+
+# Todos os processos de hash do processo atual estão ocupados (o request é
+# recusado em vez de esperar, para não ocupar o worker da aplicação)
+class ServicoSenhasOcupado(ServiceUnavailable):
+    description = 'Muitos acessos simultâneos. Tente novamente em instantes.'
+
+
+########## Processos de Hash ##########
+
+
+# O cálculo dos hashes ocupa a CPU por dezenas de milissegundos. Por padrão, ele
+# é feito no próprio request; com SENHA_PROCESSOS > 0, é feito num pool de
+# processos (um por processo da aplicação, criado no primeiro uso), de modo que
+# vários logins simultâneos usem vários núcleos. No máximo SENHA_SIMULTANEAS
+# cálculos ficam em andamento ou na fila do pool: além disso, o request recebe
+# o erro 503 (ServicoSenhasOcupado).
+
+
+# Pool, processo em que foi criado e semáforo que limita os cálculos simultâneos
+pool = None
+processo_pool = None
+semaforo = None
+
+# Trava de inicialização do pool
+trava_pool = threading.Lock()
+
+
+# Pool de processos do processo atual (criado caso ainda não exista)
+def iniciar_pool(processos, simultaneas):
+    global pool, processo_pool, semaforo
+
+    with trava_pool:
+        if pool is None or processo_pool != os.getpid():
+            pool = multiprocessing.Pool(processos)
+            processo_pool = os.getpid()
+            semaforo = threading.BoundedSemaphore(simultaneas)
+
+        return pool, semaforo
+
+
+# Encerramento do pool (ao encerrar o processo)
+@atexit.register
+def encerrar_pool():
+    if pool is not None and processo_pool == os.getpid():
+        pool.terminate()
+
+
+# Execução de uma função de hash, no request ou no pool, conforme a configuração
+def executar(funcao, *args):
+    config = current_app.config
+    processos = config.get('SENHA_PROCESSOS', 0)
+
+    if not processos:
+        return funcao(*args)
+
+    pool, semaforo = iniciar_pool(processos, config.get('SENHA_SIMULTANEAS', processos))
+
+    if not semaforo.acquire(False):
+        raise ServicoSenhasOcupado()
+
+    try:
+        return pool.apply_async(funcao, args).get(config.get('SENHA_ESPERA', ESPERA_PADRAO))
+    except multiprocessing.TimeoutError:
+        raise ServicoSenhasOcupado()
+    finally:
+        semaforo.release()
+
+
+########## Funções ##########
+
+
+# Método do hash configurado (com o número de iterações, como é gravado no hash)
+def metodo_configurado():
+    metodo = current_app.config.get('SENHA_METODO', METODO_PADRAO)
+
+    if metodo.startswith('pbkdf2:') and metodo.count(':') == 1:
+        metodo += ':%d' % DEFAULT_PBKDF2_ITERATIONS
+
+    return metodo
+
+
+# Tamanho do sal configurado
+def tamanho_sal_configurado():
+    return current_app.config.get('SENHA_TAMANHO_SAL', TAMANHO_SAL_PADRAO)
+
+
+# Hash de uma senha com o método e o tamanho de sal configurados
+def gerar_hash_senha(senha):
+    return executar(generate_password_hash, senha, metodo_configurado(),
+                    tamanho_sal_configurado())
+
+
+# Teste de uma senha a partir do seu hash (de qualquer método)
+def verificar_hash_senha(senha_hash, senha):
+    if not senha_hash:
+        return False
+
+    return executar(check_password_hash, senha_hash, senha)
+
+
+# Hash gerado com um método ou tamanho de sal diferente do configurado (deve ser
+# gerado novamente no próximo login). O formato é "<método>$<sal>$<hash>", e o
+# método inclui o número de iterações ("pbkdf2:sha256:50000")
+def hash_desatualizado(senha_hash):
+    if not senha_hash or senha_hash.count('$') != 2:
+        return True
+
+    metodo, sal, hash = senha_hash.split('$')
+
+    return metodo != metodo_configurado() or len(sal) != tamanho_sal_configurado()
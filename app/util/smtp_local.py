@@ -0,0 +1,85 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Servidor SMTP Local (Desenvolvimento e Testes)
+################################################################################
+
+
+# Importação absoluta: o módulo "email" da biblioteca padrão, e não app/util/email.py
+from __future__ import absolute_import
+
+import asyncore, smtpd, threading
+from email import message_from_string
+
+
+########## Configurações ##########
+
+
+# Endereço e porta padrão do servidor local
+ENDERECO_PADRAO = 'localhost'
+PORTA_PADRAO = 1025
+
+
+########## Servidor ##########
+
+
+# Servidor SMTP que apenas guarda as mensagens recebidas (não as entrega), para
+# uso no lugar do servidor real durante o desenvolvimento e os testes. A
+# aplicação deve ser configurada com MAIL_SERVER e MAIL_PORT do servidor local,
+# sem TLS nem autenticação (ver ConfigTeste em config.py)
+class ServidorSMTPLocal(smtpd.SMTPServer):
+    # Inicialização (endereço, porta e, opcionalmente, uma função chamada a cada
+    # mensagem recebida)
+    def __init__(self, endereco=ENDERECO_PADRAO, porta=PORTA_PADRAO, ao_receber=None):
+        smtpd.SMTPServer.__init__(self, (endereco, porta), None)
+
+        # Mensagens recebidas: (remetente, destinatários, mensagem de email)
+        self.mensagens = []
+
+        # Número de conexões SMTP recebidas
+        self.conexoes = 0
+
+        self.ao_receber = ao_receber
+        self.thread = None
+
+    # Nova conexão (contada para verificar a reutilização das conexões)
+    def handle_accept(self):
+        self.conexoes += 1
+
+        smtpd.SMTPServer.handle_accept(self)
+
+    # Mensagem recebida
+    def process_message(self, remetente, ip, destinatarios, dados):
+        mensagem = (remetente, destinatarios, message_from_string(dados))
+
+        self.mensagens.append(mensagem)
+
+        if self.ao_receber is not None:
+            self.ao_receber(*mensagem)
+
+    # Execução em primeiro plano (até ser interrompido)
+    def executar(self):
+        asyncore.loop(timeout=1, map=self._map)
+
+    # Execução em segundo plano (numa thread), para uso nos testes
+    def iniciar(self):
+        self.thread = threading.Thread(target=self.executar, name='servidor-smtp-local')
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    # Encerramento do servidor
+    def encerrar(self):
+        self.close()
+
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *args):
+        self.encerrar()
@@ -0,0 +1,250 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Execução das Tarefas de Exportação em Segundo Plano
+################################################################################
+
+
+import gzip, os, tempfile, time
+from datetime import datetime, timedelta
+from flask import current_app
+
+from .. import db
+from ..models import TarefaExportacao
+from .exportacao import LOTE_EXPORTACAO, gerar_csv, arquivo_xlsx
+
+
+########## Configurações ##########
+
+
+# Intervalo entre as verificações da fila quando não há tarefas pendentes [s]
+INTERVALO_FILA = 5
+
+# Prazo de permanência das tarefas concluídas ou com falha (e seus arquivos) [dias]
+PRAZO_TAREFAS = 7
+
+# Intervalo entre as remoções das tarefas antigas pelo worker [s]
+INTERVALO_LIMPEZA = 60 * 60
+
+# Tempo máximo de execução de uma tarefa [s]: após esse tempo, uma tarefa ainda
+# em execução é considerada interrompida (worker encerrado durante a exportação)
+DURACAO_MAXIMA_TAREFA = 2 * 60 * 60
+
+
+########## Funções ##########
+
+
+# Uma tarefa guarda o endpoint da view de listagem e a query string (busca,
+# filtros e ordenação) ativa quando foi criada. O worker reproduz o request da
+# listagem para obter, pela própria view, a mesma consulta da exportação direta,
+# com as mesmas colunas e formatos. As tarefas são retiradas da fila com
+# SELECT ... FOR UPDATE SKIP LOCKED, de modo que vários workers possam ser
+# executados em paralelo sem que dois peguem a mesma tarefa. Uma tarefa cujo
+# worker foi encerrado durante a exportação (deploy, falta de memória, ...) fica
+# em execução até passar DURACAO_MAXIMA_TAREFA, quando recebe o status "Falha".
+
+
+# Criação de uma tarefa de exportação para a view e o formato dados
+def criar_tarefa_exportacao(view, formato, parametros, id_usuario):
+    tarefa = TarefaExportacao(endpoint_view=view.endpoint,
+                              nome_view=view.name,
+                              formato=formato,
+                              parametros=parametros,
+                              id_usuario=id_usuario)
+
+    db.session.add(tarefa)
+    db.session.commit()
+
+    return tarefa
+
+
+# Mensagem de erro de uma exceção (em unicode, mesmo que a mensagem original
+# seja uma string de bytes com acentos)
+def mensagem_erro(ex):
+    try:
+        return unicode(ex)
+    except UnicodeDecodeError:
+        return str(ex).decode('utf-8', 'replace')
+
+
+# Tarefas em execução há mais do que a duração máxima (interrompidas): falha
+# Retorna o número de tarefas interrompidas
+def encerrar_tarefas_interrompidas(duracao=DURACAO_MAXIMA_TAREFA):
+    limite = datetime.now() - timedelta(seconds=duracao)
+
+    interrompidas = TarefaExportacao.query\
+        .filter(TarefaExportacao.status == 'Em Execução')\
+        .filter(TarefaExportacao.iniciada_em < limite)\
+        .update({'status': 'Falha',
+                 'erro': u'Exportação interrompida. Solicite a exportação novamente.',
+                 'concluida_em': datetime.now()},
+                synchronize_session=False)
+
+    db.session.commit()
+
+    return interrompidas
+
+
+# Retirada da próxima tarefa pendente da fila (None, caso não haja)
+# A tarefa é marcada como em execução numa transação própria
+def retirar_tarefa():
+    encerrar_tarefas_interrompidas()
+
+    tarefa = TarefaExportacao.query.filter_by(status='Pendente')\
+                                   .order_by(TarefaExportacao.criada_em)\
+                                   .with_for_update(skip_locked=True)\
+                                   .first()
+
+    if tarefa is None:
+        db.session.rollback()
+        return None
+
+    tarefa.status = 'Em Execução'
+    tarefa.iniciada_em = datetime.now()
+
+    db.session.commit()
+
+    return tarefa
+
+
+# Registro do progresso de uma tarefa (linhas exportadas e, opcionalmente, total)
+# Feito numa conexão própria, fora da transação da exportação (que mantém o
+# cursor da consulta aberto), para que fique visível imediatamente na listagem
+# de exportações
+def registrar_progresso(id_tarefa, linhas_exportadas, total_linhas=None):
+    tarefas = TarefaExportacao.__table__
+
+    valores = dict(linhas_exportadas=linhas_exportadas)
+
+    if total_linhas is not None:
+        valores['total_linhas'] = total_linhas
+
+    with db.engine.begin() as conexao:
+        conexao.execute(tarefas.update()
+                               .where(tarefas.c.id == id_tarefa)
+                               .values(**valores))
+
+
+# Linhas de uma exportação, registrando o progresso a cada lote
+def linhas_com_progresso(id_tarefa, linhas):
+    for numero, linha in enumerate(linhas, 1):
+        yield linha
+
+        if numero % LOTE_EXPORTACAO == 0:
+            registrar_progresso(id_tarefa, numero)
+
+
+# View de administração de um endpoint
+def view_exportacao(endpoint):
+    from ..administracao import admin
+
+    for view in admin._views:
+        if getattr(view, 'endpoint', None) == endpoint:
+            return view
+
+    raise ValueError('View de listagem não encontrada: %s' % endpoint)
+
+
+# Geração do arquivo de uma tarefa
+# Retorna (nome do arquivo, conteúdo compactado, total de linhas)
+def gerar_arquivo(tarefa):
+    view = view_exportacao(tarefa.endpoint_view)
+
+    # Request da listagem com os parâmetros da tarefa
+    with current_app.test_request_context('/?' + tarefa.parametros):
+        total, query = view._export_data()
+
+        registrar_progresso(tarefa.id, 0, total)
+
+        titulos = view.titulos_exportacao()
+        linhas = linhas_com_progresso(tarefa.id, view.linhas_exportacao(query))
+        nome = view.get_export_name(export_type=tarefa.formato)
+
+        if tarefa.formato == 'xlsx':
+            caminho = arquivo_xlsx(titulos, linhas)
+        else:
+            nome += '.gz'
+
+            descritor, caminho = tempfile.mkstemp(suffix='.csv.gz')
+            os.close(descritor)
+
+            try:
+                with gzip.open(caminho, 'wb') as arquivo:
+                    for linha in gerar_csv(titulos, linhas):
+                        arquivo.write(linha)
+            except:
+                os.remove(caminho)
+                raise
+
+    try:
+        with open(caminho, 'rb') as arquivo:
+            return nome, arquivo.read(), total
+    finally:
+        os.remove(caminho)
+
+
+# Execução de uma tarefa (já retirada da fila)
+def executar_tarefa(tarefa):
+    try:
+        nome, conteudo, total = gerar_arquivo(tarefa)
+
+        tarefa.nome_arquivo = nome
+        tarefa.arquivo = conteudo
+        tarefa.tamanho_arquivo = len(conteudo)
+        tarefa.linhas_exportadas = total
+        tarefa.total_linhas = total
+        tarefa.status = 'Concluída'
+        tarefa.concluida_em = datetime.now()
+
+        db.session.commit()
+
+    except Exception as ex:
+        db.session.rollback()
+
+        tarefa.status = 'Falha'
+        tarefa.erro = mensagem_erro(ex)
+        tarefa.concluida_em = datetime.now()
+
+        db.session.commit()
+
+
+# Remoção das tarefas concluídas ou com falha há mais do que o prazo dado [dias]
+def remover_tarefas_antigas(prazo=PRAZO_TAREFAS):
+    limite = datetime.now() - timedelta(days=prazo)
+
+    removidas = TarefaExportacao.query\
+        .filter(TarefaExportacao.status.in_(['Concluída', 'Falha']))\
+        .filter(TarefaExportacao.concluida_em < limite)\
+        .delete(synchronize_session=False)
+
+    db.session.commit()
+
+    return removidas
+
+
+# Execução contínua das tarefas da fila (ou apenas das pendentes, com "uma_vez")
+# As tarefas antigas são removidas ao iniciar e, depois, a cada INTERVALO_LIMPEZA
+# (quando a fila está vazia)
+# Retorna o número de tarefas executadas
+def executar_tarefas(uma_vez=False, intervalo=INTERVALO_FILA):
+    executadas = 0
+
+    remover_tarefas_antigas()
+    ultima_limpeza = time.time()
+
+    while True:
+        tarefa = retirar_tarefa()
+
+        if tarefa is not None:
+            executar_tarefa(tarefa)
+            executadas += 1
+        elif uma_vez:
+            return executadas
+        else:
+            if time.time() - ultima_limpeza >= INTERVALO_LIMPEZA:
+                remover_tarefas_antigas()
+                ultima_limpeza = time.time()
+
+            time.sleep(intervalo)
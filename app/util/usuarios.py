@@ -0,0 +1,191 @@
+# coding: utf-8
+
+################################################################################
+## SICEM - UFC
+################################################################################
+## Cache dos Usuários da Sessão e Suas Permissões
+################################################################################
+
+
+import threading, time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+
+from ..models import Usuario, Cargo, Permissao
+
+
+########## Configurações ##########
+
+
+# Número máximo de usuários em cache (por processo)
+TAMANHO_CACHE_USUARIOS = 1000
+
+# Tempo de validade de um usuário em cache [s]
+VALIDADE_CACHE_USUARIOS = 60
+
+
+########## Cache LRU com Validade ##########
+
+
+# Cache de tamanho limitado (os itens menos usados recentemente são descartados
+# primeiro), cujos itens expiram após o tempo de validade
+# Compartilhado entre as threads do processo
+class CacheLRU(object):
+    # Inicialização (tamanho máximo e tempo de validade dos itens [s])
+    def __init__(self, tamanho, validade):
+        self.tamanho = tamanho
+        self.validade = validade
+
+        # Chave -> (instante de expiração, valor), do menos ao mais recente
+        self.itens = OrderedDict()
+
+        self.trava = threading.Lock()
+
+    # Valor de uma chave (None, caso não esteja no cache ou tenha expirado)
+    def obter(self, chave):
+        with self.trava:
+            item = self.itens.pop(chave, None)
+
+            if item is None or item[0] <= time.time():
+                return None
+
+            # Reinserção no final (mais recente)
+            self.itens[chave] = item
+
+            return item[1]
+
+    # Inclusão ou substituição do valor de uma chave
+    def guardar(self, chave, valor):
+        with self.trava:
+            self.itens.pop(chave, None)
+            self.itens[chave] = (time.time() + self.validade, valor)
+
+            while len(self.itens) > self.tamanho:
+                self.itens.popitem(last=False)
+
+    # Remoção dos itens que satisfazem uma condição (função da chave e do valor)
+    def remover_se(self, condicao):
+        with self.trava:
+            for chave in [chave for chave, (expiracao, valor) in self.itens.items()
+                          if condicao(chave, valor)]:
+                del self.itens[chave]
+
+    # Remoção de todos os itens
+    def limpar(self):
+        with self.trava:
+            self.itens.clear()
+
+
+########## Usuário da Sessão ##########
+
+
+# O usuário autenticado de cada request (current_user) é uma cópia somente
+# leitura do usuário, com as permissões do seu cargo, guardada em cache pelo id.
+# A cada request, apenas a versão do usuário é consultada no banco de dados (pela
+# chave primária, sem o cargo): a cópia em cache é usada enquanto tiver a mesma
+# versão. Como a versão é incrementada a cada alteração do usuário e das
+# permissões do seu cargo (ver app/models.py), qualquer alteração, feita pelo
+# próprio usuário ou por um administrador, vale a partir do request seguinte em
+# todos os processos.
+
+
+# Cópia do usuário da sessão
+class UsuarioSessao(UserMixin):
+    # Inicialização a partir do modelo (com o cargo carregado)
+    def __init__(self, usuario):
+        self.id = usuario.id
+        self.versao = usuario.versao
+        self.nome = usuario.nome
+        self.email = usuario.email
+        self.verificado = usuario.verificado
+        self.confirmado = usuario.confirmado
+        self.id_cargo = usuario.id_cargo
+        self.id_unidade_responsavel = usuario.id_unidade_responsavel
+
+        # Permissões do cargo (None, caso o usuário não tenha cargo)
+        self.permissoes = usuario.cargo.permissoes if usuario.cargo is not None else None
+
+    # Modelo do usuário (consultado no banco de dados), para as operações que o
+    # alteram ou que usam dados fora da cópia (senha, tokens, ...)
+    @property
+    def modelo(self):
+        return Usuario.query.get(self.id)
+
+    # Testa se o usuário tem determinadas permissões (ver Usuario.autorizado)
+    def autorizado(self, permissoes):
+        return self.permissoes is not None and (self.permissoes & permissoes) == permissoes
+
+    # Testa se o usuário tem permissão para administrar
+    def pode_administrar(self):
+        return self.autorizado(Permissao.ADMINISTRAR)
+
+    # Testa se o usuário tem permissão para cadastrar
+    def pode_cadastrar(self):
+        return self.autorizado(Permissao.CADASTRAR)
+
+    # Testa se o usuário tem permissão para visualizar
+    def pode_visualizar(self):
+        return self.autorizado(Permissao.VISUALIZAR)
+
+    # Representação no shell
+    def __repr__(self):
+        return '<Usuário da Sessão: %s [versão %d]>' % (self.nome, self.versao)
+
+    # Representação na interface
+    def __str__(self):
+        return self.nome
+
+
+# Cache dos usuários da sessão do processo: id -> UsuarioSessao
+cache_usuarios = CacheLRU(TAMANHO_CACHE_USUARIOS, VALIDADE_CACHE_USUARIOS)
+
+
+# Versão atual de um usuário no banco de dados (None, caso não exista)
+def versao_usuario(id_usuario):
+    return Usuario.query.with_entities(Usuario.versao)\
+                        .filter(Usuario.id == id_usuario)\
+                        .scalar()
+
+
+# Usuário da sessão (None, caso não exista), obtido do cache caso a cópia tenha
+# a versão atual ou, senão, consultado no banco de dados (com o cargo)
+def carregar_usuario(id_usuario):
+    versao = versao_usuario(id_usuario)
+
+    if versao is None:
+        return None
+
+    usuario = cache_usuarios.obter(id_usuario)
+
+    if usuario is not None and usuario.versao == versao:
+        return usuario
+
+    modelo = Usuario.query.options(joinedload(Usuario.cargo)).get(id_usuario)
+
+    if modelo is None:
+        return None
+
+    usuario = UsuarioSessao(modelo)
+
+    cache_usuarios.guardar(usuario.id, usuario)
+
+    return usuario
+
+
+##### Eventos #####
+
+
+# Usuário alterado ou excluído: remover suas cópias do cache
+@event.listens_for(Usuario, 'after_update')
+@event.listens_for(Usuario, 'after_delete')
+def invalidar_usuario(mapper, conexao, usuario):
+    cache_usuarios.remover_se(lambda chave, copia: chave == usuario.id)
+
+
+# Cargo alterado ou excluído: remover do cache as cópias dos seus usuários
+@event.listens_for(Cargo, 'after_update')
+@event.listens_for(Cargo, 'after_delete')
+def invalidar_usuarios_cargo(mapper, conexao, cargo):
+    cache_usuarios.remover_se(lambda chave, copia: copia.id_cargo == cargo.id)
@@ -7,7 +7,7 @@
 ################################################################################
 
 
-import os
+import os, tempfile
 
 
 ########## Classes de Configuração ##########
@@ -44,6 +44,24 @@ class Config:
     MAPBOX_MAP_ID = 'mapbox.streets'
     MAPBOX_ACCESS_TOKEN = os.environ.get('MAPBOX_ACCESS_TOKEN')
 
+    # Hash das senhas (app/util/senhas.py): método no formato do Werkzeug
+    # ("pbkdf2:<algoritmo>:<iterações>") e tamanho do sal. Os hashes gerados com
+    # outros valores são atualizados no login do usuário. O hash completo deve
+    # caber na coluna "senha_hash" (128 caracteres)
+    SENHA_METODO = os.environ.get('SENHA_METODO') or 'pbkdf2:sha256:50000'
+    SENHA_TAMANHO_SAL = 16
+
+    # Processos dedicados ao cálculo dos hashes, por processo da aplicação (0:
+    # no próprio request), número máximo de cálculos simultâneos (além dele, o
+    # request recebe o erro 503) e espera máxima por um cálculo [s]
+    SENHA_PROCESSOS = int(os.environ.get('SENHA_PROCESSOS') or 0)
+    SENHA_SIMULTANEAS = int(os.environ.get('SENHA_SIMULTANEAS') or 4)
+    SENHA_ESPERA = 10
+
+    # Pasta das miniaturas das geometrias (SVG) exibidas nas listagens
+    MINIATURAS_DIR = os.environ.get('MINIATURAS_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'sicem_miniaturas')
+
     # Método executado quando a aplicação é criada (cls é a própria classe)
     @classmethod
     def init_app(cls, app):
@@ -63,6 +81,18 @@ class ConfigDesenvolvimento(Config):
 class ConfigTeste(Config):
     TESTING = True
 
+    # Hash de senhas de baixo custo
+    SENHA_METODO = 'pbkdf2:sha256:1000'
+
+    # Servidor de email local (python launcher.py servidor_smtp ou
+    # app/util/smtp_local.py), sem TLS nem autenticação
+    MAIL_SERVER = 'localhost'
+    MAIL_PORT = 1025
+    MAIL_USE_TLS = False
+    MAIL_USERNAME = None
+    MAIL_PASSWORD = None
+    MAIL_SENDER = 'sicem@localhost'
+
 
 # Configuração de Produção
 class ConfigProducao(Config):
@@ -64,6 +64,8 @@ manager.add_command('db', MigrateCommand)
 def deploy():
     from flask_migrate import upgrade
     from app.models import Cargo, Usuario
+    from app.util.agenda import gerar_agenda
+    from app.util.particoes import criar_particoes
 
     # Migrar banco de dados para última versão
     # A pasta "migrations" precisa existir e deve ter pelo menos uma
@@ -76,6 +78,283 @@ def deploy():
     # Criar administrador padrão, caso ainda não haja um
     Usuario.criar_administrador()
 
+    # Criar as partições anuais que faltam das manutenções e contas
+    criar_particoes()
+
+    # Gerar as manutenções agendadas dos equipamentos pendentes
+    gerar_agenda()
+
+
+# Comando de reconstrução dos campos de localização desnormalizados
+# (ids da hierarquia e caminho de localização de ambientes e equipamentos)
+
+@manager.command
+def reparar_locais():
+    from app.models import atualizar_locais
+
+    # Atualizações em lote de todos os ambientes e equipamentos
+    atualizar_locais(db.session.connection())
+
+    db.session.commit()
+
+
+# Comando de reconstrução da tabela de fechamento da hierarquia de locais
+
+@manager.command
+def reconstruir_hierarquia():
+    from app.models import reconstruir_hierarquia
+
+    reconstruir_hierarquia(db.session.connection())
+
+    db.session.commit()
+
+
+# Comando de recálculo em lote das próximas manutenções preventivas (seguido da
+# geração das manutenções agendadas dos equipamentos atualizados)
+# Ex.: python launcher.py recalcular_manutencoes -t Extintor -i 6
+
+@manager.option('-t', '--tipo', dest='tipo', default=None,
+                help='Tipo de equipamento (ex.: Extintor, Condicionador de Ar)')
+@manager.option('-i', '--intervalo', dest='intervalo', type=int, default=None,
+                help='Novo intervalo de manutenção (meses)')
+def recalcular_manutencoes(tipo, intervalo):
+    from app.util.manutencoes import recalcular_proximas_manutencoes
+    from app.util.agenda import atualizar_agenda
+
+    atualizados = recalcular_proximas_manutencoes(tipo, intervalo)
+
+    db.session.commit()
+
+    atualizar_agenda()
+
+    print '%d equipamento(s) atualizado(s).' % atualizados
+
+
+# Comando de aviso das manutenções preventivas vencidas (um email de resumo por
+# responsável). Deve ser agendado para execução diária (cron, Heroku Scheduler, ...)
+# Ex.: python launcher.py avisar_manutencoes -a 7
+
+@manager.option('-a', '--antecedencia', dest='antecedencia', type=int, default=0,
+                help='Incluir manutenções que vencem nos próximos dias')
+def avisar_manutencoes(antecedencia):
+    from app.util.manutencoes import avisar_manutencoes_vencidas
+
+    enviados = avisar_manutencoes_vencidas(antecedencia)
+
+    print '%d email(s) enviado(s).' % enviados
+
+
+# Comando de atualização dos indicadores de confiabilidade dos equipamentos
+# (apenas os desatualizados, ou todos com a opção -t). Com -c, atualiza
+# continuamente os desatualizados (processo "indicadores" do Procfile)
+# Ex.: python launcher.py atualizar_indicadores -c -i 60
+
+@manager.option('-t', '--todos', dest='todos', action='store_true', default=False,
+                help='Recalcular os indicadores de todos os equipamentos')
+@manager.option('-c', '--continuo', dest='continuo', action='store_true', default=False,
+                help='Atualizar continuamente os indicadores desatualizados')
+@manager.option('-i', '--intervalo', dest='intervalo', type=int, default=60,
+                help='Intervalo entre as atualizações contínuas (segundos)')
+def atualizar_indicadores(todos=False, continuo=False, intervalo=60):
+    from app.util.confiabilidade import atualizar_indicadores, \
+                                        atualizar_indicadores_continuamente
+
+    if continuo:
+        atualizar_indicadores_continuamente(intervalo)
+
+    atualizados = atualizar_indicadores(todos)
+
+    db.session.commit()
+
+    print '%d equipamento(s) atualizado(s).' % atualizados
+
+
+# Comando de comparação dos planos de execução das consultas frequentes, com e
+# sem índices (desativados apenas no planejador; nenhuma alteração é feita no
+# banco e a aplicação não é bloqueada)
+
+@manager.command
+def comparar_indices():
+    from app.util.indices import comparar_indices
+
+    for descricao, usados, com_indices, sem_indices in comparar_indices():
+        print '=' * 80
+        print descricao
+        print '=' * 80
+        print 'Índices usados: %s' % (', '.join(usados) or 'nenhum')
+        print '--- Com índices ---'
+        print '\n'.join(com_indices)
+        print '--- Sem índices ---'
+        print '\n'.join(sem_indices)
+        print
+
+
+# Comando de geração da agenda de manutenções preventivas (manutenções com status
+# "Agendada" para os próximos meses). Apenas os equipamentos com a agenda
+# desatualizada são processados. Deve ser agendado para execução periódica
+# (cron, Heroku Scheduler, ...)
+# Ex.: python launcher.py gerar_agenda -j 12
+
+@manager.option('-j', '--janela', dest='janela', type=int, default=12,
+                help='Janela de agendamento (meses)')
+@manager.option('-l', '--lote', dest='lote', type=int, default=500,
+                help='Número de equipamentos processados por transação')
+def gerar_agenda(janela=12, lote=500):
+    from app.util.agenda import gerar_agenda
+
+    equipamentos, agendadas = gerar_agenda(janela, lote)
+
+    print '%d equipamento(s) processado(s), %d manutenção(ões) agendada(s).' % \
+        (equipamentos, agendadas)
+
+
+# Comando de arquivamento dos equipamentos retirados (fora de uso) e das
+# manutenções concluídas antigas, movidos para as tabelas de arquivo em lotes.
+# Deve ser agendado para execução periódica (cron, Heroku Scheduler, ...)
+# Ex.: python launcher.py arquivar -e 365 -m 730
+
+@manager.option('-e', '--equipamentos', dest='prazo_equipamentos', type=int, default=365,
+                help='Dias sem manutenções de um equipamento fora de uso')
+@manager.option('-m', '--manutencoes', dest='prazo_manutencoes', type=int, default=730,
+                help='Dias desde a conclusão de uma manutenção')
+@manager.option('-l', '--lote', dest='lote', type=int, default=1000,
+                help='Número de linhas movidas por transação')
+def arquivar(prazo_equipamentos=365, prazo_manutencoes=730, lote=1000):
+    from app.util.arquivo import arquivar
+
+    equipamentos, manutencoes = arquivar(prazo_equipamentos, prazo_manutencoes, lote)
+
+    print '%d equipamento(s) e %d manutenção(ões) arquivado(s).' % \
+        (equipamentos, manutencoes)
+
+
+# Comando de criação das partições anuais das tabelas de manutenções e contas,
+# do ano atual até os próximos anos. Deve ser agendado para execução periódica
+# (cron, Heroku Scheduler, ...), pelo menos uma vez por ano
+# Ex.: python launcher.py criar_particoes -a 2
+
+@manager.option('-a', '--anos', dest='anos', type=int, default=2,
+                help='Número de anos seguintes ao atual')
+def criar_particoes(anos=2):
+    from app.util.particoes import criar_particoes
+
+    criadas = criar_particoes(anos)
+
+    for particao in criadas:
+        print 'Partição criada: %s' % particao
+
+    print '%d partição(ões) criada(s).' % len(criadas)
+
+
+# Comando de desanexação da partição de um ano antigo (a partição continua no
+# banco como uma tabela independente, fora das consultas da aplicação)
+# Ex.: python launcher.py desanexar_particao -t contas -a 2010
+
+@manager.option('-t', '--tabela', dest='tabela', required=True,
+                help='Tabela particionada (manutencoes ou contas)')
+@manager.option('-a', '--ano', dest='ano', type=int, required=True,
+                help='Ano da partição')
+def desanexar_particao(tabela, ano):
+    from app.util.particoes import desanexar_particao
+
+    particao = desanexar_particao(tabela, ano)
+
+    print 'Partição desanexada: %s' % particao
+
+
+# Comando de importação de equipamentos em lote a partir de um arquivo CSV
+# (mesmo formato da importação pelo painel de administração)
+# Ex.: python launcher.py importar_equipamentos -t extintor -a extintores.csv
+
+@manager.option('-t', '--tipo', dest='tipo', required=True,
+                help='Tipo de equipamento (endpoint, ex.: extintor, condicionadordear)')
+@manager.option('-a', '--arquivo', dest='arquivo', required=True,
+                help='Caminho do arquivo CSV')
+@manager.option('-p', '--parcial', dest='parcial', action='store_true', default=False,
+                help='Importar as linhas válidas mesmo que haja erros')
+def importar_equipamentos(tipo, arquivo, parcial=False):
+    from app.util.importacao import importar_equipamentos
+
+    with open(arquivo, 'rb') as csv:
+        importados, erros = importar_equipamentos(tipo, csv, parcial)
+
+    db.session.commit()
+
+    for linha, erro in erros:
+        print 'Linha %d: %s' % (linha, erro)
+
+    print '%d equipamento(s) importado(s), %d erro(s).' % (importados, len(erros))
+
+
+# Comando de envio dos emails da caixa de saída (worker)
+# Sem opções, aguarda continuamente novas mensagens (processo "emails" do
+# Procfile); com -u, envia apenas as mensagens pendentes e termina
+# Ex.: python launcher.py enviar_emails -i 10
+
+@manager.option('-u', '--uma-vez', dest='uma_vez', action='store_true', default=False,
+                help='Enviar apenas as mensagens pendentes e terminar')
+@manager.option('-i', '--intervalo', dest='intervalo', type=int, default=5,
+                help='Intervalo entre as verificações da caixa de saída vazia (segundos)')
+@manager.option('-l', '--lote', dest='lote', type=int, default=50,
+                help='Número de mensagens enviadas por transação')
+def enviar_emails(uma_vez=False, intervalo=5, lote=50):
+    from app.util.caixa_saida import enviar_emails
+
+    enviadas, falhas = enviar_emails(uma_vez, intervalo, lote)
+
+    print '%d email(s) enviado(s), %d falha(s).' % (enviadas, falhas)
+
+
+# Comando de exibição das métricas da caixa de saída de emails
+
+@manager.command
+def caixa_saida():
+    from app.util.caixa_saida import metricas_caixa_saida
+
+    for descricao, valor in metricas_caixa_saida().items():
+        print '%s: %d' % (descricao, valor)
+
+
+# Comando de execução de um servidor de email local, que apenas exibe as
+# mensagens recebidas (desenvolvimento e testes; ver ConfigTeste em config.py)
+# Ex.: python launcher.py servidor_smtp -p 1025
+
+@manager.option('-p', '--porta', dest='porta', type=int, default=1025,
+                help='Porta do servidor')
+def servidor_smtp(porta=1025):
+    from app.util.smtp_local import ServidorSMTPLocal
+
+    def exibir(remetente, destinatarios, mensagem):
+        print '=' * 80
+        print 'De: %s' % remetente
+        print 'Para: %s' % ', '.join(destinatarios)
+        print 'Assunto: %s' % mensagem['Subject']
+        print '=' * 80
+
+    print 'Servidor de email local em localhost:%d (Ctrl+C para encerrar).' % porta
+
+    try:
+        ServidorSMTPLocal(porta=porta, ao_receber=exibir).executar()
+    except KeyboardInterrupt:
+        pass
+
+
+# Comando de execução das tarefas de exportação em segundo plano (worker)
+# Sem opções, aguarda continuamente novas tarefas na fila (processo "worker" do
+# Procfile); com -u, executa apenas as tarefas pendentes e termina
+# Ex.: python launcher.py executar_tarefas -i 10
+
+@manager.option('-u', '--uma-vez', dest='uma_vez', action='store_true', default=False,
+                help='Executar apenas as tarefas pendentes e terminar')
+@manager.option('-i', '--intervalo', dest='intervalo', type=int, default=5,
+                help='Intervalo entre as verificações da fila vazia (segundos)')
+def executar_tarefas(uma_vez=False, intervalo=5):
+    from app.util.tarefas import executar_tarefas
+
+    executadas = executar_tarefas(uma_vez, intervalo)
+
+    print '%d tarefa(s) executada(s).' % executadas
+
 
 ########## Execução da Aplicação ##########
 
@@ -0,0 +1,100 @@
+# coding: utf-8
+"""Localização desnormalizada em ambientes e equipamentos
+
+Revision ID: 3a7c52d1e9b4
+Revises: fd89e72cc232
+Create Date: 2017-06-12 10:24:31.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a7c52d1e9b4'
+down_revision = 'fd89e72cc232'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Ambientes: departamento, centro e campus + caminho de localização
+    op.add_column('ambientes', sa.Column('id_departamento', sa.Integer(), nullable=True))
+    op.add_column('ambientes', sa.Column('id_centro', sa.Integer(), nullable=True))
+    op.add_column('ambientes', sa.Column('id_campus', sa.Integer(), nullable=True))
+    op.add_column('ambientes', sa.Column('caminho_local', sa.Text(), nullable=True))
+    op.create_foreign_key('ambientes_id_departamento_fkey', 'ambientes', 'departamentos', ['id_departamento'], ['id'])
+    op.create_foreign_key('ambientes_id_centro_fkey', 'ambientes', 'centros', ['id_centro'], ['id'])
+    op.create_foreign_key('ambientes_id_campus_fkey', 'ambientes', 'campi', ['id_campus'], ['id'])
+    op.create_index(op.f('ix_ambientes_id_departamento'), 'ambientes', ['id_departamento'], unique=False)
+    op.create_index(op.f('ix_ambientes_id_centro'), 'ambientes', ['id_centro'], unique=False)
+    op.create_index(op.f('ix_ambientes_id_campus'), 'ambientes', ['id_campus'], unique=False)
+
+    # Equipamentos: bloco, departamento, centro e campus + caminho de localização
+    op.add_column('equipamentos', sa.Column('id_bloco', sa.Integer(), nullable=True))
+    op.add_column('equipamentos', sa.Column('id_departamento', sa.Integer(), nullable=True))
+    op.add_column('equipamentos', sa.Column('id_centro', sa.Integer(), nullable=True))
+    op.add_column('equipamentos', sa.Column('id_campus', sa.Integer(), nullable=True))
+    op.add_column('equipamentos', sa.Column('caminho_local', sa.Text(), nullable=True))
+    op.create_foreign_key('equipamentos_id_bloco_fkey', 'equipamentos', 'blocos', ['id_bloco'], ['id'])
+    op.create_foreign_key('equipamentos_id_departamento_fkey', 'equipamentos', 'departamentos', ['id_departamento'], ['id'])
+    op.create_foreign_key('equipamentos_id_centro_fkey', 'equipamentos', 'centros', ['id_centro'], ['id'])
+    op.create_foreign_key('equipamentos_id_campus_fkey', 'equipamentos', 'campi', ['id_campus'], ['id'])
+    op.create_index(op.f('ix_equipamentos_id_bloco'), 'equipamentos', ['id_bloco'], unique=False)
+    op.create_index(op.f('ix_equipamentos_id_departamento'), 'equipamentos', ['id_departamento'], unique=False)
+    op.create_index(op.f('ix_equipamentos_id_centro'), 'equipamentos', ['id_centro'], unique=False)
+    op.create_index(op.f('ix_equipamentos_id_campus'), 'equipamentos', ['id_campus'], unique=False)
+
+    # Preenchimento dos novos campos a partir da hierarquia existente
+    # (mesmas atualizações em lote de app.models.atualizar_locais)
+    op.execute("""
+        UPDATE ambientes
+        SET id_departamento = departamentos.id,
+            id_centro = centros.id,
+            id_campus = campi.id,
+            caminho_local = blocos.nome || ' - ' || departamentos.nome || ' - ' ||
+                            centros.nome || ' - ' || campi.nome
+        FROM blocos, departamentos, centros, campi
+        WHERE ambientes.id_bloco = blocos.id
+          AND blocos.id_departamento = departamentos.id
+          AND departamentos.id_centro = centros.id
+          AND centros.id_campus = campi.id
+    """)
+
+    op.execute("""
+        UPDATE equipamentos
+        SET id_bloco = ambientes.id_bloco,
+            id_departamento = ambientes.id_departamento,
+            id_centro = ambientes.id_centro,
+            id_campus = ambientes.id_campus,
+            caminho_local = ambientes.nome || ' - ' || ambientes.caminho_local
+        FROM ambientes
+        WHERE equipamentos.id_ambiente = ambientes.id
+    """)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_equipamentos_id_campus'), table_name='equipamentos')
+    op.drop_index(op.f('ix_equipamentos_id_centro'), table_name='equipamentos')
+    op.drop_index(op.f('ix_equipamentos_id_departamento'), table_name='equipamentos')
+    op.drop_index(op.f('ix_equipamentos_id_bloco'), table_name='equipamentos')
+    op.drop_constraint('equipamentos_id_campus_fkey', 'equipamentos', type_='foreignkey')
+    op.drop_constraint('equipamentos_id_centro_fkey', 'equipamentos', type_='foreignkey')
+    op.drop_constraint('equipamentos_id_departamento_fkey', 'equipamentos', type_='foreignkey')
+    op.drop_constraint('equipamentos_id_bloco_fkey', 'equipamentos', type_='foreignkey')
+    op.drop_column('equipamentos', 'caminho_local')
+    op.drop_column('equipamentos', 'id_campus')
+    op.drop_column('equipamentos', 'id_centro')
+    op.drop_column('equipamentos', 'id_departamento')
+    op.drop_column('equipamentos', 'id_bloco')
+
+    op.drop_index(op.f('ix_ambientes_id_campus'), table_name='ambientes')
+    op.drop_index(op.f('ix_ambientes_id_centro'), table_name='ambientes')
+    op.drop_index(op.f('ix_ambientes_id_departamento'), table_name='ambientes')
+    op.drop_constraint('ambientes_id_campus_fkey', 'ambientes', type_='foreignkey')
+    op.drop_constraint('ambientes_id_centro_fkey', 'ambientes', type_='foreignkey')
+    op.drop_constraint('ambientes_id_departamento_fkey', 'ambientes', type_='foreignkey')
+    op.drop_column('ambientes', 'caminho_local')
+    op.drop_column('ambientes', 'id_campus')
+    op.drop_column('ambientes', 'id_centro')
+    op.drop_column('ambientes', 'id_departamento')
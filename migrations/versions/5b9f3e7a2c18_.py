@@ -0,0 +1,29 @@
+# coding: utf-8
+"""Unidade responsável pelos blocos
+
+Revision ID: 5b9f3e7a2c18
+Revises: 8e41b0c6d2fa
+Create Date: 2017-06-26 09:41:12.604381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9f3e7a2c18'
+down_revision = '8e41b0c6d2fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('blocos', sa.Column('id_unidade_responsavel', sa.Integer(), nullable=True))
+    op.create_foreign_key('blocos_id_unidade_responsavel_fkey', 'blocos', 'unidadesresponsaveis', ['id_unidade_responsavel'], ['id'])
+    op.create_index(op.f('ix_blocos_id_unidade_responsavel'), 'blocos', ['id_unidade_responsavel'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blocos_id_unidade_responsavel'), table_name='blocos')
+    op.drop_constraint('blocos_id_unidade_responsavel_fkey', 'blocos', type_='foreignkey')
+    op.drop_column('blocos', 'id_unidade_responsavel')
@@ -0,0 +1,64 @@
+# coding: utf-8
+"""Tabela de fechamento da hierarquia de locais
+
+Revision ID: 8e41b0c6d2fa
+Revises: 3a7c52d1e9b4
+Create Date: 2017-06-19 15:02:47.930114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41b0c6d2fa'
+down_revision = '3a7c52d1e9b4'
+branch_labels = None
+depends_on = None
+
+
+# Níveis da hierarquia: (tabela, coluna do local superior, tabela superior)
+NIVEIS = [('instituicoes', None, None),
+          ('campi', 'id_instituicao', 'instituicoes'),
+          ('centros', 'id_campus', 'campi'),
+          ('departamentos', 'id_centro', 'centros'),
+          ('blocos', 'id_departamento', 'departamentos'),
+          ('ambientes', 'id_bloco', 'blocos')]
+
+
+def upgrade():
+    op.create_table('hierarquia_locais',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo_ancestral', sa.String(length=32), nullable=False),
+    sa.Column('id_ancestral', sa.Integer(), nullable=False),
+    sa.Column('tipo_descendente', sa.String(length=32), nullable=False),
+    sa.Column('id_descendente', sa.Integer(), nullable=False),
+    sa.Column('profundidade', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_hierarquia_locais_ancestral', 'hierarquia_locais', ['tipo_ancestral', 'id_ancestral', 'tipo_descendente'], unique=False)
+    op.create_index('ix_hierarquia_locais_descendente', 'hierarquia_locais', ['tipo_descendente', 'id_descendente'], unique=False)
+
+    # Preenchimento a partir da hierarquia existente, nível por nível
+    # (mesmo procedimento de app.models.reconstruir_hierarquia)
+    for tabela, coluna_superior, tabela_superior in NIVEIS:
+        op.execute("""
+            INSERT INTO hierarquia_locais (tipo_ancestral, id_ancestral,
+                                           tipo_descendente, id_descendente, profundidade)
+            SELECT '{0}', id, '{0}', id, 0 FROM {0}
+        """.format(tabela))
+
+        if coluna_superior is not None:
+            op.execute("""
+                INSERT INTO hierarquia_locais (tipo_ancestral, id_ancestral,
+                                               tipo_descendente, id_descendente, profundidade)
+                SELECT h.tipo_ancestral, h.id_ancestral, '{0}', t.id, h.profundidade + 1
+                FROM hierarquia_locais h JOIN {0} t
+                  ON h.tipo_descendente = '{2}' AND h.id_descendente = t.{1}
+            """.format(tabela, coluna_superior, tabela_superior))
+
+
+def downgrade():
+    op.drop_index('ix_hierarquia_locais_descendente', table_name='hierarquia_locais')
+    op.drop_index('ix_hierarquia_locais_ancestral', table_name='hierarquia_locais')
+    op.drop_table('hierarquia_locais')
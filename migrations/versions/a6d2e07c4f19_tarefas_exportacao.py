@@ -0,0 +1,49 @@
+# coding: utf-8
+"""Tarefas de exportação em segundo plano
+
+Revision ID: a6d2e07c4f19
+Revises: f3c8d91b5a27
+Create Date: 2017-07-31 15:40:12.804561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2e07c4f19'
+down_revision = 'f3c8d91b5a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tarefas_exportacao',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('id_usuario', sa.Integer(), nullable=True),
+    sa.Column('endpoint_view', sa.String(length=64), nullable=False),
+    sa.Column('nome_view', sa.String(length=64), nullable=False),
+    sa.Column('formato', sa.String(length=8), nullable=False),
+    sa.Column('parametros', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('linhas_exportadas', sa.Integer(), nullable=False),
+    sa.Column('total_linhas', sa.Integer(), nullable=True),
+    sa.Column('criada_em', sa.DateTime(), nullable=False),
+    sa.Column('iniciada_em', sa.DateTime(), nullable=True),
+    sa.Column('concluida_em', sa.DateTime(), nullable=True),
+    sa.Column('erro', sa.Text(), nullable=True),
+    sa.Column('nome_arquivo', sa.String(length=128), nullable=True),
+    sa.Column('tamanho_arquivo', sa.Integer(), nullable=True),
+    sa.Column('arquivo', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['id_usuario'], ['usuarios.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tarefas_exportacao_id_usuario'), 'tarefas_exportacao', ['id_usuario'], unique=False)
+    op.create_index('ix_tarefas_exportacao_pendentes', 'tarefas_exportacao', ['criada_em'], unique=False,
+                    postgresql_where=sa.text("status = 'Pendente'"))
+
+
+def downgrade():
+    op.drop_index('ix_tarefas_exportacao_pendentes', table_name='tarefas_exportacao')
+    op.drop_index(op.f('ix_tarefas_exportacao_id_usuario'), table_name='tarefas_exportacao')
+    op.drop_table('tarefas_exportacao')
@@ -0,0 +1,38 @@
+# coding: utf-8
+"""Datas dos indicadores de confiabilidade (tempos calculados na consulta)
+
+Revision ID: a7d4e9c2f6b8
+Revises: f1a9c3e7b5d2
+Create Date: 2017-08-29 10:12:38.604127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d4e9c2f6b8'
+down_revision = 'f1a9c3e7b5d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('indicadores_confiabilidade', sa.Column('data_inicio', sa.Date(), nullable=True))
+    op.add_column('indicadores_confiabilidade', sa.Column('inicio_manutencao_aberta', sa.Date(), nullable=True))
+    op.drop_column('indicadores_confiabilidade', 'dias_vida')
+    op.drop_column('indicadores_confiabilidade', 'mtbf')
+    op.drop_column('indicadores_confiabilidade', 'taxa_falhas')
+
+    # Os dias parado gravados incluíam a manutenção em andamento até a data do
+    # cálculo: todos os indicadores precisam ser recalculados
+    op.execute('UPDATE indicadores_confiabilidade SET desatualizado = true')
+
+
+def downgrade():
+    op.add_column('indicadores_confiabilidade', sa.Column('taxa_falhas', sa.Float(), nullable=True))
+    op.add_column('indicadores_confiabilidade', sa.Column('mtbf', sa.Float(), nullable=True))
+    op.add_column('indicadores_confiabilidade', sa.Column('dias_vida', sa.Integer(), nullable=False, server_default='0'))
+    op.drop_column('indicadores_confiabilidade', 'inicio_manutencao_aberta')
+    op.drop_column('indicadores_confiabilidade', 'data_inicio')
+    op.execute('UPDATE indicadores_confiabilidade SET desatualizado = true')
@@ -0,0 +1,42 @@
+# coding: utf-8
+"""Registro de auditoria do painel de administração
+
+Revision ID: b7e5f1c2a9d4
+Revises: a6d2e07c4f19
+Create Date: 2017-08-02 10:12:37.215844
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e5f1c2a9d4'
+down_revision = 'a6d2e07c4f19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('registros_auditoria',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('data_hora', sa.DateTime(), nullable=False),
+    sa.Column('id_usuario', sa.Integer(), nullable=True),
+    sa.Column('email_usuario', sa.String(length=64), nullable=True),
+    sa.Column('modelo', sa.String(length=64), nullable=False),
+    sa.Column('id_registro', sa.Integer(), nullable=False),
+    sa.Column('operacao', sa.String(length=16), nullable=False),
+    sa.Column('alteracoes', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['id_usuario'], ['usuarios.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_registros_auditoria_data_hora'), 'registros_auditoria', ['data_hora'], unique=False)
+    op.create_index(op.f('ix_registros_auditoria_id_usuario'), 'registros_auditoria', ['id_usuario'], unique=False)
+    op.create_index('ix_registros_auditoria_registro', 'registros_auditoria', ['modelo', 'id_registro', 'data_hora'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_registros_auditoria_registro', table_name='registros_auditoria')
+    op.drop_index(op.f('ix_registros_auditoria_id_usuario'), table_name='registros_auditoria')
+    op.drop_index(op.f('ix_registros_auditoria_data_hora'), table_name='registros_auditoria')
+    op.drop_table('registros_auditoria')
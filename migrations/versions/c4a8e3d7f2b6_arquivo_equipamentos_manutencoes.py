@@ -0,0 +1,106 @@
+# coding: utf-8
+"""Arquivo de equipamentos retirados e manutenções antigas
+
+Revision ID: c4a8e3d7f2b6
+Revises: b7e5f1c2a9d4
+Create Date: 2017-08-04 09:27:51.640318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e3d7f2b6'
+down_revision = 'b7e5f1c2a9d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('manutencoes_arquivo',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('num_ordem_servico', sa.Integer(), nullable=False),
+    sa.Column('id_equipamento', sa.Integer(), nullable=True),
+    sa.Column('data_abertura', sa.Date(), nullable=False),
+    sa.Column('data_conclusao', sa.Date(), nullable=True),
+    sa.Column('tipo_manutencao', sa.String(length=64), nullable=True),
+    sa.Column('descricao_servico', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(length=64), nullable=True),
+    sa.Column('arquivado_em', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('extintores_arquivo',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('classificacao', sa.String(length=64), nullable=True),
+    sa.Column('carga_nominal', sa.Float(), nullable=True),
+    sa.Column('arquivado_em', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('condicionadores_ar_arquivo',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('classificacao', sa.String(length=64), nullable=True),
+    sa.Column('pot_nominal', sa.Integer(), nullable=True),
+    sa.Column('cap_refrigeracao', sa.Integer(), nullable=True),
+    sa.Column('tensao_alimentacao', sa.Integer(), nullable=True),
+    sa.Column('eficiencia', sa.String(length=1), nullable=True),
+    sa.Column('arquivado_em', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('equipamentos_arquivo',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('tombamento', sa.Integer(), nullable=True),
+    sa.Column('id_ambiente', sa.Integer(), nullable=True),
+    sa.Column('id_bloco', sa.Integer(), nullable=True),
+    sa.Column('id_departamento', sa.Integer(), nullable=True),
+    sa.Column('id_centro', sa.Integer(), nullable=True),
+    sa.Column('id_campus', sa.Integer(), nullable=True),
+    sa.Column('caminho_local', sa.Text(), nullable=True),
+    sa.Column('categoria_equipamento', sa.String(length=64), nullable=True),
+    sa.Column('tipo_equipamento', sa.String(length=64), nullable=True),
+    sa.Column('fabricante', sa.String(length=64), nullable=True),
+    sa.Column('intervalo_manutencao', sa.Integer(), nullable=True),
+    sa.Column('proxima_manutencao', sa.Date(), nullable=True),
+    sa.Column('info_adicional', sa.Text(), nullable=True),
+    sa.Column('em_uso', sa.Boolean(), nullable=True),
+    sa.Column('em_manutencao', sa.Boolean(), nullable=True),
+    sa.Column('inicio_manutencao', sa.Date(), nullable=True),
+    sa.Column('agenda_desatualizada', sa.Boolean(), nullable=True),
+    sa.Column('agenda_ate', sa.Date(), nullable=True),
+    sa.Column('arquivado_em', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_manutencoes_arquivo_equipamento_abertura', 'manutencoes_arquivo', ['id_equipamento', 'data_abertura'], unique=False)
+
+    # Visões do histórico completo (tabelas principais e de arquivo)
+    op.execute("""
+        CREATE VIEW historico_equipamentos AS
+            SELECT id, tombamento, tipo_equipamento, categoria_equipamento, fabricante,
+                   caminho_local, em_uso, false AS arquivado
+            FROM equipamentos
+            UNION ALL
+            SELECT id, tombamento, tipo_equipamento, categoria_equipamento, fabricante,
+                   caminho_local, em_uso, true AS arquivado
+            FROM equipamentos_arquivo
+    """)
+
+    op.execute("""
+        CREATE VIEW historico_manutencoes AS
+            SELECT id, num_ordem_servico, id_equipamento, data_abertura, data_conclusao,
+                   tipo_manutencao, descricao_servico, status, false AS arquivada
+            FROM manutencoes
+            UNION ALL
+            SELECT id, num_ordem_servico, id_equipamento, data_abertura, data_conclusao,
+                   tipo_manutencao, descricao_servico, status, true AS arquivada
+            FROM manutencoes_arquivo
+    """)
+
+
+def downgrade():
+    op.execute('DROP VIEW historico_manutencoes')
+    op.execute('DROP VIEW historico_equipamentos')
+    op.drop_index('ix_manutencoes_arquivo_equipamento_abertura', table_name='manutencoes_arquivo')
+    op.drop_table('equipamentos_arquivo')
+    op.drop_table('condicionadores_ar_arquivo')
+    op.drop_table('extintores_arquivo')
+    op.drop_table('manutencoes_arquivo')
@@ -0,0 +1,46 @@
+# coding: utf-8
+"""Indicadores de confiabilidade dos equipamentos
+
+Revision ID: c4e8a1f93b27
+Revises: 5b9f3e7a2c18
+Create Date: 2017-07-03 14:18:55.372019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f93b27'
+down_revision = '5b9f3e7a2c18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('indicadores_confiabilidade',
+    sa.Column('id_equipamento', sa.Integer(), nullable=False),
+    sa.Column('num_manutencoes', sa.Integer(), nullable=False),
+    sa.Column('num_preventivas', sa.Integer(), nullable=False),
+    sa.Column('num_corretivas', sa.Integer(), nullable=False),
+    sa.Column('num_trocas', sa.Integer(), nullable=False),
+    sa.Column('num_falhas', sa.Integer(), nullable=False),
+    sa.Column('num_reparos', sa.Integer(), nullable=False),
+    sa.Column('dias_vida', sa.Integer(), nullable=False),
+    sa.Column('dias_parado', sa.Integer(), nullable=False),
+    sa.Column('dias_reparo', sa.Integer(), nullable=False),
+    sa.Column('mtbf', sa.Float(), nullable=True),
+    sa.Column('mttr', sa.Float(), nullable=True),
+    sa.Column('taxa_falhas', sa.Float(), nullable=True),
+    sa.Column('razao_corretiva_preventiva', sa.Float(), nullable=True),
+    sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+    sa.Column('desatualizado', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['id_equipamento'], ['equipamentos.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id_equipamento')
+    )
+    op.create_index(op.f('ix_indicadores_confiabilidade_desatualizado'), 'indicadores_confiabilidade', ['desatualizado'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_indicadores_confiabilidade_desatualizado'), table_name='indicadores_confiabilidade')
+    op.drop_table('indicadores_confiabilidade')
@@ -0,0 +1,40 @@
+# coding: utf-8
+"""Índices parciais e compostos das listagens e cálculos de manutenção
+
+Revision ID: d7a35c0e8f61
+Revises: c4e8a1f93b27
+Create Date: 2017-07-10 11:05:23.118470
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a35c0e8f61'
+down_revision = 'c4e8a1f93b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_equipamentos_agendados', 'equipamentos', ['proxima_manutencao'], unique=False,
+                    postgresql_where=sa.text('em_uso = true AND em_manutencao = false'))
+    # Falha caso já existam tombamentos repetidos (diferentes de 0)
+    op.create_index('ix_equipamentos_tombamento', 'equipamentos', ['tombamento'], unique=True,
+                    postgresql_where=sa.text('tombamento <> 0'))
+    op.create_index('ix_manutencoes_concluidas', 'manutencoes', ['id_equipamento', 'data_conclusao'], unique=False,
+                    postgresql_where=sa.text(u"status = 'Concluída'"))
+    op.create_index('ix_manutencoes_abertas', 'manutencoes', ['data_abertura'], unique=False,
+                    postgresql_where=sa.text("status = 'Aberta'"))
+    op.create_index('ix_manutencoes_equipamento_abertura', 'manutencoes', ['id_equipamento', 'data_abertura'], unique=False)
+    op.create_index('ix_contas_unidade_leitura', 'contas', ['id_unidade_consumidora', 'data_leitura'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_contas_unidade_leitura', table_name='contas')
+    op.drop_index('ix_manutencoes_equipamento_abertura', table_name='manutencoes')
+    op.drop_index('ix_manutencoes_abertas', table_name='manutencoes')
+    op.drop_index('ix_manutencoes_concluidas', table_name='manutencoes')
+    op.drop_index('ix_equipamentos_tombamento', table_name='equipamentos')
+    op.drop_index('ix_equipamentos_agendados', table_name='equipamentos')
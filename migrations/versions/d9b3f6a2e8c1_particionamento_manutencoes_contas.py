@@ -0,0 +1,138 @@
+# coding: utf-8
+"""Particionamento por ano de manutenções e contas
+
+Revision ID: d9b3f6a2e8c1
+Revises: c4a8e3d7f2b6
+Create Date: 2017-08-11 10:14:32.518207
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b3f6a2e8c1'
+down_revision = 'c4a8e3d7f2b6'
+branch_labels = None
+depends_on = None
+
+
+# Requer PostgreSQL 11 ou superior (chave primária e índices em tabelas
+# particionadas, partição padrão e mudança de partição nas atualizações)
+
+# Anos seguintes ao atual com partições criadas pela migração (os demais são
+# criados pelo comando "python launcher.py criar_particoes")
+ANOS_FUTUROS = 2
+
+# Tabelas particionadas: coluna de data, chave estrangeira e índices
+# (nome, colunas, condição do índice parcial)
+TABELAS = [
+    ('manutencoes', 'data_abertura',
+     ('manutencoes_id_equipamento_fkey', 'id_equipamento', 'equipamentos'),
+     [('ix_manutencoes_data_abertura', ['data_abertura'], None),
+      ('ix_manutencoes_data_conclusao', ['data_conclusao'], None),
+      ('ix_manutencoes_status', ['status'], None),
+      ('ix_manutencoes_tipo_manutencao', ['tipo_manutencao'], None),
+      ('ix_manutencoes_concluidas', ['id_equipamento', 'data_conclusao'], u"status = 'Concluída'"),
+      ('ix_manutencoes_abertas', ['data_abertura'], "status = 'Aberta'"),
+      ('ix_manutencoes_equipamento_abertura', ['id_equipamento', 'data_abertura'], None),
+      ('ix_manutencoes_agendadas', ['data_abertura'], "status = 'Agendada'")]),
+    ('contas', 'data_leitura',
+     ('contas_id_unidade_consumidora_fkey', 'id_unidade_consumidora', 'unidadesconsumidoras'),
+     [('ix_contas_data_leitura', ['data_leitura'], None),
+      ('ix_contas_unidade_leitura', ['id_unidade_consumidora', 'data_leitura'], None)])
+]
+
+# Visão do histórico de manutenções (depende da tabela "manutencoes")
+VISAO_HISTORICO_MANUTENCOES = """
+    CREATE VIEW historico_manutencoes AS
+        SELECT id, num_ordem_servico, id_equipamento, data_abertura, data_conclusao,
+               tipo_manutencao, descricao_servico, status, false AS arquivada
+        FROM manutencoes
+        UNION ALL
+        SELECT id, num_ordem_servico, id_equipamento, data_abertura, data_conclusao,
+               tipo_manutencao, descricao_servico, status, true AS arquivada
+        FROM manutencoes_arquivo
+"""
+
+
+# Recriação de uma tabela a partir da tabela antiga (renomeada), com as mesmas
+# colunas e valores padrão (inclusive a sequência dos ids), a chave primária e a
+# chave estrangeira dadas e, opcionalmente, o particionamento
+def recriar_tabela(tabela, antiga, chave_primaria, chave_estrangeira, particionamento=''):
+    nome_chave, coluna_chave, tabela_referenciada = chave_estrangeira
+
+    op.execute('ALTER TABLE %s RENAME TO %s' % (tabela, antiga))
+    op.execute('ALTER INDEX %s_pkey RENAME TO %s_pkey' % (tabela, antiga))
+
+    op.execute("""
+        CREATE TABLE %s (
+            LIKE %s INCLUDING DEFAULTS,
+            CONSTRAINT %s_pkey PRIMARY KEY (%s),
+            CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (id)
+        ) %s
+    """ % (tabela, antiga, tabela, ', '.join(chave_primaria),
+           nome_chave, coluna_chave, tabela_referenciada, particionamento))
+
+    # A sequência dos ids passa para a nova tabela (seria excluída com a antiga)
+    op.execute('ALTER SEQUENCE %s_id_seq OWNED BY %s.id' % (tabela, tabela))
+
+
+# Cópia das linhas da tabela antiga, sua exclusão e a criação dos índices
+def copiar_linhas(tabela, antiga, indices):
+    op.execute('INSERT INTO %s SELECT * FROM %s' % (tabela, antiga))
+    op.execute('DROP TABLE %s' % antiga)
+
+    for nome, colunas, condicao in indices:
+        if condicao is None:
+            op.create_index(nome, tabela, colunas, unique=False)
+        else:
+            op.create_index(nome, tabela, colunas, unique=False,
+                            postgresql_where=sa.text(condicao))
+
+    op.execute('ANALYZE %s' % tabela)
+
+
+def upgrade():
+    op.execute('DROP VIEW historico_manutencoes')
+
+    conexao = op.get_bind()
+    ano_atual = date.today().year
+
+    for tabela, coluna, chave_estrangeira, indices in TABELAS:
+        antiga = tabela + '_antiga'
+
+        recriar_tabela(tabela, antiga, ['id', coluna], chave_estrangeira,
+                       'PARTITION BY RANGE (%s)' % coluna)
+
+        # Partição padrão (datas sem partição própria) e partições de cada ano,
+        # do primeiro ano com dados até ANOS_FUTUROS anos à frente
+        op.execute('CREATE TABLE %s_padrao PARTITION OF %s DEFAULT' % (tabela, tabela))
+
+        primeiro_ano = conexao.execute('SELECT min(extract(year FROM %s)) FROM %s'
+                                       % (coluna, antiga)).scalar()
+
+        for ano in range(int(min(primeiro_ano or ano_atual, ano_atual)),
+                         ano_atual + ANOS_FUTUROS + 1):
+            op.execute("""CREATE TABLE %s_%d PARTITION OF %s
+                          FOR VALUES FROM ('%d-01-01') TO ('%d-01-01')"""
+                       % (tabela, ano, tabela, ano, ano + 1))
+
+        copiar_linhas(tabela, antiga, indices)
+
+    op.execute(VISAO_HISTORICO_MANUTENCOES)
+
+
+def downgrade():
+    op.execute('DROP VIEW historico_manutencoes')
+
+    for tabela, coluna, chave_estrangeira, indices in TABELAS:
+        antiga = tabela + '_particionada'
+
+        recriar_tabela(tabela, antiga, ['id'], chave_estrangeira)
+
+        # As partições são excluídas com a tabela particionada
+        copiar_linhas(tabela, antiga, indices)
+
+    op.execute(VISAO_HISTORICO_MANUTENCOES)
@@ -0,0 +1,35 @@
+# coding: utf-8
+"""Agenda de manutenções preventivas (manutenções com status Agendada)
+
+Revision ID: e2b94f6a1d03
+Revises: d7a35c0e8f61
+Create Date: 2017-07-14 09:42:51.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b94f6a1d03'
+down_revision = 'd7a35c0e8f61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Equipamentos sem "agenda_ate" (todos os existentes) têm a agenda gerada na
+    # primeira execução de "python launcher.py gerar_agenda"
+    op.add_column('equipamentos', sa.Column('agenda_desatualizada', sa.Boolean(), nullable=True))
+    op.add_column('equipamentos', sa.Column('agenda_ate', sa.Date(), nullable=True))
+    op.create_index(op.f('ix_equipamentos_agenda_desatualizada'), 'equipamentos', ['agenda_desatualizada'], unique=False)
+    op.create_index('ix_manutencoes_agendadas', 'manutencoes', ['data_abertura'], unique=False,
+                    postgresql_where=sa.text("status = 'Agendada'"))
+
+
+def downgrade():
+    op.execute("DELETE FROM manutencoes WHERE status = 'Agendada'")
+    op.drop_index('ix_manutencoes_agendadas', table_name='manutencoes')
+    op.drop_index(op.f('ix_equipamentos_agenda_desatualizada'), table_name='equipamentos')
+    op.drop_column('equipamentos', 'agenda_ate')
+    op.drop_column('equipamentos', 'agenda_desatualizada')
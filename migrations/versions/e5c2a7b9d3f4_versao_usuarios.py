@@ -0,0 +1,27 @@
+# coding: utf-8
+"""Versão dos usuários (cache do usuário da sessão)
+
+Revision ID: e5c2a7b9d3f4
+Revises: d9b3f6a2e8c1
+Create Date: 2017-08-16 15:42:08.273915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c2a7b9d3f4'
+down_revision = 'd9b3f6a2e8c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('usuarios', sa.Column('versao', sa.Integer(), nullable=True))
+    op.execute('UPDATE usuarios SET versao = 1')
+    op.alter_column('usuarios', 'versao', nullable=False)
+
+
+def downgrade():
+    op.drop_column('usuarios', 'versao')
@@ -0,0 +1,45 @@
+# coding: utf-8
+"""Caixa de saída de emails
+
+Revision ID: f1a9c3e7b5d2
+Revises: e5c2a7b9d3f4
+Create Date: 2017-08-22 11:06:47.915384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a9c3e7b5d2'
+down_revision = 'e5c2a7b9d3f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('caixa_saida',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('remetente', sa.String(length=128), nullable=False),
+    sa.Column('destinatarios', sa.Text(), nullable=False),
+    sa.Column('assunto', sa.String(length=256), nullable=False),
+    sa.Column('corpo', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('chave', sa.String(length=40), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('tentativas', sa.Integer(), nullable=False),
+    sa.Column('proxima_tentativa', sa.DateTime(), nullable=False),
+    sa.Column('criada_em', sa.DateTime(), nullable=False),
+    sa.Column('enviada_em', sa.DateTime(), nullable=True),
+    sa.Column('erro', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_caixa_saida_chave'), 'caixa_saida', ['chave'], unique=False)
+    op.create_index('ix_caixa_saida_pendentes', 'caixa_saida', ['proxima_tentativa'], unique=False,
+                    postgresql_where=sa.text("status = 'Pendente'"))
+
+
+def downgrade():
+    op.drop_index('ix_caixa_saida_pendentes', table_name='caixa_saida')
+    op.drop_index(op.f('ix_caixa_saida_chave'), table_name='caixa_saida')
+    op.drop_table('caixa_saida')
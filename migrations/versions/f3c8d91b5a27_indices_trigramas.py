@@ -0,0 +1,43 @@
+# coding: utf-8
+"""Índices de trigramas das buscas dos campos de seleção
+
+Revision ID: f3c8d91b5a27
+Revises: e2b94f6a1d03
+Create Date: 2017-07-24 10:12:41.530218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d91b5a27'
+down_revision = 'e2b94f6a1d03'
+branch_labels = None
+depends_on = None
+
+
+# (nome do índice, tabela, coluna)
+INDICES = [
+    ('ix_usuarios_nome_trgm', 'usuarios', 'nome'),
+    ('ix_usuarios_email_trgm', 'usuarios', 'email'),
+    ('ix_blocos_nome_trgm', 'blocos', 'nome'),
+    ('ix_ambientes_nome_trgm', 'ambientes', 'nome'),
+    ('ix_ambientes_caminho_local_trgm', 'ambientes', 'caminho_local'),
+    ('ix_equipamentos_tipo_trgm', 'equipamentos', 'tipo_equipamento'),
+    ('ix_equipamentos_caminho_local_trgm', 'equipamentos', 'caminho_local'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for nome, tabela, coluna in INDICES:
+        op.create_index(nome, tabela, [coluna], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={coluna: 'gin_trgm_ops'})
+
+
+def downgrade():
+    for nome, tabela, coluna in reversed(INDICES):
+        op.drop_index(nome, table_name=tabela)